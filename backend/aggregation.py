@@ -0,0 +1,184 @@
+"""Industry/sector aggregation of a processed snapshot.
+
+aggregate_snapshot() computes, in memory, the same rows the SQL in AGGREGATION_SELECT_SQL produces from
+the history table, so ingest can bulk-load them instead of re-scanning history in BigQuery.
+The SQL stays the reference definition (fallback rebuild, backfills, verify_aggregation.py).
+"""
+import numpy as np
+import pandas as pd
+
+from history_schema import market_cap_sql, number_sql
+
+AGGREGATION_COLUMNS = [
+    'snapshot_id', 'processed_at', 'is_current', 'name', 'parent_sector',
+    'change', 'week', 'month', 'quarter', 'rsi', 'momentum',
+    'changeEqual', 'weekEqual', 'monthEqual', 'quarterEqual', 'rsiEqual', 'momentumEqual',
+    'marketCap', 'stockCount', 'topStocks',
+]
+
+# group column -> parent_sector expression for each aggregation level
+LEVELS = {
+    'industry': "ANY_VALUE(sector) as parent_sector",
+    'sector': "CAST(NULL as STRING) as parent_sector",
+}
+
+TOP_STOCKS_LIMIT = 5
+
+# The aggregation SQL runs on BigQuery and, for the local storage backend, on DuckDB.
+DIALECTS = {
+    'bigquery': {
+        'quote': '`',
+        'safe_cast': 'SAFE_CAST',
+        'float': 'FLOAT64',
+        'top_stocks': f"ARRAY_AGG(STRUCT(ticker, pct_week as week) IGNORE NULLS ORDER BY pct_week DESC LIMIT {TOP_STOCKS_LIMIT})",
+    },
+    'duckdb': {
+        'quote': '"',
+        'safe_cast': 'TRY_CAST',
+        'float': 'DOUBLE',
+        'top_stocks': f"list_slice(ARRAY_AGG({{'ticker': ticker, 'week': pct_week}} ORDER BY pct_week DESC NULLS LAST), 1, {TOP_STOCKS_LIMIT})",
+    },
+}
+
+def quote_table(table, dialect='bigquery'):
+    quote = DIALECTS[dialect]['quote']
+    return f"{quote}{table}{quote}"
+
+RAW_DATA_CTE_SQL = """
+    WITH raw_data AS (
+        SELECT
+            industry, sector, processed_at, {is_current_col}ticker,
+            {performance_week} as pct_week,
+            {performance_month} as pct_month,
+            {performance_quarter} as pct_quarter,
+            {change} as pct_change,
+            {relative_strength_index_14} as rsi,
+            {market_cap} as mcap
+        FROM {raw_table}
+        {where}
+    )
+"""
+
+AGGREGATION_SELECT_SQL = """
+    SELECT
+        CAST(processed_at AS STRING) as snapshot_id, MAX(processed_at) as processed_at, {is_current_select}
+        {group_col} as name, {parent_sector},
+        SUM(pct_change * mcap) / NULLIF(SUM(mcap), 0) as change,
+        SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0) as week,
+        SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0) as month,
+        SUM(pct_quarter * mcap) / NULLIF(SUM(mcap), 0) as quarter,
+        SUM(rsi * mcap) / NULLIF(SUM(mcap), 0) as rsi,
+        (SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0)) - ((SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0)) / 4) as momentum,
+        AVG(pct_change) as changeEqual, AVG(pct_week) as weekEqual, AVG(pct_month) as monthEqual, AVG(pct_quarter) as quarterEqual, AVG(rsi) as rsiEqual, AVG(pct_week) - (AVG(pct_month) / 4) as momentumEqual,
+        SUM(mcap) as marketCap, COUNT(*) as stockCount,
+        {top_stocks} as topStocks
+    FROM raw_data
+    WHERE {group_col} IS NOT NULL
+    GROUP BY CAST(processed_at AS STRING), {group_by_extra}{group_col}
+"""
+
+def aggregation_sql(raw_table, level, where='', is_current='carry', dialect='bigquery', schema_version=None):
+    """SELECT producing the aggregation rows for `level` ('industry' or 'sector') from the history table.
+
+    is_current='carry' keeps each row's flag (full rebuild), 'yes' marks every row current (aggregating the
+    current snapshot) and None leaves the column out (append-only tables behind the snapshot pointer).
+    schema_version (default HISTORY_SCHEMA_VERSION) is the history layout, see history_schema.py."""
+    sql_dialect = DIALECTS[dialect]
+    cast = {'version': schema_version, 'safe_cast': sql_dialect['safe_cast'], 'float_type': sql_dialect['float']}
+    cte = RAW_DATA_CTE_SQL.format(
+        raw_table=quote_table(raw_table, dialect),
+        **{column: number_sql(column, **cast) for column in
+           ['performance_week', 'performance_month', 'performance_quarter', 'change', 'relative_strength_index_14']},
+        market_cap=market_cap_sql(**cast),
+        where=where,
+        is_current_col='is_current, ' if is_current == 'carry' else '',
+    )
+    if is_current == 'carry':
+        is_current_select = 'is_current as is_current,'
+    elif is_current is None:
+        is_current_select = ''
+    else:
+        is_current_select = f"'{is_current}' as is_current,"
+    select = AGGREGATION_SELECT_SQL.format(
+        group_col=level,
+        parent_sector=LEVELS[level],
+        is_current_select=is_current_select,
+        group_by_extra='is_current, ' if is_current == 'carry' else '',
+        top_stocks=sql_dialect['top_stocks'],
+    )
+    return cte + select
+
+def rebuild_sql(raw_table, table, level, pointer_mode=False):
+    """CREATE OR REPLACE statement rebuilding a whole aggregation table from history."""
+    if pointer_mode:
+        return f"""CREATE OR REPLACE TABLE `{table}` PARTITION BY DATE(processed_at) AS
+            {aggregation_sql(raw_table, level, is_current=None)}"""
+    return f"CREATE OR REPLACE TABLE `{table}` AS {aggregation_sql(raw_table, level)}"
+
+def format_snapshot_id(processed_at, field_type='DATETIME'):
+    """Mirrors BigQuery's CAST(processed_at AS STRING) for a whole-second timestamp."""
+    text = pd.Timestamp(processed_at).strftime('%Y-%m-%d %H:%M:%S')
+    return f"{text}+00" if field_type == 'TIMESTAMP' else text
+
+def _snapshot_inputs(df):
+    """The typed per-ticker inputs of the aggregation (the raw_data CTE)."""
+    return pd.DataFrame({
+        'industry': df['industry'],
+        'sector': df['sector'],
+        'ticker': df['ticker'],
+        'pct_change': pd.to_numeric(df['change'], errors='coerce'),
+        'pct_week': pd.to_numeric(df['performance_week'], errors='coerce'),
+        'pct_month': pd.to_numeric(df['performance_month'], errors='coerce'),
+        'pct_quarter': pd.to_numeric(df['performance_quarter'], errors='coerce'),
+        'rsi': pd.to_numeric(df['relative_strength_index_14'], errors='coerce'),
+        'mcap': pd.to_numeric(df['market_cap'], errors='coerce') * 1000000,
+    }, index=df.index)
+
+def _top_stocks(frame, group_col):
+    """Top tickers by weekly performance per group, NULL weeks last (ARRAY_AGG ... ORDER BY pct_week DESC LIMIT 5)."""
+    ranked = frame.sort_values([group_col, 'pct_week'], ascending=[True, False], na_position='last', kind='stable')
+    top = ranked.groupby(group_col, sort=False).head(TOP_STOCKS_LIMIT)
+    weeks = top['pct_week'].astype(object).where(top['pct_week'].notna(), None)
+    records = pd.Series([{'ticker': t, 'week': w} for t, w in zip(top['ticker'], weeks)], index=top.index)
+    return records.groupby(top[group_col], sort=False).agg(list)
+
+def aggregate_snapshot(df, level, processed_at, snapshot_id, is_current='yes'):
+    """Aggregates one normalized, typed snapshot frame to `level` ('industry' or 'sector').
+
+    Matches AGGREGATION_SELECT_SQL: cap-weighted averages ignore rows where the metric is NULL in the
+    numerator but not in the denominator, equal-weighted averages ignore NULLs and stockCount counts all rows.
+    is_current=None leaves the is_current column out."""
+    frame = _snapshot_inputs(df)
+    frame = frame[frame[level].notna()]
+    columns = [c for c in AGGREGATION_COLUMNS if c != 'is_current' or is_current is not None]
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+
+    metrics = {'change': 'pct_change', 'week': 'pct_week', 'month': 'pct_month', 'quarter': 'pct_quarter', 'rsi': 'rsi'}
+    weighted_cols = []
+    for name, col in metrics.items():
+        frame[f'w_{name}'] = frame[col] * frame['mcap']
+        weighted_cols.append(f'w_{name}')
+
+    grouped = frame.groupby(level, sort=True)
+    sums = grouped[weighted_cols + ['mcap']].sum(min_count=1)
+    means = grouped[list(metrics.values())].mean()
+    cap = sums['mcap'].where(sums['mcap'] != 0)
+
+    out = pd.DataFrame(index=sums.index)
+    out['snapshot_id'] = snapshot_id
+    out['processed_at'] = processed_at
+    if is_current is not None:
+        out['is_current'] = is_current
+    out['name'] = sums.index
+    out['parent_sector'] = grouped['sector'].first() if level == 'industry' else None
+    for name in metrics:
+        out[name] = sums[f'w_{name}'] / cap
+    out['momentum'] = out['week'] - out['month'] / 4
+    for name, col in metrics.items():
+        out[f'{name}Equal'] = means[col]
+    out['momentumEqual'] = out['weekEqual'] - out['monthEqual'] / 4
+    out['marketCap'] = sums['mcap']
+    out['stockCount'] = grouped.size().astype(np.int64)
+    out['topStocks'] = _top_stocks(frame, level)
+    return out[columns].reset_index(drop=True)
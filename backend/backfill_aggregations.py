@@ -1,7 +1,34 @@
+"""Backfills the industry and sector aggregation tables from processed_stock_data_history.
+
+By default only the snapshots missing from an aggregation table are computed, in parallel batches of
+INSERT ... SELECT jobs. Progress is checkpointed to a local file so an interrupted run resumes where it
+stopped (jobs still running or already finished server-side are not re-run; failed ones are). --full rebuilds both tables
+from scratch as before.
+
+    python backfill_aggregations.py [--since 2026-01-01] [--until 2026-02-01] [--workers 4] [--batch-size 20]
+    python backfill_aggregations.py --full
+"""
+import argparse
+import contextvars
+import json
+import logging
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+import run_metrics
+from aggregation import AGGREGATION_COLUMNS, aggregation_sql, rebuild_sql
+from snapshots import table_names
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.backfill_checkpoint.json')
+
 def get_credentials():
     env_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env.local')
     env_vars = {}
@@ -30,120 +57,186 @@ def get_credentials():
     
     return project_id, credentials
 
-def backfill():
+def _targets(project_id, dataset_id, base_table_name, snapshot_mode):
+    """(raw_table, {level: aggregation table}, is_current mode) for the given snapshot mode."""
+    tables = table_names(project_id, dataset_id, base_table_name)
+    if snapshot_mode == 'pointer':
+        return tables['history_data'], {'industry': tables['industry_data'], 'sector': tables['sector_data']}, None
+    return tables['history'], {'industry': tables['industry'], 'sector': tables['sector']}, 'carry'
+
+def _range_filter(since=None, until=None):
+    """WHERE conditions on processed_at (since inclusive, until exclusive) and their query parameters."""
+    # The DATE() conditions are redundant but let BigQuery prune partitions of the `_data` tables.
+    conditions, params = [], []
+    if since:
+        conditions.append("DATE(processed_at) >= DATE(SUBSTR(@since, 1, 10)) AND CAST(processed_at AS STRING) >= @since")
+        params.append(bigquery.ScalarQueryParameter('since', 'STRING', since))
+    if until:
+        conditions.append("DATE(processed_at) <= DATE(SUBSTR(@until, 1, 10)) AND CAST(processed_at AS STRING) < @until")
+        params.append(bigquery.ScalarQueryParameter('until', 'STRING', until))
+    return conditions, params
+
+def find_missing_snapshots(client, raw_table, table, since=None, until=None):
+    """Sorted snapshot_ids that exist in history but not in the aggregation table."""
+    conditions, params = _range_filter(since, until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"""
+        SELECT DISTINCT CAST(processed_at AS STRING) as snapshot_id FROM `{raw_table}` {where}
+        EXCEPT DISTINCT
+        SELECT DISTINCT snapshot_id FROM `{table}` {where}
+    """
+    rows = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result()
+    return sorted(row.snapshot_id for row in rows)
+
+def _insert_batch_sql(raw_table, table, level, is_current):
+    columns = [c for c in AGGREGATION_COLUMNS if c != 'is_current' or is_current is not None]
+    return f"""
+        INSERT INTO `{table}` ({', '.join(columns)})
+        {aggregation_sql(raw_table, level, where="WHERE CAST(processed_at AS STRING) IN UNNEST(@snapshot_ids)", is_current=is_current)}
+    """
+
+class Checkpoint:
+    """Plan and progress of an incremental backfill, persisted as JSON after every change."""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.lock = threading.Lock()
+        self.state = {'key': key, 'levels': {}}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('key') == key:
+                self.state = saved
+                logger.info(f"Resuming backfill from checkpoint {path}")
+            else:
+                logger.warning(f"Ignoring checkpoint {path}: it was written for different arguments.")
+
+    def batches(self, level):
+        return self.state['levels'].get(level, {}).get('batches')
+
+    def plan(self, level, batches):
+        with self.lock:
+            self.state['levels'][level] = {'batches': batches, 'done': [], 'jobs': {}}
+            self._save()
+
+    def job_id(self, level, index):
+        return self.state['levels'][level]['jobs'].get(str(index))
+
+    def started(self, level, index, job_id):
+        with self.lock:
+            self.state['levels'][level]['jobs'][str(index)] = job_id
+            self._save()
+
+    def is_done(self, level, index):
+        return index in self.state['levels'][level]['done']
+
+    def done(self, level, index):
+        with self.lock:
+            self.state['levels'][level]['done'].append(index)
+            self._save()
+
+    def finish(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+def _reattach(client, job_id):
+    """True if the job a previous run started for a batch finished successfully. A job that was never
+    created (NotFound) or that failed means the batch has to run again."""
+    try:
+        job = client.get_job(job_id)
+        job.result()
+    except NotFound:
+        logger.warning(f"Job {job_id} from the checkpoint does not exist; re-running its batch.")
+        return False
+    except Exception as e:
+        logger.warning(f"Job {job_id} from the checkpoint failed ({e}); re-running its batch.")
+        return False
+    run_metrics.record_job(job)
+    return job.error_result is None
+
+def _run_batch(client, checkpoint, level, index, snapshot_ids, sql):
+    """Runs one batch, re-attaching to its job if a previous run already started it."""
+    job_id = checkpoint.job_id(level, index)
+    if job_id and _reattach(client, job_id):
+        checkpoint.done(level, index)
+        return len(snapshot_ids)
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter('snapshot_ids', 'STRING', snapshot_ids),
+    ])
+    job = client.query(sql, job_config=job_config, job_id=f"backfill_{level}_{uuid.uuid4().hex}")
+    # Recorded only once the job exists, so a resume never looks up a job that was never created.
+    checkpoint.started(level, index, job.job_id)
+    job.result()
+    run_metrics.record_job(job)
+    checkpoint.done(level, index)
+    return len(snapshot_ids)
+
+def backfill_missing_snapshots(client, raw_table, level_tables, is_current, since=None, until=None,
+                               batch_size=20, workers=4, checkpoint=None):
+    """Aggregates only the snapshots missing from each aggregation table. Returns {level: snapshots added}."""
+    checkpoint = checkpoint or Checkpoint(None, None)
+    added = {}
+    for level, table in level_tables.items():
+        batches = checkpoint.batches(level)
+        if batches is None:
+            missing = find_missing_snapshots(client, raw_table, table, since, until)
+            batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+            checkpoint.plan(level, batches)
+        pending = [i for i in range(len(batches)) if not checkpoint.is_done(level, i)]
+        logger.info(f"{level}: {sum(len(b) for b in batches)} missing snapshots in {len(batches)} batches, {len(pending)} pending.")
+
+        sql = _insert_batch_sql(raw_table, table, level, is_current)
+        added[level] = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # Copied contexts keep the jobs attributed to the current run (when called from the pipeline).
+            futures = [executor.submit(contextvars.copy_context().run, _run_batch, client, checkpoint, level, i, batches[i], sql)
+                       for i in pending]
+            for future in as_completed(futures):
+                added[level] += future.result()
+                logger.info(f"{level}: {added[level]} snapshots backfilled")
+    return added
+
+def backfill(since=None, until=None, full=False, batch_size=20, workers=4, checkpoint_path=DEFAULT_CHECKPOINT,
+             snapshot_mode=None, dataset_id='stock_data', base_table_name='processed_stock_data'):
     project_id, credentials = get_credentials()
     client = bigquery.Client(project=project_id, credentials=credentials)
+    snapshot_mode = snapshot_mode or os.environ.get('SNAPSHOT_MODE', 'flag')
+    raw_table, level_tables, is_current = _targets(project_id, dataset_id, base_table_name, snapshot_mode)
     
     print(f"Connected to BigQuery project {project_id}")
     
-    # Industry Table
-    query_industry = f"""
-    CREATE OR REPLACE TABLE `{project_id}.stock_data.processed_stock_data_industry_history` AS
-    WITH raw_data AS (
-        SELECT
-            industry,
-            sector,
-            processed_at,
-            is_current,
-            SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week,
-            SAFE_CAST(REPLACE(performance_month, '%', '') AS FLOAT64) as pct_month,
-            SAFE_CAST(REPLACE(performance_quarter, '%', '') AS FLOAT64) as pct_quarter,
-            SAFE_CAST(REPLACE(change, '%', '') AS FLOAT64) as pct_change,
-            SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-            SAFE_CAST(market_cap AS FLOAT64) * 1000000 as mcap,
-            ticker
-        FROM `{project_id}.stock_data.processed_stock_data_history`
-    )
-    SELECT
-        CAST(processed_at AS STRING) as snapshot_id,
-        MAX(processed_at) as processed_at,
-        is_current,
-        industry as name,
-        ANY_VALUE(sector) as parent_sector,
-        -- Market-Cap Weighted
-        SUM(pct_change * mcap) / NULLIF(SUM(mcap), 0) as change,
-        SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0) as week,
-        SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0) as month,
-        SUM(pct_quarter * mcap) / NULLIF(SUM(mcap), 0) as quarter,
-        SUM(rsi * mcap) / NULLIF(SUM(mcap), 0) as rsi,
-        (SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0)) - ((SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0)) / 4) as momentum,
-        -- Equal Weighted
-        AVG(pct_change) as changeEqual,
-        AVG(pct_week) as weekEqual,
-        AVG(pct_month) as monthEqual,
-        AVG(pct_quarter) as quarterEqual,
-        AVG(rsi) as rsiEqual,
-        AVG(pct_week) - (AVG(pct_month) / 4) as momentumEqual,
-
-        SUM(mcap) as marketCap,
-        COUNT(*) as stockCount,
-
-        -- Top Drivers
-        ARRAY_AGG(
-            STRUCT(ticker, pct_week as week) IGNORE NULLS ORDER BY pct_week DESC LIMIT 5
-        ) as topStocks
-    FROM raw_data
-    WHERE industry IS NOT NULL
-    GROUP BY CAST(processed_at AS STRING), is_current, industry;
-    """
-    
-    print("Creating Industry aggregated table...")
-    client.query(query_industry).result()
-    print("Success.")
-    
-    # Sector Table
-    query_sector = f"""
-    CREATE OR REPLACE TABLE `{project_id}.stock_data.processed_stock_data_sector_history` AS
-    WITH raw_data AS (
-        SELECT
-            sector,
-            processed_at,
-            is_current,
-            SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week,
-            SAFE_CAST(REPLACE(performance_month, '%', '') AS FLOAT64) as pct_month,
-            SAFE_CAST(REPLACE(performance_quarter, '%', '') AS FLOAT64) as pct_quarter,
-            SAFE_CAST(REPLACE(change, '%', '') AS FLOAT64) as pct_change,
-            SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-            SAFE_CAST(market_cap AS FLOAT64) * 1000000 as mcap,
-            ticker
-        FROM `{project_id}.stock_data.processed_stock_data_history`
-    )
-    SELECT
-        CAST(processed_at AS STRING) as snapshot_id,
-        MAX(processed_at) as processed_at,
-        is_current,
-        sector as name,
-        CAST(NULL as STRING) as parent_sector,
-        -- Market-Cap Weighted
-        SUM(pct_change * mcap) / NULLIF(SUM(mcap), 0) as change,
-        SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0) as week,
-        SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0) as month,
-        SUM(pct_quarter * mcap) / NULLIF(SUM(mcap), 0) as quarter,
-        SUM(rsi * mcap) / NULLIF(SUM(mcap), 0) as rsi,
-        (SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0)) - ((SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0)) / 4) as momentum,
-        -- Equal Weighted
-        AVG(pct_change) as changeEqual,
-        AVG(pct_week) as weekEqual,
-        AVG(pct_month) as monthEqual,
-        AVG(pct_quarter) as quarterEqual,
-        AVG(rsi) as rsiEqual,
-        AVG(pct_week) - (AVG(pct_month) / 4) as momentumEqual,
-
-        SUM(mcap) as marketCap,
-        COUNT(*) as stockCount,
-
-        -- Top Drivers
-        ARRAY_AGG(
-            STRUCT(ticker, pct_week as week) IGNORE NULLS ORDER BY pct_week DESC LIMIT 5
-        ) as topStocks
-    FROM raw_data
-    WHERE sector IS NOT NULL
-    GROUP BY CAST(processed_at AS STRING), is_current, sector;
-    """
-    
-    print("Creating Sector aggregated table...")
-    client.query(query_sector).result()
-    print("Success.")
+    if full:
+        for level, table in level_tables.items():
+            print(f"Creating {level} aggregated table...")
+            client.query(rebuild_sql(raw_table, table, level, pointer_mode=snapshot_mode == 'pointer')).result()
+            print("Success.")
+        return
+
+    checkpoint = Checkpoint(checkpoint_path, [since, until, snapshot_mode, dataset_id, base_table_name, batch_size])
+    added = backfill_missing_snapshots(client, raw_table, level_tables, is_current, since, until,
+                                       batch_size=batch_size, workers=workers, checkpoint=checkpoint)
+    checkpoint.finish()
+    print(f"Success. Backfilled {added}.")
 
 if __name__ == '__main__':
-    backfill()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--since', help="only snapshots with processed_at >= this (e.g. 2026-01-01)")
+    parser.add_argument('--until', help="only snapshots with processed_at < this")
+    parser.add_argument('--full', action='store_true', help="rebuild both tables from scratch (CREATE OR REPLACE)")
+    parser.add_argument('--batch-size', type=int, default=20, help="snapshots per INSERT job")
+    parser.add_argument('--workers', type=int, default=4, help="INSERT jobs running in parallel")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="progress file used to resume")
+    parser.add_argument('--snapshot-mode', choices=['flag', 'pointer'], help="defaults to $SNAPSHOT_MODE or 'flag'")
+    args = parser.parse_args()
+    backfill(since=args.since, until=args.until, full=args.full, batch_size=args.batch_size, workers=args.workers,
+             checkpoint_path=args.checkpoint, snapshot_mode=args.snapshot_mode)
@@ -0,0 +1,247 @@
+"""Vectorized backtests of the Bollinger and volatility screens over the whole history.
+
+The dashboard backtests (getBollingerBacktest / getVolatilityBacktest in lib/finviz.ts) compare one
+signal date with the current snapshot, one BigQuery query per comparison. Here the last `--days`
+trading days (from the trading calendar, see trading_calendar.py) are loaded once into dense
+ticker × trading-day matrices of price, RSI, daily change and market cap. Every parameter set is then
+evaluated on every signal date and holding period with array operations. Parameter sets run in a
+process pool.
+
+- bollinger: RSI below `rsi_threshold` and price outside the `period`-day SMA ± `width` × stddev
+  (at least period/2 prices in the window, like the dashboard).
+- volatility: the `top_n` tickers by average absolute daily change over `lookback` trading days.
+
+Returns are measured over `hold` trading days, in percent. Excess returns are relative to SPY when the
+history has it. Otherwise, like the dashboard, they are relative to the market-cap weighted return of
+every ticker. One summary row per strategy, parameter set and holding period is appended to
+`<base>_backtest_results`:
+
+    python backtest.py --days 250 --rsi 20 25 30 35 --lookbacks 5 10 20 --holds 1 5 10 20
+"""
+import argparse
+import itertools
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import BQ_TABLE_BASE
+from history_schema import from_storage_layout
+from trading_calendar import calendar_table
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_TICKER = 'SPY'
+MATRIX_COLUMNS = {
+    'price': 'price',
+    'rsi': 'relative_strength_index_14',
+    'change': 'change',
+    'market_cap': 'market_cap',
+}
+RESULT_COLUMNS = [
+    'run_id', 'computed_at', 'strategy', 'rsi_threshold', 'period', 'width', 'lookback', 'top_n', 'hold_days',
+    'benchmark', 'first_signal_date', 'last_signal_date', 'signal_dates', 'signals', 'avg_return_pct',
+    'median_return_pct', 'avg_benchmark_return_pct', 'avg_excess_return_pct', 'median_excess_return_pct',
+    'hit_rate',
+]
+
+def results_table(base_table_name=BQ_TABLE_BASE):
+    return f"{base_table_name}_backtest_results"
+
+class Matrices:
+    """Ticker × trading-day float matrices (NaN where a ticker has no value that day)."""
+
+    def __init__(self, tickers, trading_days, **series):
+        self.tickers = np.asarray(tickers, dtype=object)
+        self.trading_days = pd.DatetimeIndex(trading_days)
+        self.series = series
+
+    def __getitem__(self, name):
+        return self.series[name]
+
+    @classmethod
+    def from_frame(cls, frame):
+        """From long rows (processed_at, ticker and the MATRIX_COLUMNS, storage layout)."""
+        frame = from_storage_layout(frame).drop_duplicates(['processed_at', 'ticker'])
+        tickers = np.sort(frame['ticker'].unique())
+        trading_days = np.sort(frame['processed_at'].unique())
+        rows = np.searchsorted(tickers, frame['ticker'].to_numpy())
+        cols = np.searchsorted(trading_days, frame['processed_at'].to_numpy())
+        series = {}
+        for name, column in MATRIX_COLUMNS.items():
+            matrix = np.full((len(tickers), len(trading_days)), np.nan)
+            matrix[rows, cols] = pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype='float64')
+            series[name] = matrix
+        # Absolute dollars, like the aggregation tables (history stores millions).
+        series['market_cap'] *= 1e6
+        return cls(tickers, trading_days, **series)
+
+def load_matrices(storage, days, base_table_name=BQ_TABLE_BASE):
+    """The last `days` trading days of history as Matrices."""
+    history = storage.ref(f"{base_table_name}_history")
+    calendar = storage.ref(calendar_table(base_table_name))
+    frame = storage.query(f"""
+        WITH days AS (
+            SELECT processed_at FROM {calendar}
+            WHERE is_trading_day
+            ORDER BY trading_day_ordinal DESC LIMIT @days
+        )
+        SELECT h.processed_at, h.ticker, {', '.join(f'h.{c}' for c in MATRIX_COLUMNS.values())}
+        FROM {history} h JOIN days d ON h.processed_at = d.processed_at
+        WHERE h.ticker IS NOT NULL
+    """, {'days': days})
+    if frame.empty:
+        raise RuntimeError(f"No trading days found in {calendar}; run trading_calendar.py --rebuild first.")
+    return Matrices.from_frame(frame)
+
+def rolling_stats(matrix, window, min_count):
+    """Mean and sample stddev of each ticker's last `window` trading days at every date (NaNs skipped,
+    NaN where fewer than `min_count` values)."""
+    valid = ~np.isnan(matrix)
+    values = np.where(valid, matrix, 0.0)
+    pad = np.zeros((matrix.shape[0], 1))
+    sums = np.concatenate([pad, np.cumsum(values, axis=1)], axis=1)
+    squares = np.concatenate([pad, np.cumsum(values ** 2, axis=1)], axis=1)
+    counts = np.concatenate([pad, np.cumsum(valid, axis=1)], axis=1)
+    start = np.maximum(np.arange(1, matrix.shape[1] + 1) - window, 0)
+    end = np.arange(1, matrix.shape[1] + 1)
+    n = counts[:, end] - counts[:, start]
+    total = sums[:, end] - sums[:, start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        variance = (squares[:, end] - squares[:, start] - n * mean ** 2) / (n - 1)
+        stddev = np.sqrt(np.maximum(variance, 0.0))
+    too_few = n < max(2, min_count)
+    mean[too_few] = np.nan
+    stddev[too_few] = np.nan
+    return mean, stddev
+
+def forward_returns(price, hold):
+    """Percent return from each trading day to `hold` trading days later (NaN past the end)."""
+    returns = np.full(price.shape, np.nan)
+    if hold < price.shape[1]:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns[:, :-hold] = (price[:, hold:] / price[:, :-hold] - 1) * 100
+    returns[~(price > 0)] = np.nan
+    return returns
+
+def benchmark_returns(matrices, returns):
+    """Per-date benchmark return: SPY if present, else the market-cap weighted return of all tickers."""
+    spy = np.flatnonzero(matrices.tickers == BENCHMARK_TICKER)
+    if len(spy):
+        return returns[spy[0]], BENCHMARK_TICKER
+    weights = np.where(np.isnan(returns), np.nan, matrices['market_cap'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        market = np.nansum(returns * weights, axis=0) / np.nansum(weights, axis=0)
+    return market, 'market_cap_weighted'
+
+def bollinger_signals(matrices, rsi_threshold, period, width):
+    price = matrices['price']
+    sma, stddev = rolling_stats(price, period, period // 2)
+    with np.errstate(invalid='ignore'):
+        outside = (price < sma - width * stddev) | (price > sma + width * stddev)
+        return outside & (matrices['rsi'] < rsi_threshold)
+
+def volatility_signals(matrices, lookback, top_n):
+    change = matrices['change']
+    atr, _ = rolling_stats(np.abs(change), lookback, max(1, lookback // 2))
+    atr[~(matrices['price'] > 0)] = np.nan
+    # Rank per date, most volatile first; NaN sorts last.
+    order = np.argsort(np.where(np.isnan(atr), np.inf, -atr), axis=0, kind='stable')
+    signals = np.zeros(atr.shape, dtype=bool)
+    np.put_along_axis(signals, order[:top_n], True, axis=0)
+    return signals & ~np.isnan(atr)
+
+def summarize(matrices, signals, holds):
+    """Summary rows per holding period of the events in `signals`."""
+    rows = []
+    for hold in holds:
+        returns = forward_returns(matrices['price'], hold)
+        benchmark, name = benchmark_returns(matrices, returns)
+        events = signals & ~np.isnan(returns) & ~np.isnan(benchmark)[None, :]
+        event_returns = returns[events]
+        excess = event_returns - np.broadcast_to(benchmark, returns.shape)[events]
+        dates = np.flatnonzero(events.any(axis=0))
+        rows.append({
+            'hold_days': hold,
+            'benchmark': name,
+            'first_signal_date': matrices.trading_days[dates[0]] if len(dates) else pd.NaT,
+            'last_signal_date': matrices.trading_days[dates[-1]] if len(dates) else pd.NaT,
+            'signal_dates': len(dates),
+            'signals': int(events.sum()),
+            'avg_return_pct': event_returns.mean() if len(event_returns) else np.nan,
+            'median_return_pct': np.median(event_returns) if len(event_returns) else np.nan,
+            'avg_benchmark_return_pct': benchmark[dates].mean() if len(dates) else np.nan,
+            'avg_excess_return_pct': excess.mean() if len(excess) else np.nan,
+            'median_excess_return_pct': np.median(excess) if len(excess) else np.nan,
+            'hit_rate': (excess > 0).mean() if len(excess) else np.nan,
+        })
+    return rows
+
+def parameter_sets(rsi_thresholds, periods, widths, lookbacks, top_ns):
+    sets = [{'strategy': 'bollinger', 'rsi_threshold': rsi, 'period': period, 'width': width}
+            for rsi, period, width in itertools.product(rsi_thresholds, periods, widths)]
+    sets += [{'strategy': 'volatility', 'lookback': lookback, 'top_n': top_n}
+             for lookback, top_n in itertools.product(lookbacks, top_ns)]
+    return sets
+
+_matrices = None
+
+def _init_worker(matrices):
+    global _matrices
+    _matrices = matrices
+
+def evaluate(params, holds, matrices=None):
+    """Summary rows of one parameter set (in a pool worker, on the matrices passed to _init_worker)."""
+    matrices = matrices or _matrices
+    options = {k: v for k, v in params.items() if k != 'strategy'}
+    if params['strategy'] == 'bollinger':
+        signals = bollinger_signals(matrices, **options)
+    else:
+        signals = volatility_signals(matrices, **options)
+    return [{**params, **row} for row in summarize(matrices, signals, holds)]
+
+def run(matrices, sets, holds, workers=None):
+    """Evaluates every parameter set, in a process pool unless workers == 1. Returns the results frame."""
+    if workers == 1:
+        rows = [row for params in sets for row in evaluate(params, holds, matrices)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matrices,)) as pool:
+            rows = [row for result in pool.map(evaluate, sets, itertools.repeat(holds)) for row in result]
+    results = pd.DataFrame(rows)
+    results.insert(0, 'run_id', uuid.uuid4().hex)
+    results.insert(1, 'computed_at', pd.Timestamp.now(tz='UTC'))
+    return results.reindex(columns=RESULT_COLUMNS).astype({
+        'rsi_threshold': 'float64', 'period': 'Int64', 'width': 'float64', 'lookback': 'Int64', 'top_n': 'Int64',
+        'hold_days': 'int64', 'signal_dates': 'int64', 'signals': 'int64',
+    })
+
+if __name__ == '__main__':
+    from storage_backends import script_backend
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=250, help="trading days of history to load")
+    parser.add_argument('--rsi', type=float, nargs='+', default=[20, 25, 30, 35], help="Bollinger RSI thresholds")
+    parser.add_argument('--periods', type=int, nargs='+', default=[20], help="Bollinger SMA periods")
+    parser.add_argument('--widths', type=float, nargs='+', default=[2.0], help="Bollinger band widths (stddevs)")
+    parser.add_argument('--lookbacks', type=int, nargs='+', default=[5, 10, 20], help="volatility lookbacks")
+    parser.add_argument('--top-n', type=int, nargs='+', default=[25], help="volatile tickers picked per date")
+    parser.add_argument('--holds', type=int, nargs='+', default=[1, 5, 10, 20], help="holding periods (trading days)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes (1 runs in process)")
+    parser.add_argument('--no-write', action='store_true', help="print the results without storing them")
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default='bigquery')
+    args = parser.parse_args()
+
+    storage = script_backend(args.backend)
+    matrices = load_matrices(storage, args.days)
+    sets = parameter_sets(args.rsi, args.periods, args.widths, args.lookbacks, args.top_n)
+    print(f"Loaded {len(matrices.tickers)} tickers × {len(matrices.trading_days)} trading days; "
+          f"evaluating {len(sets)} parameter sets × {len(args.holds)} holding periods.")
+    results = run(matrices, sets, args.holds, args.workers)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results.drop(columns=['run_id', 'computed_at']).to_string(index=False))
+    if not args.no_write:
+        storage.append_table(results, results_table())
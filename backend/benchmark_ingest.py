@@ -0,0 +1,416 @@
+"""End-to-end ingest benchmark replaying a recorded Finviz export.
+
+The export (e.g. ../data/full_export_2026-02-15.csv) is split into the six Finviz views and served by a
+local HTTP stand-in for export.ashx. Each run is one forced main._ingest call (no unchanged-payload skip,
+no view checkpoints), so the stages run in production order through the pipeline's own code: the
+streaming fetch and parse, merge, fingerprint, raw upload, normalize, load, aggregate, calendar,
+indicators and publish. Storage is 'null' (serializes everything like a load would but discards the
+bytes) or 'local' (the DuckDB/Parquet backend in a temporary directory).
+
+The universe can be scaled synthetically (--scales 1 2 10 50): every extra copy of a row gets a new
+ticker and slightly perturbed numbers, so groups, row counts and compression stay realistic.
+
+Stage wall times are the run_metrics spans of each run (median/min/max over --repeat runs). A background
+sampler records RSS during the run, and during one extra run under tracemalloc the traced and Arrow
+memory-pool bytes, from which the peak RSS and the peak/net allocations of each stage are derived
+(sampled every RSS_SAMPLE_INTERVAL, so very short peaks can be missed). Results are written as JSON;
+--compare flags stages that got slower than a previous result file and exits 1.
+
+    python benchmark_ingest.py --scales 1 2 10 50 --output results.json
+    python benchmark_ingest.py --storage local --compare results.json
+"""
+import argparse
+import bisect
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+# The benchmark measures pipeline work, not the production Finviz rate limit (override with --rate-limit).
+os.environ.setdefault('FINVIZ_RATE_LIMIT', '1000')
+os.environ.setdefault('FINVIZ_RATE_BURST', '100')
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import main
+import parsing
+import raw_archive
+import run_metrics
+from aggregation import aggregate_snapshot, format_snapshot_id
+from config import FINVIZ_VIEWS
+from storage_backends import LocalBackend, StorageBackend
+
+# Top-level spans of main._ingest, in production order. 'fetch' includes parsing: fetch_view_api streams
+# each response into the typed CSV parser.
+STAGES = ['fetch', 'merge', 'fingerprint', 'raw_upload', 'normalize', 'load', 'aggregate', 'calendar', 'indicators',
+          'publish']
+DEFAULT_PAYLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'full_export_2026-02-15.csv')
+RSS_SAMPLE_INTERVAL = 0.005  # seconds
+
+# Columns of each Finviz view. Every view also carries No., Ticker and the quote columns; columns not
+# listed elsewhere (ownership, float, short interest, ...) go to the custom view.
+_QUOTE_COLUMNS = ['Price', 'Change', 'Volume']
+VIEW_COLUMNS = {
+    'overview': ['Company', 'Sector', 'Industry', 'Country', 'Market Cap', 'P/E'],
+    'valuation': ['Market Cap', 'P/E', 'Forward P/E', 'PEG', 'P/S', 'P/B', 'P/Cash', 'P/Free Cash Flow',
+                  'EPS Growth This Year', 'EPS Growth Next Year', 'EPS Growth Past 5 Years',
+                  'EPS Growth Next 5 Years', 'Sales Growth Past 5 Years'],
+    'financial': ['Market Cap', 'Dividend Yield', 'Return on Assets', 'Return on Equity',
+                  'Return on Invested Capital', 'Current Ratio', 'Quick Ratio', 'LT Debt/Equity',
+                  'Total Debt/Equity', 'Gross Margin', 'Operating Margin', 'Profit Margin', 'Earnings Date'],
+    'performance': ['Performance (Week)', 'Performance (Month)', 'Performance (Quarter)',
+                    'Performance (Half Year)', 'Performance (YTD)', 'Performance (Year)', 'Performance (3 Years)',
+                    'Performance (5 Years)', 'Performance (10 Years)', 'Volatility (Week)', 'Volatility (Month)',
+                    'Average Volume', 'Relative Volume'],
+    'technical': ['Beta', 'Average True Range', '20-Day Simple Moving Average', '50-Day Simple Moving Average',
+                  '200-Day Simple Moving Average', '52-Week High', '52-Week Low', 'Relative Strength Index (14)',
+                  'Change from Open', 'Gap'],
+    'custom': None,
+}
+
+# --- Payloads -------------------------------------------------------------------------------------
+
+def load_export(path):
+    """The recorded export as strings, exactly as Finviz wrote them."""
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def scale_export(export, factor, seed=0):
+    """Repeats the universe `factor` times. Copy i > 0 gets tickers suffixed with -i and its numeric
+    values scaled by a per-row factor around 1, keeping Finviz's number formatting."""
+    if factor <= 1:
+        return export
+    rng = np.random.default_rng(seed)
+    numeric = [c for c in export.columns if parsing.FINVIZ_COLUMN_TYPES.get(c) in (parsing.FLOAT, parsing.PERCENT)]
+    copies = [export]
+    for i in range(1, int(factor)):
+        copy = export.copy()
+        copy['Ticker'] = copy['Ticker'] + f"-{i}"
+        noise = rng.normal(1.0, 0.02, size=len(copy))
+        for col in numeric:
+            values = pd.to_numeric(copy[col].str.rstrip('%'), errors='coerce')
+            scaled = (values * noise).map('{:.2f}'.format)
+            scaled = scaled.where(~copy[col].str.endswith('%'), scaled + '%')
+            copy[col] = scaled.where(values.notna(), copy[col])
+        copies.append(copy)
+    scaled = pd.concat(copies, ignore_index=True)
+    scaled['No.'] = [str(i) for i in range(1, len(scaled) + 1)]
+    return scaled
+
+def view_payloads(export):
+    """{view_id: CSV bytes} with the columns Finviz returns for each view."""
+    assigned = set(_QUOTE_COLUMNS) | {'No.', 'Ticker'}
+    for columns in VIEW_COLUMNS.values():
+        assigned.update(columns or [])
+    payloads = {}
+    for view_name, view_id in FINVIZ_VIEWS:
+        columns = VIEW_COLUMNS[view_name]
+        if columns is None:
+            columns = [c for c in export.columns if c not in assigned]
+        columns = ['No.', 'Ticker'] + [c for c in columns if c in export.columns] + _QUOTE_COLUMNS
+        payloads[view_id] = export[columns].to_csv(index=False).encode('utf-8')
+    return payloads
+
+def serve_exports(payloads):
+    """Local export.ashx stand-in answering ?v=<view_id> from the (mutable) payloads dict."""
+    import http.server
+    from urllib.parse import parse_qs, urlparse
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            view_id = parse_qs(urlparse(self.path).query).get('v', [''])[0]
+            payload = payloads.get(view_id)
+            if payload is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/export.ashx"
+
+# --- Stubbed storage ------------------------------------------------------------------------------
+
+class _CountingSink(io.RawIOBase):
+    """Write-only binary sink that only counts bytes."""
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.bytes_written += len(b)
+        return len(b)
+
+class NullBackend(StorageBackend):
+    """Does the serialization a real backend does (Parquet for archives and loads, the in-process
+    aggregation) and discards the bytes. Counts the bytes each call would have uploaded in the run
+    metrics. Blobs (payload record, rolling state) are not kept, so every run starts like a first one."""
+
+    dialect = 'duckdb'
+
+    def table_name(self, name):
+        return name
+
+    def put_blob(self, name, data, content_type='application/json'):
+        run_metrics.add('bytes_uploaded', len(data.encode('utf-8') if isinstance(data, str) else data))
+
+    def get_blob(self, name):
+        return None
+
+    def delete_blob(self, name):
+        pass
+
+    def write_raw_archive(self, df, name):
+        sink = _CountingSink()
+        raw_archive.write_parquet(df, sink)
+        run_metrics.add('bytes_uploaded', sink.bytes_written)
+
+    def append_table(self, df, table, write_disposition='WRITE_APPEND', schema=None, clustering=None):
+        # load_table_from_dataframe serializes the frame to Parquet before uploading it.
+        sink = _CountingSink()
+        df.to_parquet(sink, index=False)
+        run_metrics.add('bytes_uploaded', sink.bytes_written)
+
+    def append_history(self, df):
+        self.append_table(df.drop(columns=['is_current']), 'history')
+
+    def aggregate(self, df):
+        processed_at = df['processed_at'].iloc[0]
+        for level in ['industry', 'sector']:
+            rows = aggregate_snapshot(df, level, processed_at, format_snapshot_id(processed_at), is_current=None)
+            self.append_table(rows, level)
+
+    def publish_snapshot(self, processed_at, row_count):
+        pass
+
+    def current_snapshot(self):
+        return None
+
+# --- Measurement ----------------------------------------------------------------------------------
+
+def _current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is the lifetime peak (kilobytes on Linux, bytes on macOS); best effort elsewhere.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+class _Sampler:
+    """Samples RSS (and, while tracemalloc is on, traced and Arrow-pool bytes) on a background thread
+    while a run executes. Samples are (seconds since start, rss, traced, arrow)."""
+
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations
+        self.samples = []
+
+    def _sample(self):
+        traced = tracemalloc.get_traced_memory()[0] if self.trace_allocations else 0
+        arrow = pa.total_allocated_bytes() if self.trace_allocations else 0
+        self.samples.append((time.perf_counter() - self.started, _current_rss(), traced, arrow))
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self._sample()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self._sample()
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def window(self, start, end):
+        """The samples covering [start, end]: the last one before it through the first one after it."""
+        times = [sample[0] for sample in self.samples]
+        first = max(bisect.bisect_right(times, start) - 1, 0)
+        last = min(bisect.bisect_left(times, end), len(self.samples) - 1)
+        return self.samples[first:last + 1]
+
+def run_pipeline(storage, trace_allocations=False):
+    """Runs main._ingest once (forced, without checkpoints) against `storage`. Returns ({stage: metrics},
+    run counters). Stages are the top-level spans the pipeline records; their memory figures are taken
+    from the samples during each span."""
+    with _Sampler(trace_allocations) as sampler:
+        offset = time.perf_counter() - sampler.started
+        with run_metrics.run('benchmark', emit_summary=False) as metrics:
+            main._ingest(metrics, force=True, checkpoint_max_age=0, storage=storage)
+    summary = metrics.summary()
+    results = {}
+    for span in summary['spans']:
+        if span['parent'] is not None:
+            continue
+        start = span['start_s'] + offset
+        window = sampler.window(start, start + span['duration_s'])
+        stats = results.setdefault(span['name'], {'wall_s': 0.0, 'peak_rss_mb': 0.0, 'rss_delta_mb': 0.0})
+        stats['wall_s'] += span['duration_s']
+        if trace_allocations:
+            stats['alloc_peak_mb'] = max(stats.get('alloc_peak_mb', 0.0), (max(s[2] for s in window) - window[0][2]) / 2**20)
+            stats['alloc_net_mb'] = stats.get('alloc_net_mb', 0.0) + (window[-1][2] - window[0][2]) / 2**20
+            # Arrow buffers bypass tracemalloc; the pool only exposes current totals.
+            stats['arrow_alloc_net_mb'] = stats.get('arrow_alloc_net_mb', 0.0) + (window[-1][3] - window[0][3]) / 2**20
+        else:
+            stats['peak_rss_mb'] = max(stats['peak_rss_mb'], max(s[1] for s in window) / 2**20)
+            stats['rss_delta_mb'] += (window[-1][1] - window[0][1]) / 2**20
+    counters = {key: summary[key] for key in ('rows', 'bytes_downloaded', 'bytes_uploaded', 'fetch_attempts')}
+    return results, counters
+
+def _summary(values):
+    return {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+def benchmark_scale(export, factor, payloads, args):
+    """Runs the pipeline args.repeat times (plus one traced run) at one scale factor."""
+    payloads.clear()
+    payloads.update(view_payloads(scale_export(export, factor)))
+
+    def make_storage(tmp):
+        return LocalBackend(root=tmp) if args.storage == 'local' else NullBackend()
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='finviz-bench-') as tmp:
+        run_pipeline(make_storage(os.path.join(tmp, 'warmup')))  # imports, connection pool, caches
+        for i in range(args.repeat):
+            runs.append(run_pipeline(make_storage(os.path.join(tmp, f'run{i}'))))
+        traced = None
+        if args.allocations:
+            tracemalloc.start()
+            try:
+                traced, _ = run_pipeline(make_storage(os.path.join(tmp, 'traced')), trace_allocations=True)
+            finally:
+                tracemalloc.stop()
+
+    stages = {}
+    for name in STAGES:
+        timed = [stats[name] for stats, _ in runs if name in stats]
+        if not timed:
+            continue
+        stage = {'wall_s': _summary([t['wall_s'] for t in timed]),
+                 'peak_rss_mb': max(t['peak_rss_mb'] for t in timed),
+                 'rss_delta_mb': statistics.median(t['rss_delta_mb'] for t in timed)}
+        if traced and name in traced:
+            stage.update({key: value for key, value in traced[name].items() if key.startswith(('alloc', 'arrow'))})
+        stages[name] = stage
+    counters = runs[0][1]
+    total = [sum(stats[name]['wall_s'] for name in STAGES if name in stats) for stats, _ in runs]
+    return {'tickers': counters['rows'],
+            'payload_bytes': sum(len(p) for p in payloads.values()),
+            'bytes_downloaded': counters['bytes_downloaded'],
+            'bytes_uploaded': counters['bytes_uploaded'],
+            'total_wall_s': _summary(total), 'stages': stages}
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(previous, current, threshold):
+    """Stages (and totals) whose median wall time grew by more than `threshold` (fraction) vs. previous."""
+    regressions = []
+    for scale, result in current['scales'].items():
+        before = previous.get('scales', {}).get(scale)
+        if not before:
+            continue
+        pairs = [('total', before['total_wall_s'], result['total_wall_s'])]
+        pairs += [(name, before['stages'][name]['wall_s'], result['stages'][name]['wall_s'])
+                  for name in STAGES if name in before['stages'] and name in result['stages']]
+        for name, old, new in pairs:
+            if old['median'] > 0 and new['median'] > old['median'] * (1 + threshold):
+                regressions.append(f"x{scale} {name}: {old['median']:.3f}s -> {new['median']:.3f}s "
+                                   f"(+{(new['median'] / old['median'] - 1) * 100:.0f}%)")
+    return regressions
+
+def run(args):
+    # Keep the pipeline's per-call INFO logging out of the timings and the output.
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.rate_limit:
+        main._rate_limiter = main.TokenBucket(args.rate_limit, main.FINVIZ_RATE_BURST)
+    export = load_export(args.payload)
+    payloads = {}
+    server, url = serve_exports(payloads)
+    main.FINVIZ_API_URL, main.FINVIZ_API_KEY = url, 'benchmark'
+    report = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'payload': os.path.basename(args.payload),
+            'storage': args.storage,
+            'repeat': args.repeat,
+        },
+        'scales': {},
+    }
+    try:
+        for factor in args.scales:
+            result = benchmark_scale(export, factor, payloads, args)
+            report['scales'][str(factor)] = result
+            print(f"x{factor}: {result['tickers']} tickers, total {result['total_wall_s']['median']:.3f}s  " +
+                  '  '.join(f"{name}={result['stages'][name]['wall_s']['median']:.3f}s" for name in STAGES if name in result['stages']),
+                  file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get('meta', {}).get('storage') != args.storage:
+            print(f"Warning: {args.compare} used storage {previous.get('meta', {}).get('storage')!r}.", file=sys.stderr)
+        regressions = compare(previous, report, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No stage slower than {args.compare} by more than {args.threshold:.0%}.", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payload', default=DEFAULT_PAYLOAD, help="recorded full export CSV to replay")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 2, 10, 50], help="universe multipliers")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per scale (after one warm-up)")
+    parser.add_argument('--storage', choices=['null', 'local'], default='null')
+    parser.add_argument('--no-allocations', dest='allocations', action='store_false',
+                        help="skip the extra tracemalloc run")
+    parser.add_argument('--rate-limit', type=float, help="Finviz requests/second (default: unthrottled)")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--compare', help="previous JSON results; exit 1 if a stage regressed")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown for --compare (0.2 = 20%%)")
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,104 @@
+"""Cold-start benchmark for the process_finviz_data Cloud Function module.
+
+Each sample runs in a fresh interpreter and reports the time to import main.py, which heavy modules that
+import pulled in, and (with --request) the latency of the first and a second, warm call to
+process_finviz_data. Use --replay to serve a recorded export (e.g. ../data/full_export_2026-02-15.csv) as
+FINVIZ_API_URL so the request measures real fetch/parse work without calling Finviz.
+
+With --request every sample writes to the local backend in its own temporary LOCAL_STORAGE_DIR (never to
+BigQuery/GCS), with the unchanged-payload skip and the view checkpoints turned off, so both calls time
+the full fetch → publish path.
+
+    python benchmark_startup.py --samples 5
+    python benchmark_startup.py --request --replay ../data/full_export_2026-02-15.csv
+"""
+import argparse
+import http.server
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+
+HEAVY_MODULES = ['pandas', 'pyarrow', 'numpy', 'requests', 'google.cloud.bigquery', 'google.cloud.storage']
+
+SAMPLE_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+result = {'import_s': time.perf_counter() - started,
+          'modules_loaded': [m for m in %(heavy)r if m in sys.modules]}
+if %(request)r:
+    class MockRequest:
+        pass
+    for key in ('first_request', 'warm_request'):
+        started = time.perf_counter()
+        body, status = main.process_finviz_data(MockRequest())
+        result[key + '_s'] = time.perf_counter() - started
+        result[key + '_status'] = status
+print('BENCHMARK ' + json.dumps(result))
+"""
+
+def _serve_replay(path):
+    """Serves `path` for every GET on a local port; returns the export URL."""
+    with open(path, 'rb') as f:
+        payload = f.read()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/export.ashx"
+
+def run_sample(request, env):
+    script = SAMPLE_SCRIPT % {'heavy': HEAVY_MODULES, 'request': request}
+    with tempfile.TemporaryDirectory(prefix='finviz-benchmark-') as storage_dir:
+        if request:
+            # The warm call must not skip the unchanged payload or resume the first call's checkpoints.
+            env = {**env, 'STORAGE_BACKEND': 'local', 'LOCAL_STORAGE_DIR': storage_dir,
+                   'SKIP_UNCHANGED_PAYLOAD': 'false', 'VIEW_CHECKPOINT_MAX_AGE_MINUTES': '0'}
+        proc = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith('BENCHMARK '):
+            return json.loads(line[len('BENCHMARK '):])
+    raise RuntimeError(f"Benchmark sample failed:\n{proc.stderr[-2000:]}")
+
+def _summary(values):
+    return {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+def main(args):
+    env = dict(os.environ)
+    if args.replay:
+        env['FINVIZ_API_URL'] = _serve_replay(args.replay)
+        env.setdefault('FINVIZ_API_KEY', 'replay')
+
+    samples = [run_sample(args.request, env) for _ in range(args.samples)]
+    report = {
+        'samples': len(samples),
+        'import_s': _summary([s['import_s'] for s in samples]),
+        'modules_loaded_at_import': samples[0]['modules_loaded'],
+    }
+    if args.request:
+        for key in ('first_request', 'warm_request'):
+            report[f'{key}_s'] = _summary([s[f'{key}_s'] for s in samples])
+            report[f'{key}_status'] = sorted({s[f'{key}_status'] for s in samples})
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=5, help="fresh interpreters to sample")
+    parser.add_argument('--request', action='store_true', help="also time a first and a warm process_finviz_data call (local backend in a temp dir)")
+    parser.add_argument('--replay', help="CSV export to serve as FINVIZ_API_URL")
+    main(parser.parse_args())
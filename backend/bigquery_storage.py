@@ -0,0 +1,248 @@
+"""BigQuery and GCS persistence of the ingest pipeline (used by storage_backends.BigQueryBackend)."""
+import logging
+
+import pandas as pd
+from google.cloud import bigquery
+
+import aggregation
+import backfill_aggregations
+import run_metrics
+from clients import get_bigquery_client, get_storage_client
+from config import AGGREGATION_ENGINE, FALLBACK_LOOKBACK_DAYS, SNAPSHOT_MODE
+from snapshots import table_names
+
+logger = logging.getLogger(__name__)
+
+def upload_to_gcs(bucket_name, destination_blob_name, data_string, content_type='application/json'):
+    """Uploads a string to GCS."""
+    try:
+        storage_client = get_storage_client()
+        bucket = storage_client.bucket(bucket_name)
+        blob = bucket.blob(destination_blob_name)
+        blob.upload_from_string(data_string, content_type=content_type)
+        run_metrics.add('bytes_uploaded', len(data_string.encode('utf-8') if isinstance(data_string, str) else data_string))
+        logger.info(f"File {destination_blob_name} uploaded to {bucket_name}.")
+    except Exception as e:
+        logger.error(f"Failed to upload to GCS: {e}")
+        raise
+
+def download_from_gcs(bucket_name, blob_name):
+    """Downloads a blob from GCS; returns None if it does not exist."""
+    from google.api_core.exceptions import NotFound
+    try:
+        return get_storage_client().bucket(bucket_name).blob(blob_name).download_as_bytes()
+    except NotFound:
+        return None
+
+def delete_from_gcs(bucket_name, blob_name):
+    """Deletes a blob from GCS if it exists."""
+    from google.api_core.exceptions import NotFound
+    try:
+        get_storage_client().bucket(bucket_name).blob(blob_name).delete()
+    except NotFound:
+        pass
+
+def insert_into_bigquery(df, dataset_id, table_id, write_disposition="WRITE_APPEND", schema=None, clustering=None):
+    """Inserts a Pandas DataFrame into BigQuery. With `schema` ([(column, type)]) those columns get
+    explicit types and the others are inferred from their dtypes; without it the types are autodetected."""
+    try:
+        client = get_bigquery_client()
+        table_ref = client.dataset(dataset_id).table(table_id)
+        
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=write_disposition,
+            autodetect=schema is None,
+        )
+        if schema is not None:
+            job_config.schema = [bigquery.SchemaField(name, field_type) for name, field_type in schema]
+        if clustering:
+            job_config.clustering_fields = clustering
+        
+        job = client.load_table_from_dataframe(df, table_ref, job_config=job_config)
+        job.result() # Wait for completion
+        run_metrics.record_job(job)
+        logger.info(f"Loaded {len(df)} rows into {dataset_id}.{table_id}.")
+    except Exception as e:
+        logger.error(f"Failed to insert into BigQuery {table_id}: {e}")
+        raise
+
+def set_all_historical(dataset_id, table_id):
+    """Sets is_current to 'no' for all existing rows in the cumulative table."""
+    try:
+        client = get_bigquery_client()
+        query = f"UPDATE `{client.project}.{dataset_id}.{table_id}` SET is_current = 'no' WHERE is_current = 'yes'"
+        query_job = client.query(query)
+        query_job.result()
+        run_metrics.record_job(query_job)
+        logger.info(f"Set all legacy records to is_current='no' in {table_id}.")
+    except Exception as e:
+        # If the table doesn't exist yet, we might get an error. Just log and continue.
+        logger.warning(f"Could not update is_current in {table_id} (might be new): {e}")
+
+def _aggregation_schema(processed_at_type, with_is_current=True):
+    return [
+        bigquery.SchemaField('snapshot_id', 'STRING'),
+        bigquery.SchemaField('processed_at', processed_at_type),
+        *([bigquery.SchemaField('is_current', 'STRING')] if with_is_current else []),
+        bigquery.SchemaField('name', 'STRING'),
+        bigquery.SchemaField('parent_sector', 'STRING'),
+        *[bigquery.SchemaField(col, 'FLOAT') for col in [
+            'change', 'week', 'month', 'quarter', 'rsi', 'momentum',
+            'changeEqual', 'weekEqual', 'monthEqual', 'quarterEqual', 'rsiEqual', 'momentumEqual', 'marketCap']],
+        bigquery.SchemaField('stockCount', 'INTEGER'),
+        bigquery.SchemaField('topStocks', 'RECORD', mode='REPEATED', fields=[
+            bigquery.SchemaField('ticker', 'STRING'),
+            bigquery.SchemaField('week', 'FLOAT'),
+        ]),
+    ]
+
+def get_processed_at_type(client, table):
+    """DATETIME or TIMESTAMP, whichever type processed_at was created with in `table`."""
+    try:
+        for field in client.get_table(table).schema:
+            if field.name == 'processed_at':
+                return field.field_type
+    except Exception as e:
+        logger.warning(f"Could not read schema of {table}, assuming DATETIME: {e}")
+    return 'DATETIME'
+
+def _aggregate_in_process(client, df, snapshot_id, processed_at_type, industry_table, sector_table, is_current):
+    """Aggregates the in-memory snapshot and bulk-loads one job per aggregation table."""
+    processed_at = df['processed_at'].iloc[0]
+    job_config = bigquery.LoadJobConfig(
+        write_disposition="WRITE_APPEND",
+        schema=_aggregation_schema(processed_at_type, with_is_current=is_current is not None),
+    )
+    for level, table in [('industry', industry_table), ('sector', sector_table)]:
+        rows = aggregation.aggregate_snapshot(df, level, processed_at, snapshot_id, is_current=is_current)
+        if rows.empty:
+            raise RuntimeError(f"Verification failed: {level} aggregation of snapshot {snapshot_id} produced 0 rows.")
+        job = client.load_table_from_dataframe(rows, table, job_config=job_config)
+        job.result()
+        run_metrics.record_job(job)
+        if job.output_rows != len(rows):
+            raise RuntimeError(f"Verification failed: loaded {job.output_rows} of {len(rows)} {level} rows into {table}.")
+        logger.info(f"Appended {len(rows)} current {level} rows to {table}.")
+
+def _aggregate_in_bigquery(client, snapshot_id, raw_table, industry_table, sector_table, is_current):
+    """Aggregates the current snapshot with INSERT ... SELECT over the history table."""
+    columns = [c for c in aggregation.AGGREGATION_COLUMNS if c != 'is_current' or is_current is not None]
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('snapshot_id', 'STRING', snapshot_id),
+    ])
+    for level, table in [('industry', industry_table), ('sector', sector_table)]:
+        query = f"""
+        INSERT INTO `{table}` ({', '.join(columns)})
+        {aggregation.aggregation_sql(raw_table, level, where="WHERE CAST(processed_at AS STRING) = @snapshot_id", is_current=is_current)}
+        """
+        job = client.query(query, job_config=job_config)
+        result = job.result()
+        run_metrics.record_job(job)
+        # Verify that the current snapshot made it into the aggregation table
+        if not result.num_dml_affected_rows:
+            raise RuntimeError(f"Verification failed: {level} aggregation of snapshot {snapshot_id} inserted 0 rows.")
+        logger.info(f"Appended {result.num_dml_affected_rows} current {level} rows to {table}.")
+
+def aggregate_current_data(dataset_id, base_table_name, df=None, snapshot_mode=None):
+    """Aggregates the current snapshot and appends to the industry and sector history tables.
+
+    With the in-memory snapshot `df` (and AGGREGATION_ENGINE='python') the rows are computed in process and
+    bulk-loaded; otherwise they are computed in BigQuery from the history table.
+    Falls back to backfilling every recent snapshot missing from the aggregation tables if that fails, and
+    to rebuilding a table from the whole history if it does not exist (a fresh dataset or a dropped table)."""
+    pointer_mode = (snapshot_mode or SNAPSHOT_MODE) == 'pointer'
+    client = get_bigquery_client()
+    project_id = client.project
+    tables = table_names(project_id, dataset_id, base_table_name)
+    if pointer_mode:
+        raw_table, industry_table, sector_table = tables['history_data'], tables['industry_data'], tables['sector_data']
+        is_current = None
+    else:
+        raw_table, industry_table, sector_table = tables['history'], tables['industry'], tables['sector']
+        is_current = 'yes'
+    
+    try:
+        processed_at_type = get_processed_at_type(client, raw_table)
+        if df is not None:
+            snapshot_id = aggregation.format_snapshot_id(df['processed_at'].iloc[0], processed_at_type)
+        else:
+            job = client.query(f"SELECT CAST(MAX(processed_at) AS STRING) as snapshot_id FROM `{raw_table}`")
+            snapshot_id = list(job.result())[0].snapshot_id
+            run_metrics.record_job(job)
+
+        # 1. Set current='no' in aggregate tables (the snapshot pointer makes this unnecessary)
+        if not pointer_mode:
+            for table in [industry_table, sector_table]:
+                job = client.query(f"UPDATE `{table}` SET is_current = 'no' WHERE is_current = 'yes'")
+                results = job.result()
+                run_metrics.record_job(job)
+                logger.info(f"Set legacy records to is_current='no' in {table}. Rows affected: {results.num_dml_affected_rows}")
+        
+        # 2. Append the current industry and sector aggregation
+        if df is not None and AGGREGATION_ENGINE == 'python':
+            _aggregate_in_process(client, df, snapshot_id, processed_at_type, industry_table, sector_table, is_current)
+        else:
+            _aggregate_in_bigquery(client, snapshot_id, raw_table, industry_table, sector_table, is_current)
+        
+    except Exception as e:
+        logger.error(f"Incremental aggregation failed: {e}. Falling back to backfilling missing snapshots...")
+        try:
+            _aggregation_fallback(client, raw_table, {'industry': industry_table, 'sector': sector_table}, pointer_mode)
+        except Exception as backfill_err:
+            logger.error(f"CRITICAL: Backfill fallback also failed: {backfill_err}")
+            raise
+
+def _aggregation_fallback(client, raw_table, level_tables, pointer_mode):
+    """Backfills the recent snapshots missing from each aggregation table. Tables that don't exist (or
+    disappear during the backfill) are rebuilt from the whole history with rebuild_sql."""
+    from google.api_core.exceptions import NotFound
+    existing, missing = {}, []
+    for level, table in level_tables.items():
+        try:
+            client.get_table(table)
+            existing[level] = table
+        except NotFound:
+            missing.append(level)
+    if existing:
+        since = (pd.Timestamp.now() - pd.Timedelta(days=FALLBACK_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        try:
+            # Carry each snapshot's is_current flag over from history (None in pointer mode).
+            added = backfill_aggregations.backfill_missing_snapshots(
+                client, raw_table, existing, None if pointer_mode else 'carry', since=since)
+            logger.info(f"Backfill fallback completed successfully: {added}")
+        except NotFound as e:
+            logger.error(f"Backfill fallback hit a missing table ({e}); rebuilding {sorted(existing)} from history.")
+            missing.extend(existing)
+    for level in missing:
+        logger.warning(f"Rebuilding {level_tables[level]} from the whole history.")
+        job = client.query(aggregation.rebuild_sql(raw_table, level_tables[level], level, pointer_mode=pointer_mode))
+        job.result()
+        run_metrics.record_job(job)
+        logger.info(f"Full rebuild of {level_tables[level]} completed successfully.")
+
+def publish_snapshot(dataset_id, base_table_name, processed_at, row_count):
+    """Points readers at a new snapshot by appending it to the `_snapshots` table.
+
+    This is the last write of a run, so readers switch from the previous snapshot to a complete new one."""
+    client = get_bigquery_client()
+    tables = table_names(client.project, dataset_id, base_table_name)
+    processed_at_type = get_processed_at_type(client, tables['history_data'])
+    row = pd.DataFrame([{
+        'snapshot_id': aggregation.format_snapshot_id(processed_at, processed_at_type),
+        'processed_at': processed_at,
+        'row_count': row_count,
+        'published_at': pd.Timestamp.now(tz='UTC'),
+    }])
+    job_config = bigquery.LoadJobConfig(
+        write_disposition="WRITE_APPEND",
+        schema=[
+            bigquery.SchemaField('snapshot_id', 'STRING'),
+            bigquery.SchemaField('processed_at', processed_at_type),
+            bigquery.SchemaField('row_count', 'INTEGER'),
+            bigquery.SchemaField('published_at', 'TIMESTAMP'),
+        ],
+    )
+    job = client.load_table_from_dataframe(row, tables['snapshots'], job_config=job_config)
+    job.result()
+    run_metrics.record_job(job)
+    logger.info(f"Published snapshot {row['snapshot_id'].iloc[0]} in {tables['snapshots']}.")
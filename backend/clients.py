@@ -0,0 +1,64 @@
+"""Process-wide Google Cloud clients and deferred imports.
+
+Clients are created on first use and reused for the lifetime of the process, so warm Cloud Function
+invocations skip credential discovery and keep their HTTP connection pools. lazy_import() defers heavy
+modules (pandas, google-cloud) until they are first used, which keeps the cold-start import cheap.
+"""
+import importlib
+import threading
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+class _LazyModule:
+    """Module proxy that imports the real module on first attribute access (thread-safe)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module {self._name!r} ({state})>"
+
+def lazy_import(name):
+    return _LazyModule(name)
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def get_bigquery_client():
+    """Shared bigquery.Client for the default project and credentials."""
+    def factory():
+        from google.cloud import bigquery
+        return bigquery.Client()
+    return _get_client('bigquery', factory)
+
+def get_storage_client():
+    """Shared storage.Client for the default project and credentials."""
+    def factory():
+        from google.cloud import storage
+        return storage.Client()
+    return _get_client('storage', factory)
+
+def reset_clients():
+    """Drops the cached clients (e.g. after credentials changed)."""
+    with _clients_lock:
+        _clients.clear()
@@ -0,0 +1,66 @@
+"""Environment configuration of the ingest pipeline."""
+import os
+
+RAW_BUCKET_NAME = os.environ.get('RAW_BUCKET_NAME', 'finviz-raw-data')
+BQ_DATASET = os.environ.get('BQ_DATASET', 'stock_data')
+BQ_TABLE_BASE = os.environ.get('BQ_TABLE', 'processed_stock_data')
+BQ_TABLE_HISTORY = f"{BQ_TABLE_BASE}_history"
+# 'parquet' (zstd, see raw_archive.py), 'json' (legacy records blob) or 'both'
+RAW_ARCHIVE_FORMAT = os.environ.get('RAW_ARCHIVE_FORMAT', 'parquet')
+FINVIZ_API_KEY = os.environ.get('FINVIZ_API_KEY')
+FINVIZ_API_URL = os.environ.get('FINVIZ_API_URL', 'https://elite.finviz.com/export.ashx')
+# Finviz screener filter of the ingested universe (`f=` parameter).
+FINVIZ_FILTER = os.environ.get('FINVIZ_FILTER', 'cap_midover')
+# Split every view into shards fetched concurrently: 'sector', 'exchange' or a ';'-separated list of
+# Finviz filters; empty fetches one export per view (see shards.py).
+FINVIZ_SHARDS = os.environ.get('FINVIZ_SHARDS', '')
+# A sharded universe must have at least this fraction of the tickers of the last ingested snapshot.
+FINVIZ_SHARD_MIN_COVERAGE = float(os.environ.get('FINVIZ_SHARD_MIN_COVERAGE', '0.95'))
+# Fetch tuning: 'concurrent' fetches all views in parallel, 'sequential' one after the other.
+FINVIZ_FETCH_MODE = os.environ.get('FINVIZ_FETCH_MODE', 'concurrent')
+FINVIZ_MAX_WORKERS = int(os.environ.get('FINVIZ_MAX_WORKERS', '6'))
+# Token bucket shared by every request (including retries): sustained requests/second and burst size.
+FINVIZ_RATE_LIMIT = float(os.environ.get('FINVIZ_RATE_LIMIT', '1.0'))
+FINVIZ_RATE_BURST = int(os.environ.get('FINVIZ_RATE_BURST', '2'))
+# 'python' aggregates the in-memory snapshot and bulk-loads it, 'sql' runs INSERT ... SELECT in BigQuery.
+AGGREGATION_ENGINE = os.environ.get('AGGREGATION_ENGINE', 'python')
+# 'flag' flips is_current with UPDATEs on every run; 'pointer' appends to partitioned `_data` tables and
+# publishes the snapshot in the `_snapshots` table (run migrate_snapshot_pointer.py first).
+SNAPSHOT_MODE = os.environ.get('SNAPSHOT_MODE', 'flag')
+# 'full' appends every column of every snapshot to history; 'delta' (pointer layout only) stores the
+# slow-changing fields change-only and reassembles snapshots in a view (see delta_history.py).
+HISTORY_MODE = os.environ.get('HISTORY_MODE', 'full')
+# Layout of the history and daily tables: 1 = legacy (autodetected, percent strings, market cap in
+# millions), 2 = typed (explicit FLOAT64/INT64 schema, market cap in dollars; see history_schema.py).
+HISTORY_SCHEMA_VERSION = int(os.environ.get('HISTORY_SCHEMA_VERSION', '1'))
+# How far back the aggregation fallback looks for snapshots missing from the aggregation tables.
+FALLBACK_LOOKBACK_DAYS = int(os.environ.get('FALLBACK_LOOKBACK_DAYS', '7'))
+# 'bigquery' (BigQuery + GCS) or 'local' (DuckDB over partitioned Parquet in LOCAL_STORAGE_DIR)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'bigquery')
+LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.local_storage'))
+# Table (in BQ_DATASET / the local backend) that gets one row of run metrics per run; empty disables it.
+RUN_METRICS_TABLE = os.environ.get('RUN_METRICS_TABLE', '')
+# One-row table replaced at the end of every ingest run, read by scripts/check_latest_updates.py
+# (see ingest_watermark.py); empty disables it.
+INGEST_WATERMARK_TABLE = os.environ.get('INGEST_WATERMARK_TABLE', f"{BQ_TABLE_BASE}_ingest_watermark")
+# Skip all writes when the merged views hash to the last ingested payload (see payload_fingerprint.py).
+SKIP_UNCHANGED_PAYLOAD = os.environ.get('SKIP_UNCHANGED_PAYLOAD', 'true').lower() in ('1', 'true', 'yes')
+# Fetched views are checkpointed and reused by runs within this many minutes (see view_checkpoints.py);
+# 0 disables checkpoints.
+VIEW_CHECKPOINT_MAX_AGE_MINUTES = int(os.environ.get('VIEW_CHECKPOINT_MAX_AGE_MINUTES', '60'))
+# Read API (read_api.py): seconds a cached response is served, cached responses and their total body
+# bytes per instance, and how often an instance checks for a newly ingested snapshot.
+READ_API_CACHE_TTL_S = float(os.environ.get('READ_API_CACHE_TTL_S', '300'))
+READ_API_CACHE_ENTRIES = int(os.environ.get('READ_API_CACHE_ENTRIES', '256'))
+READ_API_CACHE_MAX_BYTES = int(os.environ.get('READ_API_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+READ_API_VERSION_CHECK_S = float(os.environ.get('READ_API_VERSION_CHECK_S', '30'))
+
+# List of views to fetch and merge
+FINVIZ_VIEWS = [
+    ('overview', '111'),
+    ('valuation', '121'),
+    ('financial', '161'),
+    ('performance', '141'),
+    ('technical', '171'),
+    ('custom', '152')
+]
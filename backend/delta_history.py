@@ -0,0 +1,102 @@
+"""Delta-encoded history (HISTORY_MODE=delta, pointer layout only).
+
+Most of a snapshot's fields barely move from one day to the next: company, sector, industry, share
+counts, growth rates, margins, returns, ownership. Instead of appending them with every snapshot, the
+history is split into two physical tables:
+
+- `<base>_history_fast`: ticker, processed_at and the fields that change every run (price, change,
+  volume, valuation ratios, performance, technicals), one row per ticker per snapshot, as before.
+- `<base>_history_slow`: SLOW_COLUMNS as change-only SCD-2 records (ticker, valid_from, row_hash, ...).
+  A ticker gets a new version only when the hash of its slow fields differs from its latest version;
+  valid_to is derived with LEAD() when reading, so ingest never updates a row.
+
+`<base>_history_data` becomes a view joining each fast row to the slow version valid at its
+processed_at (reassembly_sql), so the `_history` view, the SQL aggregation engine, the backfill and
+every reader keep seeing full snapshots. Convert an existing dataset with migrate_delta_history.py.
+"""
+import logging
+
+import pandas as pd
+
+from history_schema import table_schema
+
+logger = logging.getLogger(__name__)
+
+# Normalized columns stored change-only. Everything else (except ticker) is stored with every snapshot.
+SLOW_COLUMNS = [
+    'company', 'sector', 'industry', 'country', 'shares_outstanding', 'shares_float',
+    'eps_growth_this_year', 'eps_growth_next_year', 'eps_growth_past_5_years', 'eps_growth_next_5_years',
+    'sales_growth_past_5_years', 'insider_ownership', 'insider_transactions', 'institutional_ownership',
+    'institutional_transactions', 'beta', 'return_on_assets', 'return_on_equity', 'return_on_invested_capital',
+    'current_ratio', 'quick_ratio', 'lt_debt_equity', 'total_debt_equity', 'gross_margin', 'operating_margin',
+    'profit_margin', 'earnings_date',
+]
+
+def slow_columns(df):
+    return [c for c in SLOW_COLUMNS if c in df.columns]
+
+def row_hash(slow):
+    """INT64 hash per row of the slow fields. Values are hashed as strings, so a row read back from
+    storage (float64 or string columns, None or NaN) hashes like the row that was written."""
+    canonical = pd.DataFrame({c: slow[c].astype('string').fillna('') for c in slow.columns}, index=slow.index)
+    hashes = pd.util.hash_pandas_object(canonical, index=False).to_numpy(dtype='uint64')
+    return pd.Series(hashes.view('int64'), index=slow.index)
+
+def split_snapshot(df):
+    """Splits a snapshot (storage layout, without is_current) into its fast rows and slow records."""
+    slow_cols = slow_columns(df)
+    fast = df.drop(columns=slow_cols)
+    slow = df[['ticker', 'processed_at', *slow_cols]].rename(columns={'processed_at': 'valid_from'})
+    slow.insert(2, 'row_hash', row_hash(df[slow_cols]))
+    return fast, slow
+
+def changed_records(slow, latest_hashes):
+    """The slow records whose hash differs from the ticker's latest version (or that are new).
+    latest_hashes is a Series of row_hash by ticker."""
+    # Compared as (ticker, hash) pairs: mapping would turn the INT64 hashes into lossy floats.
+    known = pd.MultiIndex.from_arrays([latest_hashes.index, latest_hashes.to_numpy(dtype='int64')])
+    return slow[~pd.MultiIndex.from_frame(slow[['ticker', 'row_hash']]).isin(known)]
+
+def latest_hashes_sql(slow_table):
+    """Query for the row_hash of each ticker's latest version."""
+    return f"""
+        SELECT ticker, row_hash FROM (
+            SELECT ticker, row_hash, ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY valid_from DESC) as rn
+            FROM {slow_table}
+        ) WHERE rn = 1
+    """
+
+def latest_hashes(storage, slow_table):
+    """row_hash of each ticker's latest version in `slow_table` (empty if the table doesn't exist yet)."""
+    try:
+        rows = storage.query(latest_hashes_sql(storage.ref(slow_table)))
+    except Exception as e:
+        logger.warning(f"Could not read {slow_table} (might be new), writing every slow record: {e}")
+        return pd.Series(dtype='int64')
+    return rows.set_index('ticker')['row_hash']
+
+def append_snapshot(storage, df, fast_table, slow_table, hashes=None):
+    """Appends a snapshot: every fast row, and the slow records that changed. `hashes` (latest row_hash
+    by ticker) is read from `slow_table` unless given; returns the updated hashes."""
+    fast, slow = split_snapshot(df.drop(columns=['is_current'], errors='ignore'))
+    if hashes is None:
+        hashes = latest_hashes(storage, slow_table)
+    changed = changed_records(slow, hashes)
+    storage.append_table(fast, fast_table, schema=table_schema(fast))
+    if not changed.empty:
+        storage.append_table(changed, slow_table, schema=table_schema(changed))
+    logger.info(f"Delta history: {len(fast)} fast rows, {len(changed)} of {len(slow)} slow records changed.")
+    return pd.concat([hashes[~hashes.index.isin(changed['ticker'])], changed.set_index('ticker')['row_hash']])
+
+def reassembly_sql(fast_table, slow_table, slow_cols=SLOW_COLUMNS, quote='`'):
+    """View of full snapshots: each fast row joined to the slow version valid at its processed_at."""
+    columns = ', '.join(f's.{c}' for c in slow_cols)
+    return f"""
+        SELECT f.*, {columns}
+        FROM {quote}{fast_table}{quote} f
+        LEFT JOIN (
+            SELECT *, LEAD(valid_from) OVER (PARTITION BY ticker ORDER BY valid_from) as valid_to
+            FROM {quote}{slow_table}{quote}
+        ) s
+        ON s.ticker = f.ticker AND s.valid_from <= f.processed_at AND (s.valid_to IS NULL OR f.processed_at < s.valid_to)
+    """
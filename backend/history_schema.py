@@ -0,0 +1,88 @@
+"""Versioned column layout of the history and daily tables.
+
+- version 1 (legacy): the layout BigQuery autodetected from the first loads. Percent columns are
+  "-1.23%" strings, market_cap is in millions, and every reader parses them with SAFE_CAST(REPLACE(...)).
+- version 2 (typed): an explicit schema. Numeric columns are FLOAT64 (percent columns hold -1.23),
+  counts are INT64 and market_cap is in absolute dollars. Tables are clustered by ticker, sector and
+  industry (those that have the columns).
+
+HISTORY_SCHEMA_VERSION selects the layout ingest writes and readers expect. Switch to 2 after rewriting
+the existing tables with migrate_typed_history.py. The in-memory snapshot keeps the parsed Finviz units
+(market cap in millions); to_storage_layout / from_storage_layout convert at the storage boundary.
+"""
+from config import HISTORY_SCHEMA_VERSION
+from parsing import FINVIZ_COLUMN_TYPES, FLOAT, INTEGER, PERCENT, STRING, from_legacy_layout, normalize_column_name, to_legacy_layout
+
+LEGACY = 1
+TYPED = 2
+CLUSTERING = ['ticker', 'sector', 'industry']
+
+_BIGQUERY_TYPES = {STRING: 'STRING', INTEGER: 'INT64', FLOAT: 'FLOAT64', PERCENT: 'FLOAT64'}
+
+# Typed layout: normalized column -> BigQuery type. processed_at keeps the type its table was created
+# with (DATETIME or TIMESTAMP) and is inferred from the frame.
+COLUMN_TYPES = {
+    **{normalize_column_name(name): _BIGQUERY_TYPES[kind] for name, kind in FINVIZ_COLUMN_TYPES.items()},
+    'volume': 'INT64',
+    'change_pct': 'FLOAT64',
+    'is_current': 'STRING',
+}
+PERCENT_COLUMNS = [normalize_column_name(name) for name, kind in FINVIZ_COLUMN_TYPES.items() if kind == PERCENT]
+
+def to_storage_layout(df, version=None):
+    """Copy of a normalized, typed snapshot in the layout of schema `version`."""
+    version = version or HISTORY_SCHEMA_VERSION
+    if version == LEGACY:
+        return to_legacy_layout(df)
+    df = df.copy()
+    for column, bigquery_type in COLUMN_TYPES.items():
+        if column not in df.columns:
+            continue
+        if bigquery_type == 'INT64':
+            df[column] = df[column].round().astype('Int64')
+        elif bigquery_type == 'FLOAT64':
+            df[column] = df[column].astype('float64')
+    if 'market_cap' in df.columns:
+        df['market_cap'] = df['market_cap'] * 1e6
+    return df
+
+def from_storage_layout(df, version=None):
+    """Inverse of to_storage_layout for rows read back from history (parsed Finviz units)."""
+    version = version or HISTORY_SCHEMA_VERSION
+    if version == LEGACY:
+        return from_legacy_layout(df)
+    df = df.copy()
+    if 'market_cap' in df.columns:
+        df['market_cap'] = df['market_cap'].astype('float64') / 1e6
+    return df
+
+def table_schema(df, version=None):
+    """[(column, BigQuery type)] of df's columns for an explicit load schema, or None (autodetect) for
+    the legacy layout. Columns outside the registry (processed_at, ...) are left to the loader."""
+    version = version or HISTORY_SCHEMA_VERSION
+    if version == LEGACY:
+        return None
+    return [(column, COLUMN_TYPES[column]) for column in df.columns if column in COLUMN_TYPES]
+
+def clustering(columns, version=None):
+    """Clustering columns available in a new table with `columns` (none for the legacy layout)."""
+    version = version or HISTORY_SCHEMA_VERSION
+    if version == LEGACY:
+        return None
+    return [column for column in CLUSTERING if column in columns]
+
+def number_sql(column, version=None, safe_cast='SAFE_CAST', float_type='FLOAT64'):
+    """SQL reading a numeric column as a float in schema `version`. Percent columns are in percent."""
+    version = version or HISTORY_SCHEMA_VERSION
+    if version != LEGACY:
+        return column
+    if column.split('.')[-1] in PERCENT_COLUMNS:
+        return f"{safe_cast}(REPLACE({column}, '%', '') AS {float_type})"
+    return f"{safe_cast}({column} AS {float_type})"
+
+def market_cap_sql(column='market_cap', version=None, safe_cast='SAFE_CAST', float_type='FLOAT64'):
+    """SQL reading market cap in absolute dollars in schema `version`."""
+    version = version or HISTORY_SCHEMA_VERSION
+    if version != LEGACY:
+        return column
+    return f"{safe_cast}({column} AS {float_type}) * 1000000"
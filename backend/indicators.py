@@ -0,0 +1,267 @@
+"""Technical indicators maintained incrementally at ingest.
+
+Each trading-day snapshot advances the per-ticker rolling window (rolling_state.py) and writes
+- the Bollinger bands of every ticker to `<base>_bollinger_signals`, keyed by snapshot_id and ticker;
+- volatility statistics over the last 1/5/10/20 trading days per ticker, rolled up to industries and
+  sectors with market-cap weights, to `<base>_volatility`, keyed by snapshot_id, horizon, level and name.
+Readers look these up instead of recomputing window functions over history.
+
+Every snapshot is first classified in the trading calendar (trading_calendar.py). Snapshots taken on
+non-trading days leave the state and the indicator tables untouched. The state can be rebuilt from history:
+
+    python indicators.py --seed --days 60                  # replay the last 60 snapshots into the state
+    python indicators.py --seed --days 60 --write-signals  # ... and append their signals (empty tables)
+"""
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import BQ_TABLE_BASE
+from history_schema import from_storage_layout
+import trading_calendar
+from rolling_state import RollingState, load_state, save_state
+
+logger = logging.getLogger(__name__)
+
+SERIES = ['price', 'change']
+BOLLINGER_PERIOD = 20
+BOLLINGER_WIDTH = 2
+VOLATILITY_HORIZONS = [1, 5, 10, 20]  # trading days; at most rolling_state.WINDOW
+
+SNAPSHOT_COLUMNS = ['ticker', 'company', 'sector', 'industry', 'price', 'change', 'relative_strength_index_14', 'market_cap']
+
+def bollinger_table(base_table_name=BQ_TABLE_BASE):
+    return f"{base_table_name}_bollinger_signals"
+
+def volatility_table(base_table_name=BQ_TABLE_BASE):
+    return f"{base_table_name}_volatility"
+
+def _window_stats(matrix, period):
+    """Mean, sample stddev and count of each row's last `period` observations (NaNs skipped)."""
+    valid = ~np.isnan(matrix)
+    # 1 for the most recent observation of a row, 2 for the one before, ...
+    recency = np.cumsum(valid[:, ::-1], axis=1)[:, ::-1]
+    in_window = valid & (recency <= period)
+    count = in_window.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(in_window, matrix, 0.0).sum(axis=1) / count
+        squares = np.where(in_window, (matrix - mean[:, None]) ** 2, 0.0).sum(axis=1)
+        stddev = np.sqrt(squares / (count - 1))
+    stddev[count < 2] = np.nan
+    return mean, stddev, count
+
+def bollinger_signals(state, snapshot, processed_at, snapshot_id):
+    """Bollinger bands of the tickers priced in `snapshot` (indexed by ticker) after advancing the state."""
+    snapshot = snapshot[snapshot['price'].notna()]
+    rows = state.rows(snapshot.index)
+    sma, stddev, count = (a[rows] for a in _window_stats(state.series['price'], BOLLINGER_PERIOD))
+    price = snapshot['price'].to_numpy(dtype='float64')
+    lower = sma - BOLLINGER_WIDTH * stddev
+    upper = sma + BOLLINGER_WIDTH * stddev
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Percent beyond each band; negative while inside the bands.
+        below_lower = (lower - price) / lower * 100
+        above_upper = (price - upper) / upper * 100
+    # The nearer band is the one the price is further beyond (or less far inside).
+    nearer_lower = below_lower > above_upper
+    signals = pd.DataFrame({
+        'snapshot_id': snapshot_id,
+        'processed_at': processed_at,
+        'ticker': snapshot.index.to_numpy(),
+        'company': snapshot['company'].to_numpy(),
+        'sector': snapshot['sector'].to_numpy(),
+        'industry': snapshot['industry'].to_numpy(),
+        'price': price,
+        'rsi': snapshot['relative_strength_index_14'].to_numpy(dtype='float64'),
+        # Absolute dollars, like marketCap in the aggregation tables (history stores millions).
+        'market_cap': snapshot['market_cap'].to_numpy(dtype='float64') * 1e6,
+        'sma20': sma,
+        'stddev20': stddev,
+        'lower_band': lower,
+        'upper_band': upper,
+        'band_side': np.where(nearer_lower, 'lower', 'upper'),
+        'distance_from_band': np.where(nearer_lower, below_lower, above_upper),
+        'window_size': count.astype('int64'),
+    })
+    return signals[signals['stddev20'].notna()].reset_index(drop=True)
+
+def _horizon_stats(changes, horizon):
+    """Per-row statistics of the daily changes over the last `horizon` trading days (NaNs skipped)."""
+    window = changes[:, -horizon:]
+    valid = ~np.isnan(window)
+    count = valid.sum(axis=1)
+    moves = np.abs(window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats = {
+            'latest_change': window[:, -1],
+            'atr_pct': np.where(valid, moves, 0.0).sum(axis=1) / count,
+            'avg_change': np.where(valid, window, 0.0).sum(axis=1) / count,
+            'max_move': np.where(valid, moves, -np.inf).max(axis=1),
+            'min_change': np.where(valid, window, np.inf).min(axis=1),
+            'max_change': np.where(valid, window, -np.inf).max(axis=1),
+        }
+    for values in stats.values():
+        values[count == 0] = np.nan
+    stats['days_counted'] = count
+    return stats
+
+def _rollup(tickers, level):
+    """Market-cap weighted rollup of the per-ticker rows to industries or sectors."""
+    tickers = tickers[tickers[level].notna()]
+    mcap = tickers['market_cap']
+    weighted = tickers[['latest_change', 'atr_pct', 'avg_change']].mul(mcap, axis=0)
+    weighted[level] = tickers[level]
+    weighted['mcap'] = mcap
+    grouped = weighted.groupby(level, sort=True)
+    cap = grouped['mcap'].sum(min_count=1).replace(0, np.nan)
+    rows = pd.DataFrame({
+        'name': cap.index,
+        'sector': tickers.groupby(level, sort=True)['sector'].first().to_numpy(),
+        'industry': cap.index if level == 'industry' else None,
+        'market_cap': cap.to_numpy(),
+    })
+    for column in ['latest_change', 'atr_pct', 'avg_change']:
+        rows[column] = (grouped[column].sum(min_count=1) / cap).to_numpy()
+    extremes = tickers.groupby(level, sort=True).agg(
+        max_move=('max_move', 'max'), min_change=('min_change', 'min'), max_change=('max_change', 'max'),
+        stock_count=('ticker', 'size'))
+    return pd.concat([rows, extremes.reset_index(drop=True)], axis=1)
+
+def volatility_rollups(state, snapshot, processed_at, snapshot_id):
+    """Volatility over each horizon for the tickers priced in `snapshot`, plus industry/sector rollups.
+    Tickers missing from the current snapshot are left out (their sector and market cap are unknown)."""
+    snapshot = snapshot[snapshot['price'].notna()]
+    rows = state.rows(snapshot.index)
+    changes = state.series['change'][rows]
+    frames = []
+    for horizon in VOLATILITY_HORIZONS:
+        stats = _horizon_stats(changes, horizon)
+        tickers = pd.DataFrame({
+            'ticker': snapshot.index.to_numpy(),
+            'company': snapshot['company'].to_numpy(),
+            'sector': snapshot['sector'].to_numpy(),
+            'industry': snapshot['industry'].to_numpy(),
+            'price': snapshot['price'].to_numpy(dtype='float64'),
+            'market_cap': snapshot['market_cap'].to_numpy(dtype='float64') * 1e6,
+            **stats,
+        })
+        # Tickers present on fewer than half of the horizon's trading days are left out.
+        tickers = tickers[tickers['days_counted'] >= max(1, horizon // 2)]
+        levels = {
+            'ticker': tickers.rename(columns={'ticker': 'name'}).assign(stock_count=1),
+            'industry': _rollup(tickers, 'industry'),
+            'sector': _rollup(tickers, 'sector'),
+        }
+        for level, frame in levels.items():
+            frames.append(frame.assign(horizon=horizon, level=level))
+    rollups = pd.concat(frames, ignore_index=True)
+    rollups = rollups[rollups['atr_pct'].notna()]
+    rollups.insert(0, 'snapshot_id', snapshot_id)
+    rollups.insert(1, 'processed_at', processed_at)
+    columns = ['snapshot_id', 'processed_at', 'horizon', 'level', 'name', 'company', 'sector', 'industry', 'price',
+               'market_cap', 'latest_change', 'atr_pct', 'avg_change', 'max_move', 'min_change', 'max_change',
+               'days_counted', 'stock_count']
+    rollups = rollups.reindex(columns=columns).reset_index(drop=True)
+    return rollups.astype({'horizon': 'int64', 'days_counted': 'Int64', 'stock_count': 'int64'})
+
+def _snapshot_frame(df):
+    snapshot = df[[c for c in SNAPSHOT_COLUMNS if c in df.columns]].dropna(subset=['ticker'])
+    snapshot = snapshot.drop_duplicates('ticker').set_index('ticker')
+    for column in SNAPSHOT_COLUMNS[1:]:
+        if column not in snapshot.columns:
+            snapshot[column] = np.nan
+    return snapshot
+
+def apply_snapshot(state, df, snapshot_id):
+    """Classifies the typed snapshot df (identified by snapshot_id) against `state` and advances the state
+    if it is a new trading day. Returns (calendar row or None if the state already includes the snapshot,
+    the snapshot indexed by ticker if it was a new trading day else None)."""
+    processed_at = pd.Timestamp(df['processed_at'].iloc[0])
+    if state.last_trading_day is not None and processed_at <= state.last_trading_day:
+        logger.info(f"Rolling state already includes {processed_at}; skipping.")
+        return None, None
+    snapshot = _snapshot_frame(df)
+    previous = state.latest('price') if state.last_trading_day is not None else None
+    is_trading_day, changed, compared, digest = trading_calendar.classify(previous, snapshot['price'], snapshot['market_cap'])
+    ordinal = state.meta.get(trading_calendar.ORDINAL_KEY, 0) + (1 if is_trading_day else 0)
+    state.meta[trading_calendar.ORDINAL_KEY] = ordinal
+    row = trading_calendar.calendar_row(snapshot_id, processed_at, is_trading_day, ordinal, changed, compared, digest)
+    if not is_trading_day:
+        logger.info(f"Snapshot {processed_at} repeats the prices of {state.last_trading_day}; not a trading day.")
+        return row, None
+    priced = snapshot['price'].notna()
+    state.advance(processed_at, {
+        'price': snapshot['price'][priced],
+        'change': snapshot['change'][priced],
+    })
+    return row, snapshot
+
+def record_calendar(storage, df, base_table_name=BQ_TABLE_BASE):
+    """Ingest step: classifies the snapshot in the trading calendar, saves the advanced state and appends
+    the calendar row. Returns (state, snapshot indexed by ticker) if it was a new trading day (for
+    update_indicators), else None."""
+    state = load_state(storage, SERIES)
+    if trading_calendar.ORDINAL_KEY not in state.meta:
+        state.meta[trading_calendar.ORDINAL_KEY] = trading_calendar.last_ordinal(storage, base_table_name)
+    row, snapshot = apply_snapshot(state, df, storage.snapshot_id(df['processed_at'].iloc[0]))
+    if row is None:
+        return None
+    # State first, so the calendar never has a row (and ordinal) the state doesn't include. If the
+    # append fails, `python trading_calendar.py --rebuild` restores the row.
+    save_state(storage, state)
+    storage.append_table(trading_calendar.calendar_frame([row]), trading_calendar.calendar_table(base_table_name))
+    return None if snapshot is None else (state, snapshot)
+
+def update_indicators(storage, state, snapshot, base_table_name=BQ_TABLE_BASE):
+    """Ingest step: writes the indicators of the trading day record_calendar added to `state`."""
+    written = _write_indicators(storage, state, snapshot, state.last_trading_day, base_table_name)
+    logger.info(f"Updated indicators of {len(state)} tickers; wrote {written}.")
+
+def _write_indicators(storage, state, snapshot, processed_at, base_table_name):
+    snapshot_id = storage.snapshot_id(processed_at)
+    written = {}
+    for table, rows in [(bollinger_table(base_table_name), bollinger_signals(state, snapshot, processed_at, snapshot_id)),
+                        (volatility_table(base_table_name), volatility_rollups(state, snapshot, processed_at, snapshot_id))]:
+        if not rows.empty:
+            storage.append_table(rows, table)
+        written[table] = len(rows)
+    return written
+
+def seed(storage, days=60, write_signals=False, base_table_name=BQ_TABLE_BASE):
+    """Rebuilds the state by replaying the last `days` snapshots of history."""
+    history = storage.ref(f"{base_table_name}_history")
+    frame = storage.query(f"""
+        WITH recent AS (
+            SELECT DISTINCT processed_at FROM {history} ORDER BY processed_at DESC LIMIT @days
+        )
+        SELECT h.processed_at, {', '.join('h.' + c for c in SNAPSHOT_COLUMNS)}
+        FROM {history} h JOIN recent r ON h.processed_at = r.processed_at
+    """, {'days': days})
+    frame = from_storage_layout(frame)
+    state = RollingState(SERIES, meta={trading_calendar.ORDINAL_KEY: 0})
+    trading_days = 0
+    for processed_at, df in frame.sort_values('processed_at').groupby('processed_at', sort=True):
+        _, snapshot = apply_snapshot(state, df, storage.snapshot_id(processed_at))
+        if snapshot is None:
+            continue
+        trading_days += 1
+        if write_signals:
+            _write_indicators(storage, state, snapshot, processed_at, base_table_name)
+    # Continue the ordinals of the calendar table (see trading_calendar.py --rebuild).
+    state.meta[trading_calendar.ORDINAL_KEY] = trading_calendar.last_ordinal(storage, base_table_name) or trading_days
+    save_state(storage, state)
+    print(f"Seeded rolling state with {trading_days} trading days of {frame['processed_at'].nunique()} snapshots "
+          f"({len(state)} tickers, last trading day {state.last_trading_day}).")
+
+if __name__ == '__main__':
+    from storage_backends import script_backend
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', required=True, help="rebuild the state from history")
+    parser.add_argument('--days', type=int, default=60, help="snapshots of history to replay")
+    parser.add_argument('--write-signals', action='store_true', help="also append the replayed signals")
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default='bigquery')
+    args = parser.parse_args()
+    seed(script_backend(args.backend), args.days, args.write_signals)
@@ -0,0 +1,53 @@
+"""One-row ingest watermark for cheap freshness monitoring (scripts/check_latest_updates.py).
+
+At the end of every ingest run (ok, unchanged, error), INGEST_WATERMARK_TABLE is replaced by a single row
+describing that run and the last ingested snapshot:
+
+    run_id, run_name, status, error, started_at, finished_at, duration_s, rows   # this run
+    snapshot_id, processed_at, snapshot_rows                                      # last ingested snapshot
+    last_checked_at                                                               # last run that succeeded
+                                                                                  # (ingested or unchanged)
+
+The snapshot fields come from the payload record (state/last_payload.json), so failed and unchanged
+runs keep reporting the snapshot that is actually published. A monitor reads the row with a free
+tabledata.list call instead of scanning MAX(processed_at) from history.
+"""
+import logging
+
+import pandas as pd
+
+import payload_fingerprint
+from config import INGEST_WATERMARK_TABLE
+
+logger = logging.getLogger(__name__)
+
+def _timestamp(value):
+    return pd.Timestamp(value) if value else pd.NaT
+
+def watermark_row(metrics, record=None):
+    """The watermark of a finished run (run_metrics.RunMetrics) and the payload record."""
+    record = record or {}
+    summary = metrics.summary()
+    return {
+        'run_id': metrics.run_id,
+        'run_name': metrics.name,
+        'status': metrics.status,
+        'error': metrics.error,
+        'started_at': metrics.started_at,
+        'finished_at': metrics.finished_at,
+        'duration_s': float(summary['duration_s']),
+        'rows': int(summary.get('rows', 0)),
+        'snapshot_id': record.get('snapshot_id'),
+        'processed_at': _timestamp(record.get('processed_at')),
+        'snapshot_rows': record.get('rows'),
+        'last_checked_at': _timestamp(record.get('last_checked_at')),
+    }
+
+def write(storage, metrics, table=INGEST_WATERMARK_TABLE):
+    """Replaces the watermark table with the row of `metrics` (no-op if the table is not configured)."""
+    if not table:
+        return
+    row = watermark_row(metrics, payload_fingerprint.last_payload(storage))
+    df = pd.DataFrame([row]).astype({'snapshot_rows': 'Int64', 'error': 'string', 'snapshot_id': 'string'})
+    storage.append_table(df, table, write_disposition='WRITE_TRUNCATE')
+    logger.info(f"Ingest watermark: run {row['run_id']} {row['status']}, snapshot {row['snapshot_id']}.")
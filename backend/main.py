@@ -1,232 +1,87 @@
 import functions_framework
-import json
 import logging
-import os
-import pandas as pd
-import requests
-import io
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from google.cloud import storage
-from google.cloud import bigquery
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+import run_metrics
+from clients import lazy_import
+from config import (
+    BQ_TABLE_BASE, BQ_TABLE_HISTORY, FINVIZ_API_KEY, FINVIZ_API_URL, FINVIZ_FETCH_MODE, FINVIZ_FILTER, FINVIZ_MAX_WORKERS,
+    FINVIZ_RATE_BURST, FINVIZ_RATE_LIMIT, FINVIZ_VIEWS, RAW_ARCHIVE_FORMAT, RUN_METRICS_TABLE, SKIP_UNCHANGED_PAYLOAD,
+    VIEW_CHECKPOINT_MAX_AGE_MINUTES,
+)
+
+# Heavy modules are imported on first use to keep cold starts short (see benchmark_startup.py).
+pd = lazy_import('pandas')
+history_schema = lazy_import('history_schema')
+ingest_watermark = lazy_import('ingest_watermark')
+indicators = lazy_import('indicators')
+parsing = lazy_import('parsing')
+payload_fingerprint = lazy_import('payload_fingerprint')
+read_api = lazy_import('read_api')
+shards = lazy_import('shards')
+storage_backends = lazy_import('storage_backends')
+view_checkpoints = lazy_import('view_checkpoints')
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Constants
-RAW_BUCKET_NAME = os.environ.get('RAW_BUCKET_NAME', 'finviz-raw-data')
-BQ_DATASET = os.environ.get('BQ_DATASET', 'stock_data')
-BQ_TABLE_BASE = os.environ.get('BQ_TABLE', 'processed_stock_data')
-BQ_TABLE_HISTORY = f"{BQ_TABLE_BASE}_history"
-FINVIZ_API_KEY = os.environ.get('FINVIZ_API_KEY')
-FINVIZ_API_URL = os.environ.get('FINVIZ_API_URL', 'https://elite.finviz.com/export.ashx')
+def normalize_columns(df):
+    """Renames columns to be BigQuery friendly."""
+    df.columns = [parsing.normalize_column_name(c) for c in df.columns]
+    return df
 
-def upload_to_gcs(bucket_name, destination_blob_name, data_string, content_type='application/json'):
-    """Uploads a string to GCS."""
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-        blob.upload_from_string(data_string, content_type=content_type)
-        logger.info(f"File {destination_blob_name} uploaded to {bucket_name}.")
-    except Exception as e:
-        logger.error(f"Failed to upload to GCS: {e}")
-        raise
+class TokenBucket:
+    """Thread-safe token bucket. acquire() blocks until a token is available."""
 
-def insert_into_bigquery(df, dataset_id, table_id, write_disposition="WRITE_APPEND"):
-    """Inserts a Pandas DataFrame into BigQuery."""
-    try:
-        client = bigquery.Client()
-        table_ref = client.dataset(dataset_id).table(table_id)
-        
-        job_config = bigquery.LoadJobConfig(
-            write_disposition=write_disposition,
-            autodetect=True,
-        )
-        
-        job = client.load_table_from_dataframe(df, table_ref, job_config=job_config)
-        job.result() # Wait for completion
-        logger.info(f"Loaded {len(df)} rows into {dataset_id}.{table_id}.")
-    except Exception as e:
-        logger.error(f"Failed to insert into BigQuery {table_id}: {e}")
-        raise
+    def __init__(self, rate, capacity):
+        # Checked here, at import for the shared limiter: a zero rate would stall or crash every fetch thread.
+        if not rate > 0:
+            raise ValueError(f"Rate limit must be a positive number of requests per second (FINVIZ_RATE_LIMIT), got {rate}.")
+        if capacity < 1:
+            raise ValueError(f"Burst size must be at least 1 (FINVIZ_RATE_BURST), got {capacity}.")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
 
-def set_all_historical(dataset_id, table_id):
-    """Sets is_current to 'no' for all existing rows in the cumulative table."""
-    try:
-        client = bigquery.Client()
-        query = f"UPDATE `{client.project}.{dataset_id}.{table_id}` SET is_current = 'no' WHERE is_current = 'yes'"
-        query_job = client.query(query)
-        query_job.result()
-        logger.info(f"Set all legacy records to is_current='no' in {table_id}.")
-    except Exception as e:
-        # If the table doesn't exist yet, we might get an error. Just log and continue.
-        logger.warning(f"Could not update is_current in {table_id} (might be new): {e}")
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
-def _rebuild_aggregation_tables(client, project_id, raw_table, industry_table, sector_table):
-    """Full rebuild of industry and sector tables from all historical data. Used as a fallback."""
-    logger.warning("FALLBACK: Rebuilding aggregation tables from scratch...")
-    
-    raw_cte = f"""
-        WITH raw_data AS (
-            SELECT
-                industry, sector, processed_at, is_current, ticker,
-                SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week,
-                SAFE_CAST(REPLACE(performance_month, '%', '') AS FLOAT64) as pct_month,
-                SAFE_CAST(REPLACE(performance_quarter, '%', '') AS FLOAT64) as pct_quarter,
-                SAFE_CAST(REPLACE(change, '%', '') AS FLOAT64) as pct_change,
-                SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-                SAFE_CAST(market_cap AS FLOAT64) * 1000000 as mcap
-            FROM `{raw_table}`
-        )
-    """
-
-    agg_select = """
-        SELECT
-            CAST(processed_at AS STRING) as snapshot_id, MAX(processed_at) as processed_at, is_current,
-            {group_col} as name, {parent_sector},
-            SUM(pct_change * mcap) / NULLIF(SUM(mcap), 0) as change,
-            SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0) as week,
-            SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0) as month,
-            SUM(pct_quarter * mcap) / NULLIF(SUM(mcap), 0) as quarter,
-            SUM(rsi * mcap) / NULLIF(SUM(mcap), 0) as rsi,
-            (SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0)) - ((SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0)) / 4) as momentum,
-            AVG(pct_change) as changeEqual, AVG(pct_week) as weekEqual, AVG(pct_month) as monthEqual, AVG(pct_quarter) as quarterEqual, AVG(rsi) as rsiEqual, AVG(pct_week) - (AVG(pct_month) / 4) as momentumEqual,
-            SUM(mcap) as marketCap, COUNT(*) as stockCount,
-            ARRAY_AGG(STRUCT(ticker, pct_week as week) IGNORE NULLS ORDER BY pct_week DESC LIMIT 5) as topStocks
-        FROM raw_data
-        WHERE {group_col} IS NOT NULL
-        GROUP BY CAST(processed_at AS STRING), is_current, {group_col}
-    """
-    
-    # Rebuild industry table
-    query_industry = f"CREATE OR REPLACE TABLE `{industry_table}` AS {raw_cte} {agg_select.format(group_col='industry', parent_sector='ANY_VALUE(sector) as parent_sector')}"
-    client.query(query_industry).result()
-    logger.info(f"FALLBACK: Rebuilt {industry_table} from scratch.")
-    
-    # Rebuild sector table  
-    query_sector = f"CREATE OR REPLACE TABLE `{sector_table}` AS {raw_cte} {agg_select.format(group_col='sector', parent_sector='CAST(NULL as STRING) as parent_sector')}"
-    client.query(query_sector).result()
-    logger.info(f"FALLBACK: Rebuilt {sector_table} from scratch.")
-
-
-def aggregate_current_data(dataset_id, base_table_name):
-    """Aggregates the current snapshot and appends to the industry and sector history tables.
-    Falls back to a full rebuild if the incremental approach fails."""
-    client = bigquery.Client()
-    project_id = client.project
-    raw_table = f"{project_id}.{dataset_id}.{base_table_name}_history"
-    industry_table = f"{project_id}.{dataset_id}.{base_table_name}_industry_history"
-    sector_table = f"{project_id}.{dataset_id}.{base_table_name}_sector_history"
-    
-    try:
-        # 1. Set current='no' in aggregate tables
-        for table in [industry_table, sector_table]:
-            results = client.query(f"UPDATE `{table}` SET is_current = 'no' WHERE is_current = 'yes'").result()
-            logger.info(f"Set legacy records to is_current='no' in {table}. Rows affected: {results.num_dml_affected_rows}")
-                
-        # 2. Insert Industry Aggregation
-        query_industry = f"""
-        INSERT INTO `{industry_table}` (
-            snapshot_id, processed_at, is_current, name, parent_sector,
-            change, week, month, quarter, rsi, momentum,
-            changeEqual, weekEqual, monthEqual, quarterEqual, rsiEqual, momentumEqual,
-            marketCap, stockCount, topStocks
-        )
-        WITH raw_data AS (
-            SELECT
-                industry, sector, processed_at, is_current, ticker,
-                SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week,
-                SAFE_CAST(REPLACE(performance_month, '%', '') AS FLOAT64) as pct_month,
-                SAFE_CAST(REPLACE(performance_quarter, '%', '') AS FLOAT64) as pct_quarter,
-                SAFE_CAST(REPLACE(change, '%', '') AS FLOAT64) as pct_change,
-                SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-                SAFE_CAST(market_cap AS FLOAT64) * 1000000 as mcap
-            FROM `{raw_table}`
-            WHERE is_current = 'yes'
-        )
-        SELECT
-            CAST(processed_at AS STRING) as snapshot_id, MAX(processed_at) as processed_at, 'yes' as is_current,
-            industry as name, ANY_VALUE(sector) as parent_sector,
-            SUM(pct_change * mcap) / NULLIF(SUM(mcap), 0) as change,
-            SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0) as week,
-            SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0) as month,
-            SUM(pct_quarter * mcap) / NULLIF(SUM(mcap), 0) as quarter,
-            SUM(rsi * mcap) / NULLIF(SUM(mcap), 0) as rsi,
-            (SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0)) - ((SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0)) / 4) as momentum,
-            AVG(pct_change) as changeEqual, AVG(pct_week) as weekEqual, AVG(pct_month) as monthEqual, AVG(pct_quarter) as quarterEqual, AVG(rsi) as rsiEqual, AVG(pct_week) - (AVG(pct_month) / 4) as momentumEqual,
-            SUM(mcap) as marketCap, COUNT(*) as stockCount,
-            ARRAY_AGG(STRUCT(ticker, pct_week as week) IGNORE NULLS ORDER BY pct_week DESC LIMIT 5) as topStocks
-        FROM raw_data WHERE industry IS NOT NULL GROUP BY CAST(processed_at AS STRING), industry
-        """
-        client.query(query_industry).result()
-        logger.info(f"Appended current industry aggregation to {industry_table}.")
-        
-        # 3. Insert Sector Aggregation
-        query_sector = f"""
-        INSERT INTO `{sector_table}` (
-            snapshot_id, processed_at, is_current, name, parent_sector,
-            change, week, month, quarter, rsi, momentum,
-            changeEqual, weekEqual, monthEqual, quarterEqual, rsiEqual, momentumEqual,
-            marketCap, stockCount, topStocks
-        )
-        WITH raw_data AS (
-            SELECT
-                sector, processed_at, is_current, ticker,
-                SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week,
-                SAFE_CAST(REPLACE(performance_month, '%', '') AS FLOAT64) as pct_month,
-                SAFE_CAST(REPLACE(performance_quarter, '%', '') AS FLOAT64) as pct_quarter,
-                SAFE_CAST(REPLACE(change, '%', '') AS FLOAT64) as pct_change,
-                SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-                SAFE_CAST(market_cap AS FLOAT64) * 1000000 as mcap
-            FROM `{raw_table}`
-            WHERE is_current = 'yes'
-        )
-        SELECT
-            CAST(processed_at AS STRING) as snapshot_id, MAX(processed_at) as processed_at, 'yes' as is_current,
-            sector as name, CAST(NULL as STRING) as parent_sector,
-            SUM(pct_change * mcap) / NULLIF(SUM(mcap), 0) as change,
-            SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0) as week,
-            SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0) as month,
-            SUM(pct_quarter * mcap) / NULLIF(SUM(mcap), 0) as quarter,
-            SUM(rsi * mcap) / NULLIF(SUM(mcap), 0) as rsi,
-            (SUM(pct_week * mcap) / NULLIF(SUM(mcap), 0)) - ((SUM(pct_month * mcap) / NULLIF(SUM(mcap), 0)) / 4) as momentum,
-            AVG(pct_change) as changeEqual, AVG(pct_week) as weekEqual, AVG(pct_month) as monthEqual, AVG(pct_quarter) as quarterEqual, AVG(rsi) as rsiEqual, AVG(pct_week) - (AVG(pct_month) / 4) as momentumEqual,
-            SUM(mcap) as marketCap, COUNT(*) as stockCount,
-            ARRAY_AGG(STRUCT(ticker, pct_week as week) IGNORE NULLS ORDER BY pct_week DESC LIMIT 5) as topStocks
-        FROM raw_data WHERE sector IS NOT NULL GROUP BY CAST(processed_at AS STRING), sector
-        """
-        client.query(query_sector).result()
-        logger.info(f"Appended current sector aggregation to {sector_table}.")
-        
-        # 4. Verify that current data exists in the aggregation tables
-        for table_name, table_ref in [("industry", industry_table), ("sector", sector_table)]:
-            check = client.query(f"SELECT COUNT(*) as cnt FROM `{table_ref}` WHERE is_current = 'yes'").result()
-            count = list(check)[0].cnt
-            if count == 0:
-                raise RuntimeError(f"Verification failed: {table_name} table has 0 rows with is_current='yes' after INSERT.")
-            logger.info(f"Verified {table_name} aggregation: {count} current rows.")
-        
-    except Exception as e:
-        logger.error(f"Incremental aggregation failed: {e}. Falling back to full rebuild...")
-        try:
-            _rebuild_aggregation_tables(client, project_id, raw_table, industry_table, sector_table)
-            logger.info("Full rebuild fallback completed successfully.")
-        except Exception as rebuild_err:
-            logger.error(f"CRITICAL: Full rebuild also failed: {rebuild_err}")
-            raise
+_session = None
+_session_lock = threading.Lock()
+_rate_limiter = TokenBucket(FINVIZ_RATE_LIMIT, FINVIZ_RATE_BURST)
 
-def normalize_columns(df):
-    """Renames columns to be BigQuery friendly."""
-    import re
-    # Lowercase, replace special chars with _, strip leading/trailing underscores
-    df.columns = [re.sub(r'[^a-z0-9_]', '_', c.lower()).strip('_') for c in df.columns]
-    # Avoid double underscores
-    df.columns = [re.sub(r'_{2,}', '_', c) for c in df.columns]
-    return df
+def get_http_session():
+    """Returns the process-wide pooled HTTP session used for all Finviz requests."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, FINVIZ_MAX_WORKERS))
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
 
 def _log_retry(retry_state):
+    run_metrics.add('retries')
+    run_metrics.add('retry_backoff_s', retry_state.next_action.sleep)
     logger.warning(f"Retrying Finviz fetch after exception (attempt {retry_state.attempt_number}): {retry_state.outcome.exception()}")
 
 @retry(
@@ -236,113 +91,296 @@ def _log_retry(retry_state):
     before_sleep=_log_retry,
     reraise=True
 )
-def fetch_view_api(url, view_name):
-    """Fetches Finviz view with exponential backoff on any exception."""
-    response = requests.get(url, timeout=30)
-    
-    # Let requests handle raising HTTP parsing errors
-    response.raise_for_status()
+def fetch_view_api(url, view_name, allow_empty=False):
+    """Fetches Finviz view with exponential backoff on any exception. With `allow_empty`, a CSV with no
+    rows is a valid result (see parsing.parse_view_csv)."""
+    # One span per attempt; download and parse overlap because the body is streamed into the parser.
+    with run_metrics.span('fetch_attempt', view=view_name) as span:
+        run_metrics.add('fetch_attempts')
+        # Every attempt (including retries) takes a token so we never exceed the configured rate.
+        with run_metrics.span('rate_limit_wait', view=view_name):
+            _rate_limiter.acquire()
+        # Stream the body straight into the typed CSV parser instead of decoding it into a str first.
+        with get_http_session().get(url, timeout=30, stream=True) as response:
+            # Let requests handle raising HTTP parsing errors
+            response.raise_for_status()
+            response.raw.decode_content = True
+            # Empty payloads (which occur occasionally on FinViz timeout) raise ValueError in the parser
+            df = parsing.parse_view_csv(response.raw, view_name, allow_empty=allow_empty)
+            # Bytes read off the wire (compressed, if the server used Content-Encoding)
+            run_metrics.add('bytes_downloaded', response.raw.tell())
+        if span is not None:
+            span['attrs'].update(rows=len(df), bytes=response.raw.tell())
+        return df
+
+def fetch_view(view_name, view_id, filter_param, api_url, api_key, checkpoints=None, shard=None):
+    """Entry point for fetching a Finviz View. Will hard crash the flow if it fails after all retries.
+    With `checkpoints` (view_checkpoints.ViewCheckpoints), a staged copy is reused and a fetched view staged.
+    `shard` (a Finviz filter, see shards.py) restricts the export to one shard of the universe."""
+    if checkpoints is not None:
+        df = checkpoints.load(view_name, view_id, shard)
+        if df is not None:
+            return df
+    url = f"{api_url}?v={view_id}&f={shards.shard_filter(filter_param, shard)}&auth={api_key}"
+    logger.info(f"Fetching view: {view_name} (v={view_id}{f', shard {shard}' if shard else ''})...")
     
-    # Catch empty responses which occur occasionally on FinViz timeout
-    if not response.text or len(response.text.strip()) == 0:
-         raise ValueError(f"View {view_name} returned an empty payload.")
-         
-    df = pd.read_csv(io.StringIO(response.text))
-    if df.empty:
-        raise ValueError(f"View {view_name} returned a CSV with no visible rows.")
+    # We let tenacity handle the retry and simply bubble up the Exception if it ultimately fails. A shard
+    # may legitimately match no tickers; the merged universe is checked by shards.check_coverage.
+    df = fetch_view_api(url, view_name, allow_empty=shard is not None)
+    if checkpoints is not None:
+        checkpoints.save(view_name, view_id, df, shard)
     return df
 
-def fetch_view(view_name, view_id, filter_param, api_url, api_key):
-    """Entry point for fetching a Finviz View. Will hard crash the flow if it fails after all retries."""
-    url = f"{api_url}?v={view_id}&f={filter_param}&auth={api_key}"
-    logger.info(f"Fetching view: {view_name} (v={view_id})...")
+def fetch_views(views, filter_param, api_url, api_key, mode=None, checkpoints=None, shard_filters=None):
+    """Fetches all views and returns [(view_name, df)] in the order given.
+
+    In 'concurrent' mode the views are fetched on a thread pool sharing one HTTP session and
+    the rate limiter, so the total latency is bounded by the slowest view. Any view that fails
+    after all retries aborts the whole fetch; with `checkpoints`, the views fetched until then stay staged
+    for the next run. With `shard_filters`, every view is fetched once per shard on the same pool and
+    its shards are combined into one frame (shards.combine)."""
+    mode = mode or FINVIZ_FETCH_MODE
+    tasks = [(name, view_id, shard) for name, view_id in views for shard in shard_filters or [None]]
+    if mode == 'sequential' or len(tasks) <= 1:
+        frames = [fetch_view(name, view_id, filter_param, api_url, api_key, checkpoints, shard) for name, view_id, shard in tasks]
+    else:
+        started = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=max(1, min(FINVIZ_MAX_WORKERS, len(tasks))), thread_name_prefix='finviz')
+        try:
+            # Each task runs in a copy of this context so its spans land in the current run.
+            futures = [executor.submit(contextvars.copy_context().run, fetch_view, name, view_id, filter_param, api_url, api_key,
+                                       checkpoints, shard)
+                       for name, view_id, shard in tasks]
+            frames = [future.result() for future in futures]
+        finally:
+            # On failure, don't start views that are still queued.
+            executor.shutdown(wait=True, cancel_futures=True)
+        logger.info(f"Fetched {len(tasks)} exports concurrently in {time.monotonic() - started:.1f}s.")
+
+    if not shard_filters:
+        return [(name, df) for (name, _, _), df in zip(tasks, frames)]
+    fetched = list(zip(tasks, frames))
+    return [(name, shards.combine(name, [(shard, df) for (task_name, _, shard), df in fetched if task_name == name]))
+            for name, _ in views]
+
+
+def merge_views(view_frames):
+    """Combines [(view_name, df)] into one frame with a single index-aligned concat keyed on Ticker.
+
+    Columns that repeat across views are taken from the first view that has them. Returns the merged
+    frame and a report of duplicate tickers (dropped, first row kept) and tickers missing from a view."""
+    report = {'duplicates': {}, 'missing': {}}
+    seen = {'Ticker'}
+    parts = []
+    for view_name, df in view_frames:
+        cols = [c for c in df.columns if c not in seen]
+        seen.update(cols)
+        df = df[df['Ticker'].notna()]
+        duplicated = df['Ticker'].duplicated(keep='first')
+        if duplicated.any():
+            report['duplicates'][view_name] = sorted(df.loc[duplicated, 'Ticker'].unique().tolist())
+            df = df[~duplicated]
+        parts.append((view_name, df.set_index('Ticker')[cols]))
+
+    merged = pd.concat([part for _, part in parts], axis=1, join='outer', sort=True)
+    for view_name, part in parts:
+        missing = merged.index.difference(part.index)
+        if len(missing):
+            report['missing'][view_name] = missing.tolist()
+
+    for view_name, tickers in report['duplicates'].items():
+        logger.warning(f"View {view_name} returned {len(tickers)} duplicate tickers (kept first row): {tickers[:20]}")
+    for view_name, tickers in report['missing'].items():
+        logger.warning(f"View {view_name} is missing {len(tickers)} of {len(merged)} tickers: {tickers[:20]}")
+
+    merged.index.name = 'Ticker'
+    return merged.reset_index(), report
+
+def transform_snapshot(df):
+    """Normalizes the merged views and stamps the snapshot. Returns the typed frame (used for the
+    aggregation) and the storage-layout frame written to the daily and history tables."""
+    logger.info("Starting data transformation...")
+    df = normalize_columns(df)
+    
+    logger.info(f"Normalized columns: {df.columns.tolist()}")
+    
+    # Add a timestamp and current flag
+    # Whole seconds, so the snapshot_id computed at ingest equals CAST(processed_at AS STRING).
+    df['processed_at'] = pd.Timestamp.now().floor('s')
+    df['is_current'] = 'yes'
     
-    # We let tenacity handle the retry and simply bubble up the Exception if it ultimately fails
-    return fetch_view_api(url, view_name)
+    # Example Calculation: Volatility (if Price and Change are available)
+    if 'change' in df.columns:
+        df['change_pct'] = df['change']
+    
+    # The history tables use the layout of HISTORY_SCHEMA_VERSION; convert at the storage boundary.
+    return df, history_schema.to_storage_layout(df)
+
+
+def _store_run_metrics(metrics):
+    """Replaces the ingest watermark and appends the run summary to RUN_METRICS_TABLE (if configured)."""
+    storage = storage_backends.get_storage_backend()
+    ingest_watermark.write(storage, metrics)
+    if RUN_METRICS_TABLE:
+        storage.append_table(pd.DataFrame([metrics.table_row()]), RUN_METRICS_TABLE)
 
+def _force_requested(request):
+    """True if the request asks to ingest even an unchanged payload (`?force=true`)."""
+    args = getattr(request, 'args', None) or {}
+    return str(args.get('force', '')).lower() in ('1', 'true', 'yes')
 
 @functions_framework.http
 def process_finviz_data(request):
     """Cloud Function entry point."""
+    with run_metrics.run('ingest', sink=_store_run_metrics) as metrics:
+        try:
+            return _ingest(metrics, force=_force_requested(request))
+        except Exception as e:
+            metrics.fail(e)
+            logger.error(f"Error in data pipeline: {e}")
+            return f"Error: {str(e)}", 500
+
+@functions_framework.http
+def resume_finviz_data(request):
+    """Cloud Function entry point resuming today's failed run from its checkpointed views (see
+    view_checkpoints.py): `?max_age_minutes=` (default: any age). `?date=` must be today if given."""
+    args = getattr(request, 'args', None) or {}
+    today = datetime.now().strftime('%Y-%m-%d')
+    if args.get('date') and args['date'] != today:
+        # The run is stamped, archived and published as now; another day's views would become today's snapshot.
+        return f"Error: can only resume today's run ({today}), not {args['date']}.", 400
+    with run_metrics.run('ingest_resume', sink=_store_run_metrics) as metrics:
+        try:
+            max_age = args.get('max_age_minutes')
+            return _ingest(metrics, force=_force_requested(request),
+                           checkpoint_max_age=int(max_age) if max_age else None)
+        except Exception as e:
+            metrics.fail(e)
+            logger.error(f"Error in resumed data pipeline: {e}")
+            return f"Error: {str(e)}", 500
+
+@functions_framework.http
+def serve_finviz_data(request):
+    """Cloud Function entry point of the cached read API (see read_api.py)."""
+    try:
+        return read_api.handle(request)
+    except Exception as e:
+        logger.error(f"Error in read API: {e}")
+        return f"Error: {str(e)}", 500
+
+def _ingest(metrics, force=False, checkpoint_max_age=VIEW_CHECKPOINT_MAX_AGE_MINUTES, storage=None):
+    """Runs the pipeline. Fetched views are checkpointed under today's date and checkpoints younger than
+    `checkpoint_max_age` minutes are reused (None: any age, 0: no checkpoints).
+    `storage` defaults to the configured backend (benchmark_ingest.py passes its own)."""
     now = datetime.now()
     date_path = now.strftime('%Y/%m/%d')
-    raw_filename = f"{date_path}/raw.json"
+    raw_prefix = f"{date_path}/raw"
     
-    try:
-        logger.info("Starting FinViz data ingestion via API...")
-        
-        if not FINVIZ_API_KEY:
-            raise ValueError("FINVIZ_API_KEY environment variable is not set.")
-
-        # List of views to fetch and merge
-        views = [
-            ('overview', '111'),
-            ('valuation', '121'),
-            ('financial', '161'),
-            ('performance', '141'),
-            ('technical', '171'),
-            ('custom', '152')
-        ]
-        
-        merged_df = None
-        filter_param = "cap_midover" # Mid-cap and over
-
-        import time
-        for view_name, view_id in views:
-            df_view = fetch_view(view_name, view_id, filter_param, FINVIZ_API_URL, FINVIZ_API_KEY)
-            
-            # Since fetch_view now raises on permanent failure, if we get here we have valid data.
-            if merged_df is None:
-                merged_df = df_view
-            else:
-                # Merge on Ticker, avoiding duplicate columns except Ticker
-                cols_to_use = df_view.columns.difference(merged_df.columns).tolist()
-                cols_to_use.append('Ticker')
-                merged_df = pd.merge(merged_df, df_view[cols_to_use], on='Ticker', how='outer')
-            
-            # Add a small delay between views to avoid rate limits
-            time.sleep(2)
-
-        if merged_df is None or merged_df.empty:
-            logger.warning("No data fetched from FinViz views.")
-            return "No data fetched", 200
-
-        df = merged_df
-        # 2. Raw Storage: Save untouched raw data to GCS
-        raw_data = df.to_json(orient='records')
-        upload_to_gcs(RAW_BUCKET_NAME, raw_filename, raw_data)
-        
-        # 3. Transformation: Process the raw data
-        logger.info("Starting data transformation...")
-        df = normalize_columns(df)
-        
-        logger.info(f"Normalized columns: {df.columns.tolist()}")
-        
-        # Add a timestamp and current flag
-        df['processed_at'] = pd.Timestamp.now()
-        df['is_current'] = 'yes'
-        
-        # Example Calculation: Volatility (if Price and Change are available)
-        if 'change' in df.columns:
-            df['change_pct'] = df['change'].str.replace('%', '').astype(float)
-        
-        # 4. Final Storage: Layered approach
-        # 4a. Daily Table (WRITE_TRUNCATE because it's only for this day)
-        date_suffix = now.strftime('%Y%m%d')
-        daily_table = f"{BQ_TABLE_BASE}_{date_suffix}"
-        insert_into_bigquery(df, BQ_DATASET, daily_table, write_disposition="WRITE_TRUNCATE")
-        
-        # 4b. Cumulative/History Table
-        # Update existing records to is_current='no'
-        set_all_historical(BQ_DATASET, BQ_TABLE_HISTORY)
-        # Append new records
-        insert_into_bigquery(df, BQ_DATASET, BQ_TABLE_HISTORY, write_disposition="WRITE_APPEND")
-        
-        # 4c. Pre-calculate aggregations into historical tables
-        aggregate_current_data(BQ_DATASET, BQ_TABLE_BASE)
-        
-        return f"Successfully processed {len(df)} tickers into {daily_table} and {BQ_TABLE_HISTORY}.", 200
+    logger.info("Starting FinViz data ingestion via API...")
+    
+    if not FINVIZ_API_KEY:
+        raise ValueError("FINVIZ_API_KEY environment variable is not set.")
+
+    filter_param = FINVIZ_FILTER # Mid-cap and over by default
+    shard_filters = shards.resolve()
+    # Persistence goes through the configured storage backend (BigQuery + GCS, or local DuckDB/Parquet).
+    storage = storage or storage_backends.get_storage_backend()
+
+    # 1. Fetch every view, staging each one so a failed run can resume without downloading it again.
+    checkpoints = view_checkpoints.ViewCheckpoints(storage, now.strftime('%Y-%m-%d'), filter_param,
+                                                   max_age=checkpoint_max_age)
+    # fetch_views raises on permanent failure, so if we get here every view has valid data.
+    with run_metrics.span('fetch'):
+        view_frames = fetch_views(FINVIZ_VIEWS, filter_param, FINVIZ_API_URL, FINVIZ_API_KEY, checkpoints=checkpoints,
+                                  shard_filters=shard_filters)
+    with run_metrics.span('merge'):
+        merged_df, merge_report = merge_views(view_frames)
+    del view_frames
+
+    if merged_df.empty:
+        logger.warning("No data fetched from FinViz views.")
+        checkpoints.clear(FINVIZ_VIEWS, shard_filters)
+        return "No data fetched", 200
+
+    df = merged_df
+    run_metrics.add('rows', len(df))
+    skip_unchanged = SKIP_UNCHANGED_PAYLOAD and not force
+    # The last ingested snapshot, read once for the coverage check and the unchanged-payload skip.
+    last = payload_fingerprint.last_payload(storage) if shard_filters or skip_unchanged else None
+    if shard_filters:
+        # A missing or truncated shard would silently shrink the universe; don't resume from its checkpoint.
+        try:
+            shards.check_coverage(len(df), last and last.get('rows'))
+        except ValueError:
+            checkpoints.clear(FINVIZ_VIEWS, shard_filters)
+            raise
 
+    # 1b. Skip everything below if Finviz serves the same data as the last ingested snapshot.
+    with run_metrics.span('fingerprint'):
+        digest = payload_fingerprint.fingerprint(df)
+    previous = last if skip_unchanged else None
+    if previous is not None and previous.get('fingerprint') == digest:
+        payload_fingerprint.record_no_change(storage, previous)
+        metrics.skip()
+        checkpoints.clear(FINVIZ_VIEWS, shard_filters)
+        return f"No change since snapshot {previous['snapshot_id']}; skipped {len(df)} tickers.", 200
+
+    # 2. Raw Storage: Save untouched raw data
+    with run_metrics.span('raw_upload', format=RAW_ARCHIVE_FORMAT):
+        if RAW_ARCHIVE_FORMAT in ('parquet', 'both'):
+            storage.write_raw_archive(df, f"{raw_prefix}.parquet")
+        if RAW_ARCHIVE_FORMAT in ('json', 'both'):
+            # The JSON archive keeps the legacy raw.json layout: "1.23%" strings and null for missing values.
+            storage.put_blob(f"{raw_prefix}.json", parsing.to_legacy_layout(df).to_json(orient='records'))
+    
+    # 3. Transformation: Process the raw data
+    with run_metrics.span('normalize'):
+        df, bq_df = transform_snapshot(df)
+    
+    # 4. Final Storage: Layered approach
+    # 4a. Daily Table (WRITE_TRUNCATE because it's only for this day)
+    date_suffix = now.strftime('%Y%m%d')
+    daily_table = f"{BQ_TABLE_BASE}_{date_suffix}"
+    with run_metrics.span('load'):
+        with run_metrics.span('load_daily'):
+            storage.append_table(bq_df, daily_table, write_disposition="WRITE_TRUNCATE",
+                                 schema=history_schema.table_schema(bq_df), clustering=history_schema.clustering(bq_df.columns))
+        
+        # 4b. Cumulative/History Table, 4c. pre-calculated aggregations, then (pointer layout) publish the
+        # snapshot last so readers never see a half-written one.
+        with run_metrics.span('load_history'):
+            storage.append_history(bq_df)
+    with run_metrics.span('aggregate'):
+        storage.aggregate(df)
+    # 4d. Trading calendar (and the rolling state), then the incrementally maintained indicators. Derived
+    # data: a failure is logged and counted in the run metrics but doesn't fail the run.
+    trading_day = None
+    try:
+        with run_metrics.span('calendar'):
+            trading_day = indicators.record_calendar(storage, df)
     except Exception as e:
-        logger.error(f"Error in data pipeline: {e}")
-        return f"Error: {str(e)}", 500
+        run_metrics.add('calendar_failed')
+        logger.error(f"Trading calendar update failed (the snapshot is still published): {e}")
+    if trading_day is not None:
+        try:
+            with run_metrics.span('indicators'):
+                indicators.update_indicators(storage, *trading_day)
+        except Exception as e:
+            run_metrics.add('indicators_failed')
+            logger.error(f"Indicator update failed (the snapshot is still published): {e}")
+    with run_metrics.span('publish'):
+        storage.publish_snapshot(df['processed_at'].iloc[0], len(df))
+    # Only a fully written snapshot becomes the reference for unchanged-payload checks. The snapshot is
+    # already published: a failure is logged and counted, and the next run just ingests the payload again.
+    record = {}
+    try:
+        record = payload_fingerprint.record_payload(storage, digest, df['processed_at'].iloc[0], len(df))
+    except Exception as e:
+        run_metrics.add('payload_record_failed')
+        logger.error(f"Could not record the payload fingerprint (the snapshot is still published): {e}")
+    # Read API instances in this process drop their cache now; others on their next version check.
+    read_api.invalidate(record.get('snapshot_id'))
+    # The run succeeded: the next one starts from fresh data instead of these views.
+    checkpoints.clear(FINVIZ_VIEWS, shard_filters)
+    
+    return f"Successfully processed {len(df)} tickers into {daily_table} and {BQ_TABLE_HISTORY}.", 200
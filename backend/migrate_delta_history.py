@@ -0,0 +1,147 @@
+"""One-time conversion of the pointer-layout history to delta-encoded history (see delta_history.py).
+
+  1. create `<base>_history_fast` (partitioned by DATE(processed_at), clustered by ticker) and
+     `<base>_history_slow` (clustered by ticker) in BigQuery,
+  2. replay history_data in batches of days: every row into the fast table, the slow fields only where
+     they changed since the ticker's previous version (resumes after the last copied snapshot),
+  3. check that the reassembled latest snapshot equals the original and the row counts match,
+  4. replace the `<base>_history_data` table with the reassembly view (the local backend moves the
+     table's directory to <root>/backup/ and creates the view itself).
+
+Prints the plan by default; pass --execute to run it. Deploy with HISTORY_MODE=delta afterwards.
+"""
+import argparse
+import os
+import shutil
+
+import pandas as pd
+
+import delta_history
+from config import BQ_TABLE_BASE
+
+def _bigquery_ddl(storage, tables, slow_cols):
+    source = f"`{storage.table_name(tables['data'])}`"
+    return [
+        f"""CREATE TABLE IF NOT EXISTS `{storage.table_name(tables['fast'])}`
+            PARTITION BY DATE(processed_at) CLUSTER BY ticker AS
+            SELECT * EXCEPT({', '.join(slow_cols)}) FROM {source} WHERE FALSE""",
+        f"""CREATE TABLE IF NOT EXISTS `{storage.table_name(tables['slow'])}` CLUSTER BY ticker AS
+            SELECT ticker, processed_at as valid_from, CAST(0 AS INT64) as row_hash, {', '.join(slow_cols)}
+            FROM {source} WHERE FALSE""",
+    ]
+
+def _copied_until(storage, fast_table):
+    try:
+        value = storage.query(f"SELECT MAX(processed_at) as processed_at FROM {storage.ref(fast_table)}")['processed_at'].iloc[0]
+    except Exception:
+        return None
+    return None if pd.isna(value) else pd.Timestamp(value)
+
+def copy_history(storage, tables, days_per_batch):
+    """Replays history_data into the fast and slow tables. Returns the number of snapshots copied."""
+    since = _copied_until(storage, tables['fast'])
+    days = storage.query(f"""
+        SELECT DISTINCT CAST(CAST(processed_at AS DATE) AS STRING) as day FROM {storage.ref(tables['data'])}
+        ORDER BY day""")['day'].tolist()
+    if since is not None:
+        days = [day for day in days if day >= since.strftime('%Y-%m-%d')]
+        print(f"Resuming after {since}.")
+    hashes = delta_history.latest_hashes(storage, tables['slow'])
+    copied = 0
+    for start in range(0, len(days), days_per_batch):
+        batch = days[start:start + days_per_batch]
+        rows = storage.query(f"""
+            SELECT * FROM {storage.ref(tables['data'])}
+            WHERE CAST(processed_at AS DATE) BETWEEN CAST(@first AS DATE) AND CAST(@last AS DATE)""",
+            {'first': batch[0], 'last': batch[-1]})
+        rows = rows.drop(columns=['processed_date'], errors='ignore')
+        if since is not None:
+            rows = rows[pd.to_datetime(rows['processed_at']) > since]
+        fast_parts, slow_parts = [], []
+        for _, snapshot in rows.groupby('processed_at', sort=True):
+            fast, slow = delta_history.split_snapshot(snapshot)
+            changed = delta_history.changed_records(slow, hashes)
+            hashes = pd.concat([hashes[~hashes.index.isin(changed['ticker'])], changed.set_index('ticker')['row_hash']])
+            fast_parts.append(fast)
+            slow_parts.append(changed)
+            copied += 1
+        if fast_parts:
+            # Slow first: the fast table's last snapshot marks where a resumed run continues.
+            slow = pd.concat(slow_parts, ignore_index=True)
+            if not slow.empty:
+                storage.append_table(slow, tables['slow'], schema=delta_history.table_schema(slow))
+            fast = pd.concat(fast_parts, ignore_index=True)
+            storage.append_table(fast, tables['fast'], schema=delta_history.table_schema(fast))
+        print(f"Copied {batch[0]} .. {batch[-1]}: {len(fast_parts)} snapshots.")
+    return copied
+
+def _reassembly(storage, tables, slow_cols):
+    quote = '`' if storage.dialect == 'bigquery' else '"'
+    return delta_history.reassembly_sql(storage.table_name(tables['fast']), storage.table_name(tables['slow']),
+                                        slow_cols, quote=quote)
+
+def verify(storage, tables, slow_cols):
+    """Compares the row counts and the latest snapshot of history_data with their reassembly."""
+    count_sql = "SELECT COUNT(*) as n FROM {}"
+    original = int(storage.query(count_sql.format(storage.ref(tables['data'])))['n'].iloc[0])
+    copied = int(storage.query(count_sql.format(storage.ref(tables['fast'])))['n'].iloc[0])
+    if original != copied:
+        raise RuntimeError(f"Row count mismatch: {original} rows in {tables['data']}, {copied} in {tables['fast']}.")
+    latest = f"(SELECT MAX(processed_at) FROM {storage.ref(tables['data'])})"
+    frames = [
+        storage.query(f"SELECT * FROM {source} WHERE processed_at = {latest}")
+        .drop(columns=['processed_date'], errors='ignore').sort_values('ticker', ignore_index=True)
+        for source in [storage.ref(tables['data']), f"({_reassembly(storage, tables, slow_cols)})"]
+    ]
+    columns = sorted(frames[0].columns)
+    hashes = [delta_history.row_hash(frame[columns]) for frame in frames]
+    mismatches = int((hashes[0] != hashes[1]).sum()) if len(frames[0]) == len(frames[1]) else None
+    if mismatches != 0:
+        raise RuntimeError(f"The reassembled latest snapshot differs from history_data ({mismatches} rows).")
+    print(f"Verified: {copied} rows; latest snapshot reassembles identically ({len(frames[0])} rows).")
+
+def swap(storage, tables, slow_cols):
+    """Replaces the history_data table with the reassembly view."""
+    if storage.dialect == 'bigquery':
+        for statement in [f"DROP TABLE `{storage.table_name(tables['data'])}`",
+                          f"CREATE VIEW `{storage.table_name(tables['data'])}` AS {_reassembly(storage, tables, slow_cols)}"]:
+            print(statement.strip() + ";\n")
+            storage.client.query(statement).result()
+    else:
+        backup = os.path.join(storage.root, 'backup', tables['data'])
+        shutil.move(storage._table_dir(tables['data']), backup)
+        print(f"Moved {tables['data']} to {backup}; the backend now serves it as a view.")
+
+def migrate(storage, base_table_name, execute, days_per_batch):
+    tables = {name: f"{base_table_name}_history{suffix}" for name, suffix in
+              [('data', '_data'), ('fast', '_fast'), ('slow', '_slow')]}
+    columns = storage.query(f"SELECT * FROM {storage.ref(tables['data'])} LIMIT 0").columns
+    slow_cols = [c for c in delta_history.SLOW_COLUMNS if c in columns]
+    ddl = _bigquery_ddl(storage, tables, slow_cols) if storage.dialect == 'bigquery' else []
+    if not execute:
+        for statement in ddl:
+            print(statement.strip() + ";\n")
+        print(f"Would copy {tables['data']} into {tables['fast']} and {tables['slow']} "
+              f"({len(slow_cols)} slow columns), verify, then replace {tables['data']} with a view.")
+        print("Dry run; re-run with --execute to apply.")
+        return
+    for statement in ddl:
+        storage.client.query(statement).result()
+    copied = copy_history(storage, tables, days_per_batch)
+    print(f"Copied {copied} snapshots.")
+    verify(storage, tables, slow_cols)
+    swap(storage, tables, slow_cols)
+    print("Migration complete. Deploy with HISTORY_MODE=delta.")
+
+if __name__ == '__main__':
+    from storage_backends import script_backend
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-table', default=BQ_TABLE_BASE)
+    parser.add_argument('--days-per-batch', type=int, default=30, help="days of history copied per load job")
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default='bigquery')
+    parser.add_argument('--execute', action='store_true', help="run the migration instead of printing the plan")
+    args = parser.parse_args()
+    storage = script_backend(args.backend)
+    if storage.dialect == 'bigquery' and storage.snapshot_mode != 'pointer':
+        parser.error("Delta history needs the pointer layout: run migrate_snapshot_pointer.py and set SNAPSHOT_MODE=pointer.")
+    migrate(storage, args.base_table, args.execute, args.days_per_batch)
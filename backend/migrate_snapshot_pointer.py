@@ -0,0 +1,59 @@
+"""One-time migration of the is_current flag tables to the snapshot-pointer layout (see snapshots.py).
+
+For the history, industry and sector tables:
+  1. copy the rows (without is_current) into a `<table>_data` table partitioned by DATE(processed_at),
+  2. seed `<base>_snapshots` with every snapshot in history,
+  3. replace the original table with a view that derives is_current from the pointer.
+
+Prints the statements by default; pass --execute to run them. Deploy with SNAPSHOT_MODE=pointer afterwards.
+"""
+import argparse
+
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+
+from backfill_aggregations import get_credentials
+from snapshots import flagged_view_sql, table_names
+
+def migration_statements(client, tables):
+    statements = []
+    for logical in ['history', 'industry', 'sector']:
+        table, data_table = tables[logical], tables[f'{logical}_data']
+        try:
+            client.get_table(data_table)
+            print(f"{data_table} already exists, skipping copy.")
+        except NotFound:
+            statements.append(f"""CREATE TABLE `{data_table}` PARTITION BY DATE(processed_at) AS
+                SELECT * EXCEPT(is_current) FROM `{table}`""")
+
+    statements.append(f"""CREATE TABLE IF NOT EXISTS `{tables['snapshots']}` AS
+        SELECT CAST(processed_at AS STRING) as snapshot_id, processed_at, COUNT(*) as row_count,
+               CURRENT_TIMESTAMP() as published_at
+        FROM `{tables['history_data']}`
+        GROUP BY processed_at""")
+
+    for logical in ['history', 'industry', 'sector']:
+        table = tables[logical]
+        if client.get_table(table).table_type != 'VIEW':
+            statements.append(f"DROP TABLE `{table}`")
+        statements.append(f"CREATE OR REPLACE VIEW `{table}` AS {flagged_view_sql(tables[f'{logical}_data'], tables['snapshots'])}")
+    return statements
+
+def migrate(dataset_id, base_table_name, execute):
+    project_id, credentials = get_credentials()
+    client = bigquery.Client(project=project_id, credentials=credentials)
+    tables = table_names(project_id, dataset_id, base_table_name)
+
+    for statement in migration_statements(client, tables):
+        print(statement.strip() + ";\n")
+        if execute:
+            client.query(statement).result()
+    print("Migration complete." if execute else "Dry run; re-run with --execute to apply.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default='stock_data')
+    parser.add_argument('--base-table', default='processed_stock_data')
+    parser.add_argument('--execute', action='store_true', help="run the statements instead of printing them")
+    args = parser.parse_args()
+    migrate(args.dataset, args.base_table, args.execute)
@@ -0,0 +1,157 @@
+"""One-time rewrite of the history tables from the legacy layout (schema version 1) to the typed layout
+(version 2, see history_schema.py).
+
+Rewrites whichever physical history tables exist: `<base>_history` (flag layout), `<base>_history_data`
+(pointer layout) or `<base>_history_fast` and `<base>_history_slow` (delta history). Tables whose
+percent columns are already numeric are skipped. Daily tables are not rewritten; they are replaced
+day by day.
+
+BigQuery: each table is copied with CREATE TABLE ... AS SELECT into `<table>_v2` (partitioned by
+DATE(processed_at), clustered by ticker/sector/industry, labeled schema_version=2). After the row counts
+match, the original is renamed to `<table>_v1` and the copy takes its name. The slow table of delta
+history is rewritten in Python so its row hashes match the typed values. Local backend: the table
+directory moves to <root>/backup/ and is rewritten file by file.
+
+Prints the statements by default; pass --execute to run them. Deploy with HISTORY_SCHEMA_VERSION=2
+afterwards (and set it for the dashboard too).
+"""
+import argparse
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import delta_history
+import history_schema
+from config import BQ_TABLE_BASE
+
+TABLE_SUFFIXES = ['_history', '_history_data', '_history_fast', '_history_slow']
+LEGACY_TYPE_NAMES = {'FLOAT': 'FLOAT64', 'INTEGER': 'INT64'}
+# Column types meaning "string" in a BigQuery schema or in the dtypes of a DuckDB result
+STRING_TYPES = {'STRING', 'object', 'string', 'str'}
+
+def typed_select_sql(source, columns):
+    """SELECT converting the legacy columns [(name, type)] of `source` to the typed layout."""
+    expressions = []
+    for name, field_type in columns:
+        target = history_schema.COLUMN_TYPES.get(name)
+        if name == 'market_cap':
+            expressions.append("SAFE_CAST(market_cap AS FLOAT64) * 1000000 as market_cap")
+        elif name in history_schema.PERCENT_COLUMNS and field_type == 'STRING':
+            expressions.append(f"SAFE_CAST(REPLACE({name}, '%', '') AS FLOAT64) as {name}")
+        elif target in ('INT64', 'FLOAT64') and field_type != target:
+            expressions.append(f"SAFE_CAST({name} AS {target}) as {name}")
+        else:
+            expressions.append(name)
+    return f"SELECT {', '.join(expressions)} FROM `{source}`"
+
+def _is_legacy(columns):
+    types = dict(columns)
+    return any(types.get(name) in STRING_TYPES for name in history_schema.PERCENT_COLUMNS)
+
+def convert_frame(df, slow=False):
+    """Legacy rows in the typed layout (slow records of delta history get new row hashes)."""
+    df = history_schema.to_storage_layout(history_schema.from_storage_layout(df, history_schema.LEGACY),
+                                          history_schema.TYPED)
+    if slow:
+        df['row_hash'] = delta_history.row_hash(df[delta_history.slow_columns(df)])
+    return df
+
+def bigquery_plan(storage, table):
+    """Statements rewriting `table` (None if it is missing, a view or already typed)."""
+    from google.api_core.exceptions import NotFound
+    try:
+        bq_table = storage.client.get_table(storage.table_name(table))
+    except NotFound:
+        return None
+    columns = [(field.name, LEGACY_TYPE_NAMES.get(field.field_type, field.field_type)) for field in bq_table.schema]
+    if bq_table.table_type == 'VIEW' or not _is_legacy(columns):
+        return None
+    names = [name for name, _ in columns]
+    options = []
+    if 'processed_at' in names:
+        options.append("PARTITION BY DATE(processed_at)")
+    cluster = history_schema.clustering(names, history_schema.TYPED)
+    if cluster:
+        options.append(f"CLUSTER BY {', '.join(cluster)}")
+    options.append("OPTIONS(labels=[('schema_version', '2')])")
+    full_name = storage.table_name(table)
+    return {
+        'table': table,
+        'slow': table.endswith('_history_slow'),
+        'create': f"CREATE TABLE `{full_name}_v2` {' '.join(options)} AS {typed_select_sql(full_name, columns)}",
+        'swap': [f"ALTER TABLE `{full_name}` RENAME TO `{table}_v1`",
+                 f"ALTER TABLE `{full_name}_v2` RENAME TO `{table}`"],
+        'cluster': cluster,
+    }
+
+def _count(storage, table):
+    return int(storage.query(f"SELECT COUNT(*) as n FROM {storage.ref(table)}")['n'].iloc[0])
+
+def migrate_bigquery(storage, tables, execute):
+    plans = [plan for plan in (bigquery_plan(storage, table) for table in tables) if plan]
+    if not plans:
+        print("No legacy history tables found.")
+    for plan in plans:
+        if plan['slow']:
+            print(f"-- {plan['table']}: rewritten in Python into {plan['table']}_v2 (new row hashes)")
+        else:
+            print(plan['create'] + ";\n")
+        for statement in plan['swap']:
+            print(statement + ";\n")
+        if not execute:
+            continue
+        if plan['slow']:
+            rows = convert_frame(storage.query(f"SELECT * FROM {storage.ref(plan['table'])}"), slow=True)
+            storage.append_table(rows, f"{plan['table']}_v2", write_disposition='WRITE_TRUNCATE',
+                                 schema=history_schema.table_schema(rows, history_schema.TYPED), clustering=plan['cluster'])
+        else:
+            storage.client.query(plan['create']).result()
+        original, copied = _count(storage, plan['table']), _count(storage, f"{plan['table']}_v2")
+        if original != copied:
+            raise RuntimeError(f"Row count mismatch: {original} rows in {plan['table']}, {copied} in the copy.")
+        for statement in plan['swap']:
+            storage.client.query(statement).result()
+        print(f"Rewrote {plan['table']} ({copied} rows); the legacy table is kept as {plan['table']}_v1.")
+
+def migrate_local(storage, tables, execute):
+    for table in tables:
+        table_dir = storage._table_dir(table)
+        if not os.path.isdir(table_dir):
+            continue
+        columns = storage.query(f"SELECT * FROM {storage.ref(table)} LIMIT 0").dtypes.astype(str).items()
+        if not _is_legacy(list(columns)):
+            continue
+        backup = os.path.join(storage.root, 'backup', f"{table}_v1")
+        print(f"Rewrite {table} (original moved to {backup})")
+        if not execute:
+            continue
+        shutil.move(table_dir, backup)
+        for directory, _, files in os.walk(backup):
+            for name in files:
+                if not name.endswith('.parquet'):
+                    continue
+                rows = convert_frame(pd.read_parquet(os.path.join(directory, name)), slow=table.endswith('_history_slow'))
+                target = os.path.join(table_dir, os.path.relpath(directory, backup))
+                os.makedirs(target, exist_ok=True)
+                pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), os.path.join(target, name), compression='zstd')
+        print(f"Rewrote {table} ({_count(storage, table)} rows).")
+
+def migrate(storage, base_table_name, execute):
+    tables = [f"{base_table_name}{suffix}" for suffix in TABLE_SUFFIXES]
+    if storage.dialect == 'bigquery':
+        migrate_bigquery(storage, tables, execute)
+    else:
+        migrate_local(storage, tables, execute)
+    print("Migration complete. Deploy with HISTORY_SCHEMA_VERSION=2." if execute else "Dry run; re-run with --execute to apply.")
+
+if __name__ == '__main__':
+    from storage_backends import script_backend
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-table', default=BQ_TABLE_BASE)
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default='bigquery')
+    parser.add_argument('--execute', action='store_true', help="run the migration instead of printing the plan")
+    args = parser.parse_args()
+    migrate(script_backend(args.backend), args.base_table, args.execute)
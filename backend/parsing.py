@@ -0,0 +1,173 @@
+"""Typed parsing of Finviz CSV exports.
+
+Finviz exports are parsed straight from the HTTP byte stream with pyarrow.csv using an explicit
+column schema, so percent, market-cap and volume fields arrive as float64 instead of strings.
+"""
+import logging
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+logger = logging.getLogger(__name__)
+
+# Column kinds by original Finviz column name. Each view's schema is the subset of these
+# columns that appear in its header.
+STRING = 'string'
+INTEGER = 'integer'
+FLOAT = 'float'
+PERCENT = 'percent'  # "-1.23%" in the export, parsed to float64 (-1.23)
+
+FINVIZ_COLUMN_TYPES = {
+    'No.': INTEGER,
+    'Ticker': STRING,
+    'Company': STRING,
+    'Sector': STRING,
+    'Industry': STRING,
+    'Country': STRING,
+    'Market Cap': FLOAT,  # millions of USD
+    'P/E': FLOAT,
+    'Price': FLOAT,
+    'Change': PERCENT,
+    'Volume': FLOAT,
+    'Forward P/E': FLOAT,
+    'PEG': FLOAT,
+    'P/S': FLOAT,
+    'P/B': FLOAT,
+    'P/Cash': FLOAT,
+    'P/Free Cash Flow': FLOAT,
+    'EPS Growth This Year': PERCENT,
+    'EPS Growth Next Year': PERCENT,
+    'EPS Growth Past 5 Years': PERCENT,
+    'EPS Growth Next 5 Years': PERCENT,
+    'Sales Growth Past 5 Years': PERCENT,
+    'Shares Outstanding': FLOAT,
+    'Shares Float': FLOAT,
+    'Insider Ownership': PERCENT,
+    'Insider Transactions': PERCENT,
+    'Institutional Ownership': PERCENT,
+    'Institutional Transactions': PERCENT,
+    'Short Float': PERCENT,
+    'Short Ratio': FLOAT,
+    'Average Volume': FLOAT,  # thousands of shares
+    'Performance (Week)': PERCENT,
+    'Performance (Month)': PERCENT,
+    'Performance (Quarter)': PERCENT,
+    'Performance (Half Year)': PERCENT,
+    'Performance (YTD)': PERCENT,
+    'Performance (Year)': PERCENT,
+    'Performance (3 Years)': PERCENT,
+    'Performance (5 Years)': PERCENT,
+    'Performance (10 Years)': PERCENT,
+    'Volatility (Week)': PERCENT,
+    'Volatility (Month)': PERCENT,
+    'Relative Volume': FLOAT,
+    'Beta': FLOAT,
+    'Average True Range': FLOAT,
+    '20-Day Simple Moving Average': PERCENT,
+    '50-Day Simple Moving Average': PERCENT,
+    '200-Day Simple Moving Average': PERCENT,
+    '52-Week High': PERCENT,
+    '52-Week Low': PERCENT,
+    'Relative Strength Index (14)': FLOAT,
+    'Change from Open': PERCENT,
+    'Gap': PERCENT,
+    'Dividend Yield': PERCENT,
+    'Return on Assets': PERCENT,
+    'Return on Equity': PERCENT,
+    'Return on Invested Capital': PERCENT,
+    'Current Ratio': FLOAT,
+    'Quick Ratio': FLOAT,
+    'LT Debt/Equity': FLOAT,
+    'Total Debt/Equity': FLOAT,
+    'Gross Margin': PERCENT,
+    'Operating Margin': PERCENT,
+    'Profit Margin': PERCENT,
+    'Earnings Date': STRING,
+}
+
+_ARROW_READ_TYPES = {
+    STRING: pa.string(),
+    INTEGER: pa.int64(),
+    FLOAT: pa.float64(),
+    PERCENT: pa.string(),  # converted after the read, see _convert_percent
+}
+
+# Finviz writes "-" or nothing for missing values.
+NULL_VALUES = ['', '-']
+
+def normalize_column_name(name):
+    """BigQuery friendly column name: lowercase, special chars to _, no leading/trailing/double underscores."""
+    name = re.sub(r'[^a-z0-9_]', '_', name.lower()).strip('_')
+    return re.sub(r'_{2,}', '_', name)
+
+# Kind of each column under its original and its normalized name
+_COLUMN_KINDS = {**FINVIZ_COLUMN_TYPES, **{normalize_column_name(name): kind for name, kind in FINVIZ_COLUMN_TYPES.items()}}
+
+def columns_of_kind(kind, normalized=False):
+    """Finviz column names of the given kind (optionally in normalized form)."""
+    names = [name for name, k in FINVIZ_COLUMN_TYPES.items() if k == kind]
+    return [normalize_column_name(n) for n in names] if normalized else names
+
+def view_schema(header):
+    """Explicit arrow read types for the columns present in a view header."""
+    unknown = [c for c in header if c not in FINVIZ_COLUMN_TYPES]
+    if unknown:
+        logger.warning(f"Columns without an explicit type (will be inferred): {unknown}")
+    return {c: _ARROW_READ_TYPES[FINVIZ_COLUMN_TYPES[c]] for c in header if c in FINVIZ_COLUMN_TYPES}
+
+def _convert_percent(column):
+    return pc.cast(pc.replace_substring(column, '%', ''), pa.float64())
+
+def parse_view_csv(source, view_name, allow_empty=False):
+    """Parses a Finviz CSV export (bytes or a binary file-like object) into a typed DataFrame. A CSV with a
+    header but no rows raises unless `allow_empty` (a shard whose filter matches nothing)."""
+    read_options = pacsv.ReadOptions(block_size=1 << 20)
+    # pyarrow only applies the types of columns that are present, so the full registry serves every view.
+    convert_options = pacsv.ConvertOptions(
+        column_types=view_schema(list(FINVIZ_COLUMN_TYPES)),
+        null_values=NULL_VALUES,
+        strings_can_be_null=True,
+    )
+    if isinstance(source, (bytes, bytearray)):
+        source = pa.BufferReader(source)
+    try:
+        table = pacsv.read_csv(source, read_options=read_options, convert_options=convert_options)
+    except pa.ArrowInvalid as e:
+        if 'Empty CSV file' in str(e):
+            raise ValueError(f"View {view_name} returned an empty payload.") from e
+        raise
+
+    view_schema(table.column_names)  # log unknown columns
+    for i, name in enumerate(table.column_names):
+        if FINVIZ_COLUMN_TYPES.get(name) == PERCENT:
+            table = table.set_column(i, name, _convert_percent(table.column(i)))
+
+    if table.num_rows == 0 and not allow_empty:
+        raise ValueError(f"View {view_name} returned a CSV with no visible rows.")
+    return table.to_pandas()
+
+def to_legacy_layout(df):
+    """Returns a copy of a frame in the layout the string-typed BigQuery tables expect: percent columns
+    as "1.23%" strings and volume as an integer. Missing values stay missing (null in the JSON raw
+    archive). Takes normalized or original Finviz column names (the raw archive)."""
+    df = df.copy()
+    for col in df.columns:
+        kind = _COLUMN_KINDS.get(col)
+        if kind == PERCENT:
+            values = df[col]
+            df[col] = values.map(lambda v: f"{v:.2f}%", na_action='ignore').astype(object).where(values.notna(), None)
+        elif col in ('volume', 'Volume'):
+            df[col] = df[col].round().astype('Int64')
+    return df
+
+def from_legacy_layout(df):
+    """Inverse of to_legacy_layout: parses "1.23%" strings read back from the BigQuery tables to float64."""
+    df = df.copy()
+    for col in columns_of_kind(PERCENT, normalized=True):
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            values = df[col].astype('string').str.replace('%', '', regex=False)
+            df[col] = pd.to_numeric(values, errors='coerce').astype('float64')
+    return df
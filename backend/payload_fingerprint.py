@@ -0,0 +1,58 @@
+"""Content fingerprint of the merged Finviz views, to skip runs that would ingest the same data again.
+
+The scheduler also fires on weekends, on holidays and between Finviz updates. A run whose merged views
+hash to the fingerprint of the last ingested payload writes nothing: no raw archive, daily table,
+history rows, aggregations or indicators. It only updates the no-change marker in the payload blob
+and ends with run status 'unchanged'.
+
+The blob (`state/last_payload.json`, next to the rolling state) holds:
+
+    fingerprint, snapshot_id, processed_at, rows    # the last ingested payload
+    last_checked_at, unchanged_runs                 # the no-change marker
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_BLOB = 'state/last_payload.json'
+
+def fingerprint(df):
+    """sha256 of the frame's values, independent of row and column order."""
+    df = df.sort_values('Ticker', kind='stable').reset_index(drop=True) if 'Ticker' in df.columns else df
+    digest = hashlib.sha256()
+    for column in sorted(df.columns, key=str):
+        digest.update(str(column).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(df[column], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def last_payload(storage, blob=PAYLOAD_BLOB):
+    """The stored record of the last ingested payload, or None."""
+    data = storage.get_blob(blob)
+    return json.loads(data) if data else None
+
+def record_payload(storage, digest, processed_at, rows, blob=PAYLOAD_BLOB):
+    """Stores the fingerprint of a payload that was just ingested."""
+    record = {
+        'fingerprint': digest,
+        'snapshot_id': storage.snapshot_id(processed_at),
+        'processed_at': pd.Timestamp(processed_at).isoformat(),
+        'rows': int(rows),
+        'last_checked_at': datetime.now(timezone.utc).isoformat(),
+        'unchanged_runs': 0,
+    }
+    storage.put_blob(blob, json.dumps(record), content_type='application/json')
+    return record
+
+def record_no_change(storage, record, blob=PAYLOAD_BLOB):
+    """Updates the no-change marker of the stored payload record."""
+    record = {**record, 'last_checked_at': datetime.now(timezone.utc).isoformat(),
+              'unchanged_runs': int(record.get('unchanged_runs', 0)) + 1}
+    storage.put_blob(blob, json.dumps(record), content_type='application/json')
+    logger.info(f"Payload unchanged since snapshot {record['snapshot_id']} "
+                f"({record['unchanged_runs']} unchanged runs); skipping all writes.")
+    return record
@@ -0,0 +1,75 @@
+"""Raw daily archive of the merged Finviz views as zstd-compressed Parquet.
+
+The frame is written sorted by Ticker in small row groups with the original Finviz column names.
+read_raw_archive() only fetches the footer and the column chunks / row groups it needs, so a backfill
+can load a few columns or tickers of a day without downloading or parsing the whole file.
+"""
+import logging
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import run_metrics
+from clients import get_storage_client
+
+logger = logging.getLogger(__name__)
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 256  # rows; small groups keep ticker lookups to a few KB
+READ_CHUNK_SIZE = 256 * 1024  # bytes per ranged GCS read (the BlobReader default is 40 MB)
+TICKER_COLUMN = 'Ticker'
+
+def write_parquet(df, sink):
+    """Writes df to a binary file-like object or path. Returns the number of rows written."""
+    if TICKER_COLUMN in df.columns:
+        df = df.sort_values(TICKER_COLUMN, kind='stable')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pq.ParquetWriter(sink, table.schema, compression=COMPRESSION, write_statistics=True) as writer:
+        writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+    return table.num_rows
+
+def _row_groups_for(parquet_file, tickers):
+    """Indices of the row groups whose Ticker min/max statistics can contain one of `tickers`."""
+    index = parquet_file.schema_arrow.get_field_index(TICKER_COLUMN)
+    metadata = parquet_file.metadata
+    groups = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(index).statistics
+        if stats is None or not stats.has_min_max or any(stats.min <= t <= stats.max for t in tickers):
+            groups.append(i)
+    return groups
+
+def read_parquet(source, columns=None, tickers=None):
+    """Reads selected columns/tickers of a raw archive from a path or seekable binary file-like object."""
+    parquet_file = pq.ParquetFile(source)
+    read_columns = None
+    if columns is not None:
+        read_columns = list(columns)
+        if tickers is not None and TICKER_COLUMN not in read_columns:
+            read_columns.append(TICKER_COLUMN)
+
+    if tickers is None:
+        table = parquet_file.read(columns=read_columns)
+    else:
+        tickers = sorted(set(tickers))
+        table = parquet_file.read_row_groups(_row_groups_for(parquet_file, tickers), columns=read_columns)
+        table = table.filter(pc.is_in(table[TICKER_COLUMN], value_set=pa.array(tickers)))
+
+    df = table.to_pandas()
+    return df[list(columns)] if columns is not None else df
+
+def write_raw_archive(df, bucket_name, blob_name):
+    """Streams df as Parquet/zstd to gs://bucket_name/blob_name (resumable upload, no in-memory copy)."""
+    blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+    with blob.open('wb', content_type=PARQUET_CONTENT_TYPE) as sink:
+        rows = write_parquet(df, sink)
+        run_metrics.add('bytes_uploaded', sink.tell())
+    logger.info(f"File {blob_name} ({rows} rows, Parquet/{COMPRESSION}) uploaded to {bucket_name}.")
+
+def read_raw_archive(bucket_name, blob_name, columns=None, tickers=None):
+    """Reads selected columns/tickers of a raw archive in GCS using ranged reads."""
+    blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+    with blob.open('rb', chunk_size=READ_CHUNK_SIZE) as source:
+        return read_parquet(source, columns=columns, tickers=tickers)
@@ -0,0 +1,212 @@
+"""Cached read API over the published snapshot and the industry/sector aggregation tables.
+
+Served by the `serve_finviz_data` entry point in main.py:
+
+    GET /snapshot?snapshot_id=&sector=&industry=&columns=ticker,price   rows of one snapshot
+    GET /industries?snapshot_id=|days=&sector=                          industry aggregates
+    GET /sectors?snapshot_id=|days=                                     sector aggregates
+
+(or `?resource=snapshot|industries|sectors`). Without snapshot_id or days the current snapshot is
+returned. `days` only applies to the aggregates: ticker history over a range is far too large for one
+cached response, so /snapshot serves one snapshot at a time. Responses are compact JSON (`{"columns": [...], "data": [[...], ...]}`) or, with `?format=arrow`
+or `Accept: application/vnd.apache.arrow.stream`, an Arrow IPC stream. Each carries an ETag;
+a matching If-None-Match gets 304.
+
+Encoded responses are kept in a per-process LRU cache (at most READ_API_CACHE_ENTRIES responses and
+READ_API_CACHE_MAX_BYTES of bodies) for READ_API_CACHE_TTL_S seconds. Ingest calls invalidate() after publishing. Other instances notice the new snapshot within
+READ_API_VERSION_CHECK_S, because they poll the last ingested snapshot id in state/last_payload.json
+(a small blob read; see payload_fingerprint.py).
+"""
+import hashlib
+import io
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import pyarrow as pa
+
+import payload_fingerprint
+import storage_backends
+from config import READ_API_CACHE_ENTRIES, READ_API_CACHE_MAX_BYTES, READ_API_CACHE_TTL_S, READ_API_VERSION_CHECK_S
+
+logger = logging.getLogger(__name__)
+
+ARROW_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+JSON_CONTENT_TYPE = 'application/json'
+# resource -> table suffix (the views with is_current in the pointer layout)
+RESOURCES = {'snapshot': '_history', 'industries': '_industry_history', 'sectors': '_sector_history'}
+# resource -> the query parameters build_query reads; the cache key ignores any others
+RESOURCE_ARGS = {
+    'snapshot': ('snapshot_id', 'days', 'sector', 'industry', 'columns'),
+    'industries': ('snapshot_id', 'days', 'sector'),
+    'sectors': ('snapshot_id', 'days'),
+}
+MAX_DAYS = 366
+_IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after they were stored. Holds at most
+    `max_entries` entries whose sizes (as given to put) add up to at most `max_bytes`."""
+
+    def __init__(self, max_entries, ttl, max_bytes=None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._pop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, size=0):
+        with self.lock:
+            self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (time.monotonic(), value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._pop(next(iter(self.entries)))
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+_cache = TTLCache(READ_API_CACHE_ENTRIES, READ_API_CACHE_TTL_S, READ_API_CACHE_MAX_BYTES)
+_version = {'snapshot_id': None, 'checked_at': None}
+_version_lock = threading.Lock()
+
+def invalidate(snapshot_id=None):
+    """Drops every cached response. Ingest calls this after publishing `snapshot_id`."""
+    with _version_lock:
+        _cache.clear()
+        _version['snapshot_id'] = snapshot_id
+        _version['checked_at'] = time.monotonic() if snapshot_id else None
+    logger.info(f"Read API cache invalidated (snapshot {snapshot_id}).")
+
+def current_version(storage):
+    """Id of the last ingested snapshot, re-read at most every READ_API_VERSION_CHECK_S seconds. A new
+    id clears the cache."""
+    with _version_lock:
+        checked_at = _version['checked_at']
+        if checked_at is not None and time.monotonic() - checked_at < READ_API_VERSION_CHECK_S:
+            return _version['snapshot_id']
+        record = payload_fingerprint.last_payload(storage) or {}
+        snapshot_id = record.get('snapshot_id')
+        if snapshot_id != _version['snapshot_id']:
+            _cache.clear()
+            _version['snapshot_id'] = snapshot_id
+        _version['checked_at'] = time.monotonic()
+        return snapshot_id
+
+def _columns(value):
+    if not value:
+        return '*'
+    columns = [c.strip().lower() for c in value.split(',') if c.strip()]
+    invalid = [c for c in columns if not _IDENTIFIER.match(c)]
+    if invalid:
+        raise ValueError(f"Invalid column names: {invalid}")
+    return ', '.join(columns)
+
+def cache_args(resource, args):
+    """The (name, value) pairs of args that build_query uses for `resource`, sorted by name."""
+    used = {name: args[name] for name in RESOURCE_ARGS.get(resource, ()) if args.get(name)}
+    if 'snapshot_id' in used:
+        used.pop('days', None)  # snapshot_id takes precedence
+    return tuple(sorted(used.items()))
+
+def build_query(resource, args, storage):
+    """(sql, params) of a request. Raises KeyError for an unknown resource, ValueError for invalid parameters."""
+    if resource not in RESOURCES:
+        raise KeyError(resource)
+    params = {}
+    if args.get('snapshot_id'):
+        params['snapshot_id'] = args['snapshot_id']
+        where = ["CAST(processed_at AS STRING) = @snapshot_id" if resource == 'snapshot' else "snapshot_id = @snapshot_id"]
+    elif args.get('days'):
+        if resource == 'snapshot':
+            raise ValueError("days is only supported for industries and sectors; use snapshot_id for /snapshot.")
+        days = int(args['days'])
+        if not 0 < days <= MAX_DAYS:
+            raise ValueError(f"days must be between 1 and {MAX_DAYS}.")
+        params['since'] = (date.today() - timedelta(days=days)).isoformat()
+        where = ["CAST(processed_at AS DATE) >= CAST(@since AS DATE)"]
+    else:
+        where = ["is_current = 'yes'"]
+    filters = {'sector': 'sector', 'industry': 'industry'} if resource == 'snapshot' else {'sector': 'parent_sector'}
+    for arg, column in filters.items():
+        if args.get(arg) and resource != 'sectors':
+            params[arg] = args[arg]
+            where.append(f"{column} = @{arg}")
+    order = 'ticker' if resource == 'snapshot' else 'processed_at, name'
+    columns = _columns(args.get('columns')) if resource == 'snapshot' else '*'
+    sql = f"SELECT {columns} FROM {storage.ref(storage.base_table_name + RESOURCES[resource])} WHERE {' AND '.join(where)} ORDER BY {order}"
+    return sql, params
+
+def encode(df, fmt):
+    """(body, content type) of a frame as compact JSON or an Arrow IPC stream."""
+    df = df.drop(columns=['processed_date'], errors='ignore')
+    if fmt == 'arrow':
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue(), ARROW_CONTENT_TYPE
+    return df.to_json(orient='split', index=False, date_format='iso').encode('utf-8'), JSON_CONTENT_TYPE
+
+def _resource(request):
+    args = getattr(request, 'args', None) or {}
+    return (args.get('resource') or (getattr(request, 'path', '') or '').rstrip('/').rsplit('/', 1)[-1]).lower()
+
+def _format(request):
+    args = getattr(request, 'args', None) or {}
+    headers = getattr(request, 'headers', None) or {}
+    if args.get('format'):
+        return 'arrow' if args['format'].lower() == 'arrow' else 'json'
+    return 'arrow' if ARROW_CONTENT_TYPE in (headers.get('Accept') or '') else 'json'
+
+def handle(request, storage=None):
+    """Serves one request; returns (body, status, headers)."""
+    storage = storage or storage_backends.get_storage_backend()
+    args = dict(getattr(request, 'args', None) or {})
+    resource, fmt = _resource(request), _format(request)
+    version = current_version(storage)
+    # Keyed by snapshot too, so a response built while a new snapshot lands is never served for it.
+    key = (version, resource, fmt, cache_args(resource, args))
+    cached = _cache.get(key)
+    if cached is None:
+        try:
+            sql, params = build_query(resource, args, storage)
+        except KeyError:
+            return f"Unknown resource {resource!r}; expected one of {sorted(RESOURCES)}.", 404, {}
+        except ValueError as e:
+            return f"Bad request: {e}", 400, {}
+        body, content_type = encode(storage.query(sql, params), fmt)
+        cached = {'body': body, 'content_type': content_type,
+                  'etag': f'"{hashlib.sha256(body).hexdigest()[:32]}"', 'snapshot_id': version}
+        _cache.put(key, cached, size=len(body))
+    headers = {'ETag': cached['etag'], 'Cache-Control': f"private, max-age={int(READ_API_CACHE_TTL_S)}",
+               'X-Snapshot-Id': cached['snapshot_id'] or ''}
+    headers_in = getattr(request, 'headers', None) or {}
+    if cached['etag'] in [tag.strip() for tag in (headers_in.get('If-None-Match') or '').split(',')]:
+        return '', 304, headers
+    return cached['body'], 200, {**headers, 'Content-Type': cached['content_type']}
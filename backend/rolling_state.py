@@ -0,0 +1,120 @@
+"""Per-ticker rolling window of the last trading days, maintained incrementally at ingest.
+
+The state is one float matrix per series (e.g. price, change) with a row per ticker and a column per
+trading day, oldest first and aligned across tickers: a ticker missing from a day has NaN in that
+column. Advancing to a new trading day shifts every row left by one column and fills the last column
+from the snapshot, so each ingest does O(tickers × window) work instead of rescanning history.
+
+The state is persisted as a small Parquet blob (one fixed-size list column per series; the trading days
+and `meta` in the schema metadata) through the storage backend.
+"""
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+WINDOW = 25  # trading days kept: 20-day indicators plus a buffer for tickers missing on some days
+STATE_BLOB = 'state/rolling_state.parquet'
+
+class RollingState:
+    def __init__(self, series_names, window=WINDOW, trading_days=(), tickers=(), series=None, meta=None):
+        self.window = window
+        # Small JSON-serializable values persisted with the state (e.g. the trading-day ordinal)
+        self.meta = dict(meta or {})
+        self.trading_days = [pd.Timestamp(t) for t in trading_days]
+        self.tickers = np.asarray(tickers, dtype=object)
+        self.series = series or {name: np.full((len(self.tickers), window), np.nan) for name in series_names}
+        self._index = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    @property
+    def last_trading_day(self):
+        return self.trading_days[-1] if self.trading_days else None
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def _add_tickers(self, tickers):
+        new = [t for t in pd.unique(np.asarray(tickers, dtype=object)) if t not in self._index]
+        if not new:
+            return
+        self.tickers = np.concatenate([self.tickers, np.asarray(new, dtype=object)])
+        for name, matrix in self.series.items():
+            self.series[name] = np.vstack([matrix, np.full((len(new), self.window), np.nan)])
+        self._index = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    def rows(self, tickers):
+        """Row positions of `tickers` (which must be in the state)."""
+        return np.fromiter((self._index[t] for t in tickers), dtype=np.int64, count=len(tickers))
+
+    def advance(self, processed_at, values):
+        """Appends trading day `processed_at`. `values` maps a series name to a Series indexed by ticker;
+        tickers without a (non-null) value get NaN for the day."""
+        for series in values.values():
+            self._add_tickers(series.index)
+        for name, matrix in self.series.items():
+            matrix[:, :-1] = matrix[:, 1:]
+            matrix[:, -1] = np.nan
+            series = values.get(name)
+            if series is not None:
+                series = series.dropna()
+                matrix[self.rows(series.index), -1] = series.to_numpy(dtype='float64')
+        self.trading_days = (self.trading_days + [pd.Timestamp(processed_at)])[-self.window:]
+        self._prune()
+
+    def _prune(self):
+        """Drops tickers without a single value left in the window."""
+        keep = np.zeros(len(self.tickers), dtype=bool)
+        for matrix in self.series.values():
+            keep |= ~np.isnan(matrix).all(axis=1)
+        if keep.all():
+            return
+        self.tickers = self.tickers[keep]
+        self.series = {name: matrix[keep] for name, matrix in self.series.items()}
+        self._index = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+    def latest(self, name):
+        """Series of the last trading day's values, indexed by ticker (NaN where missing)."""
+        return pd.Series(self.series[name][:, -1], index=self.tickers)
+
+    def to_parquet(self):
+        columns = {'ticker': pa.array(self.tickers.tolist(), pa.string())}
+        for name, matrix in self.series.items():
+            columns[name] = pa.FixedSizeListArray.from_arrays(pa.array(matrix.ravel(), pa.float64()), self.window)
+        table = pa.table(columns).replace_schema_metadata({
+            'window': str(self.window),
+            'trading_days': json.dumps([t.isoformat() for t in self.trading_days]),
+            'meta': json.dumps(self.meta),
+        })
+        sink = io.BytesIO()
+        pq.write_table(table, sink, compression='zstd')
+        return sink.getvalue()
+
+    @classmethod
+    def from_parquet(cls, data, series_names):
+        table = pq.read_table(io.BytesIO(data))
+        metadata = table.schema.metadata
+        window = int(metadata[b'window'])
+        trading_days = json.loads(metadata[b'trading_days'])
+        tickers = table['ticker'].to_pylist()
+        series = {}
+        for name in series_names:
+            if name in table.column_names:
+                flat = table[name].combine_chunks().flatten().to_numpy(zero_copy_only=False)
+                series[name] = flat.reshape(len(tickers), window).astype('float64')
+            else:
+                series[name] = np.full((len(tickers), window), np.nan)
+        meta = json.loads(metadata.get(b'meta', b'{}'))
+        return cls(series_names, window=window, trading_days=trading_days, tickers=tickers, series=series, meta=meta)
+
+def load_state(storage, series_names, blob=STATE_BLOB):
+    """The persisted state, or an empty one."""
+    data = storage.get_blob(blob)
+    if data is None:
+        return RollingState(series_names)
+    return RollingState.from_parquet(data, series_names)
+
+def save_state(storage, state, blob=STATE_BLOB):
+    storage.put_blob(blob, state.to_parquet(), content_type='application/vnd.apache.parquet')
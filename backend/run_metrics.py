@@ -0,0 +1,179 @@
+"""Per-run instrumentation of the ingest pipeline.
+
+run() opens a RunMetrics for one invocation. Inside it, span() times a stage (or a single retry
+attempt), add() bumps a counter and record_job() adds the bytes a BigQuery job processed and billed.
+All three are no-ops outside a run, so the shared helpers can call them unconditionally.
+
+When the run ends, one summary record is printed as a JSON line to stdout: stage durations, rows, bytes
+downloaded/uploaded, BigQuery bytes and retry counts. Cloud Logging ingests that line as a structured
+entry. With RUN_METRICS_TABLE set, the record is also appended to that table as one flat row.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Counters present (as 0) in every record, so the run-metrics table keeps a stable schema.
+COUNTERS = [
+    'rows', 'bytes_downloaded', 'bytes_uploaded', 'fetch_attempts', 'retries', 'retry_backoff_s',
+    'bq_jobs', 'bq_bytes_processed', 'bq_bytes_billed',
+]
+
+_current_run = contextvars.ContextVar('run_metrics_run', default=None)
+_current_span = contextvars.ContextVar('run_metrics_span', default=None)
+
+class RunMetrics:
+    """Spans and counters of one pipeline run. Thread-safe; worker threads need a copied context
+    (contextvars.copy_context().run) to see the run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.status = 'running'
+        self.error = None
+        self.counters = {counter: 0 for counter in COUNTERS}
+        self.spans = []
+        self._started = time.perf_counter()
+        self._duration = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        record = {'name': name, 'parent': _current_span.get(), 'start_s': time.perf_counter() - self._started,
+                  'duration_s': None, 'status': 'ok', **({'attrs': attrs} if attrs else {})}
+        token = _current_span.set(name)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record['status'] = 'error'
+            record['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record['duration_s'] = time.perf_counter() - started
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(record)
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def record_job(self, job):
+        """Adds the statistics of a finished BigQuery query or load job."""
+        self.add('bq_jobs')
+        for counter, attr in [('bq_bytes_processed', 'total_bytes_processed'),
+                              ('bq_bytes_billed', 'total_bytes_billed'),
+                              ('bytes_uploaded', 'input_file_bytes')]:
+            value = getattr(job, attr, None)
+            if value:
+                self.add(counter, int(value))
+
+    def skip(self, status='unchanged'):
+        """Marks a run that intentionally wrote nothing (e.g. an unchanged payload)."""
+        self.status = status
+
+    def fail(self, error):
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def stage_durations(self):
+        """Total seconds per top-level span."""
+        durations = {}
+        for record in self.spans:
+            if record['parent'] is None:
+                durations[record['name']] = durations.get(record['name'], 0.0) + record['duration_s']
+        return durations
+
+    def summary(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda r: r['start_s'])
+            counters = dict(self.counters)
+        return {
+            'run_id': self.run_id,
+            'name': self.name,
+            'status': self.status,
+            'error': self.error,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_s': self._duration if self._duration is not None else time.perf_counter() - self._started,
+            'stages': self.stage_durations(),
+            **counters,
+            'spans': spans,
+        }
+
+    def table_row(self):
+        """The summary as one flat row (nested parts as JSON strings) for the run-metrics table."""
+        summary = self.summary()
+        row = {key: value for key, value in summary.items() if key not in ('stages', 'spans')}
+        row['started_at'], row['finished_at'] = self.started_at, self.finished_at
+        row['stages_json'] = json.dumps(summary['stages'])
+        row['spans_json'] = json.dumps(summary['spans'], default=str)
+        return row
+
+    def finish(self):
+        self.finished_at = datetime.now(timezone.utc)
+        self._duration = time.perf_counter() - self._started
+        if self.status == 'running':
+            self.status = 'ok'
+
+def current_run():
+    return _current_run.get()
+
+@contextmanager
+def run(name, sink=None, emit_summary=True):
+    """Opens a RunMetrics for the block, then emits its summary (unless emit_summary is False) and passes
+    it to `sink`, if given. A failing sink is logged and never fails the run."""
+    metrics = RunMetrics(name)
+    token = _current_run.set(metrics)
+    try:
+        yield metrics
+    except BaseException as e:
+        metrics.fail(e)
+        raise
+    finally:
+        _current_run.reset(token)
+        metrics.finish()
+        if emit_summary:
+            emit(metrics)
+        if sink is not None:
+            try:
+                sink(metrics)
+            except Exception as e:
+                logger.warning(f"Could not store run metrics of run {metrics.run_id}: {e}")
+
+def emit(metrics):
+    """Prints the summary as a structured log line."""
+    summary = metrics.summary()
+    entry = {'severity': 'ERROR' if metrics.status == 'error' else 'INFO',
+             'message': f"{metrics.name} run {metrics.status} in {summary['duration_s']:.2f}s",
+             'run_metrics': summary}
+    print(json.dumps(entry, default=str), flush=True)
+
+@contextmanager
+def span(name, **attrs):
+    """Times the block as a span of the current run (if any)."""
+    metrics = _current_run.get()
+    if metrics is None:
+        yield None
+        return
+    with metrics.span(name, **attrs) as record:
+        yield record
+
+def add(counter, value=1):
+    metrics = _current_run.get()
+    if metrics is not None:
+        metrics.add(counter, value)
+
+def record_job(job):
+    metrics = _current_run.get()
+    if metrics is not None:
+        metrics.record_job(job)
@@ -0,0 +1,68 @@
+"""Sharded universe fetching (FINVIZ_SHARDS).
+
+One export per view gets slower and more likely to time out as the universe grows. With shards,
+every view is fetched once per shard, with the shard's filter added to FINVIZ_FILTER
+(e.g. `cap_midover,sec_technology`). All view × shard requests share the fetch thread pool and the
+rate limiter. The shards of a view are concatenated and tickers that appear in more than one shard
+are dropped (first shard wins), so the rest of the pipeline sees the same frame as one export.
+
+FINVIZ_SHARDS is a preset ('sector', 'exchange') or a ';'-separated list of Finviz filters. A shard
+with no rows is valid (its filter may match nothing); an empty payload is still retried like any
+export. Completeness is checked on the merged universe instead: it must cover at least
+FINVIZ_SHARD_MIN_COVERAGE of the tickers of the last ingested snapshot. The presets partition the whole
+Finviz universe, so a smaller union means a truncated or missing shard.
+"""
+import logging
+
+import pandas as pd
+
+import run_metrics
+from config import FINVIZ_SHARD_MIN_COVERAGE, FINVIZ_SHARDS
+
+logger = logging.getLogger(__name__)
+
+PRESETS = {
+    'sector': [
+        'sec_basicmaterials', 'sec_communicationservices', 'sec_consumercyclical', 'sec_consumerdefensive',
+        'sec_energy', 'sec_financial', 'sec_healthcare', 'sec_industrials', 'sec_realestate',
+        'sec_technology', 'sec_utilities',
+    ],
+    'exchange': ['exch_amex', 'exch_nasd', 'exch_nyse'],
+}
+
+def resolve(spec=None):
+    """Shard filters of a FINVIZ_SHARDS value, or None for one unsharded export per view."""
+    spec = (FINVIZ_SHARDS if spec is None else spec).strip()
+    if not spec:
+        return None
+    if spec in PRESETS:
+        return PRESETS[spec]
+    return [shard.strip() for shard in spec.split(';') if shard.strip()]
+
+def shard_filter(filter_param, shard):
+    """The Finviz `f=` value of a shard (filters are comma-separated)."""
+    return f"{filter_param},{shard}" if shard else filter_param
+
+def combine(view_name, parts):
+    """Concatenates the [(shard, df)] of one view, dropping tickers already seen in an earlier shard."""
+    # Empty shards are left out so they can't turn typed columns into object columns.
+    frames = [part for _, part in parts if not part.empty] or [parts[0][1]]
+    df = pd.concat(frames, ignore_index=True)
+    duplicated = df['Ticker'].duplicated(keep='first') & df['Ticker'].notna()
+    if duplicated.any():
+        run_metrics.add('shard_duplicates', int(duplicated.sum()))
+        logger.warning(f"View {view_name}: {int(duplicated.sum())} tickers appeared in more than one shard (kept first).")
+        df = df[~duplicated].reset_index(drop=True)
+    logger.info(f"View {view_name}: {len(df)} tickers from {len(parts)} shards.")
+    return df
+
+def check_coverage(tickers, previous_rows, min_coverage=None):
+    """Raises if the sharded universe has fewer than `min_coverage` of the tickers of the last ingested
+    snapshot (previous_rows; None skips the check)."""
+    min_coverage = FINVIZ_SHARD_MIN_COVERAGE if min_coverage is None else min_coverage
+    if not previous_rows:
+        return
+    coverage = tickers / previous_rows
+    if coverage < min_coverage:
+        raise ValueError(f"Sharded fetch returned {tickers} tickers, {coverage:.1%} of the {previous_rows} in the last "
+                         f"snapshot (minimum {min_coverage:.0%}); a shard is probably missing or truncated.")
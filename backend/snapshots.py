@@ -0,0 +1,41 @@
+"""Table layout of the "current snapshot" pointer model.
+
+In pointer mode the history, industry and sector tables are append-only physical tables (suffix `_data`,
+partitioned by DATE(processed_at)) and the latest published snapshot is recorded in a small `_snapshots`
+table. Views with the original table names derive is_current from that pointer, so readers keep
+filtering on is_current = 'yes' while ingest never has to UPDATE history.
+"""
+
+DATA_SUFFIX = '_data'
+
+# Logical tables that carry an is_current flag, relative to the base table name.
+FLAGGED_TABLE_SUFFIXES = ['_history', '_industry_history', '_sector_history']
+
+def table_names(project_id, dataset_id, base_table_name):
+    """Fully qualified names of the logical tables, their physical `_data` tables and the snapshot pointer.
+    Without project and dataset (local storage backend) the names are unqualified."""
+    prefix = '.'.join(part for part in [project_id, dataset_id, base_table_name] if part)
+    return {
+        'history': f"{prefix}_history",
+        'industry': f"{prefix}_industry_history",
+        'sector': f"{prefix}_sector_history",
+        'history_data': f"{prefix}_history{DATA_SUFFIX}",
+        'industry_data': f"{prefix}_industry_history{DATA_SUFFIX}",
+        'sector_data': f"{prefix}_sector_history{DATA_SUFFIX}",
+        'snapshots': f"{prefix}_snapshots",
+        # Physical tables behind the history_data view in HISTORY_MODE=delta (see delta_history.py)
+        'history_fast': f"{prefix}_history_fast",
+        'history_slow': f"{prefix}_history_slow",
+    }
+
+def current_snapshot_sql(snapshots_table, quote='`'):
+    """One-row query with the processed_at of the latest published snapshot."""
+    return f"SELECT MAX(processed_at) as processed_at FROM {quote}{snapshots_table}{quote}"
+
+def flagged_view_sql(data_table, snapshots_table, quote='`'):
+    """View exposing a `_data` table with an is_current column derived from the snapshot pointer."""
+    return f"""
+        SELECT d.*, CASE WHEN d.processed_at = c.processed_at THEN 'yes' ELSE 'no' END as is_current
+        FROM {quote}{data_table}{quote} d
+        CROSS JOIN ({current_snapshot_sql(snapshots_table, quote)}) c
+    """
@@ -0,0 +1,359 @@
+"""Pluggable persistence for the ingest pipeline.
+
+StorageBackend is what process_finviz_data writes through: raw blobs, table appends, the history table,
+the industry/sector aggregation and the snapshot pointer, plus SQL queries for readers and tools.
+
+- BigQueryBackend: GCS + BigQuery, the production setup (bigquery_storage.py).
+- LocalBackend: files under a local directory, tables as Parquet partitioned by processed_at date and
+  queried with DuckDB, running the same aggregation SQL. It needs `pip install duckdb` and lets the
+  whole pipeline run (and be profiled) without cloud access.
+"""
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import run_metrics
+from clients import get_bigquery_client, lazy_import
+from config import (
+    AGGREGATION_ENGINE, BQ_DATASET, BQ_TABLE_BASE, HISTORY_MODE, LOCAL_STORAGE_DIR, RAW_BUCKET_NAME, SNAPSHOT_MODE,
+    STORAGE_BACKEND,
+)
+from snapshots import DATA_SUFFIX, FLAGGED_TABLE_SUFFIXES, current_snapshot_sql, flagged_view_sql, table_names
+
+pd = lazy_import('pandas')
+aggregation = lazy_import('aggregation')
+bigquery_storage = lazy_import('bigquery_storage')
+delta_history = lazy_import('delta_history')
+history_schema = lazy_import('history_schema')
+raw_archive = lazy_import('raw_archive')
+
+logger = logging.getLogger(__name__)
+
+class StorageBackend:
+    """Persistence used by the ingest pipeline."""
+
+    dialect = 'bigquery'
+
+    def table_name(self, name):
+        """Name of table `name` as used in this backend's SQL (unquoted)."""
+        raise NotImplementedError
+
+    def ref(self, name):
+        """Quoted reference to table `name` for use in SQL."""
+        return aggregation.quote_table(self.table_name(name), self.dialect)
+
+    def put_blob(self, name, data, content_type='application/json'):
+        raise NotImplementedError
+
+    def get_blob(self, name):
+        """Contents of blob `name` as bytes, or None if it does not exist."""
+        raise NotImplementedError
+
+    def delete_blob(self, name):
+        """Deletes blob `name` (no-op if it does not exist)."""
+        raise NotImplementedError
+
+    def write_raw_archive(self, df, name):
+        raise NotImplementedError
+
+    def append_table(self, df, table, write_disposition='WRITE_APPEND', schema=None, clustering=None):
+        """Appends (or with WRITE_TRUNCATE replaces) table `table` with the rows of df. `schema` is an
+        optional [(column, type)] overriding inferred column types and `clustering` the clustering
+        columns of a table the load creates (see history_schema.py)."""
+        raise NotImplementedError
+
+    def append_history(self, df):
+        """Appends a snapshot (storage layout, including is_current) to the history table."""
+        raise NotImplementedError
+
+    def aggregate(self, df):
+        """Appends the industry and sector aggregation of the snapshot df (typed) to their tables."""
+        raise NotImplementedError
+
+    def publish_snapshot(self, processed_at, row_count):
+        """Makes processed_at the current snapshot for readers. Last write of a run."""
+        raise NotImplementedError
+
+    def snapshot_id(self, processed_at):
+        """snapshot_id of processed_at, as CAST(processed_at AS STRING) renders it in this backend's history."""
+        return aggregation.format_snapshot_id(processed_at)
+
+    def current_snapshot(self):
+        """processed_at of the current snapshot, or None."""
+        raise NotImplementedError
+
+    def query(self, sql, params=None):
+        """Runs SQL (named parameters written as @name) and returns a DataFrame."""
+        raise NotImplementedError
+
+class BigQueryBackend(StorageBackend):
+    """GCS for blobs, BigQuery for tables. Honors SNAPSHOT_MODE ('flag' or 'pointer') and HISTORY_MODE
+    ('full' or 'delta')."""
+
+    dialect = 'bigquery'
+
+    def __init__(self, dataset_id=BQ_DATASET, base_table_name=BQ_TABLE_BASE, bucket_name=RAW_BUCKET_NAME,
+                 snapshot_mode=SNAPSHOT_MODE, history_mode=HISTORY_MODE, client=None):
+        if history_mode == 'delta' and snapshot_mode != 'pointer':
+            raise ValueError("HISTORY_MODE=delta needs SNAPSHOT_MODE=pointer (history_data is a view).")
+        self.dataset_id = dataset_id
+        self.base_table_name = base_table_name
+        self.bucket_name = bucket_name
+        self.snapshot_mode = snapshot_mode
+        self.history_mode = history_mode
+        self._client = client
+        self._processed_at_type = None
+
+    @property
+    def client(self):
+        return self._client or get_bigquery_client()
+
+    def table_name(self, name):
+        return f"{self.client.project}.{self.dataset_id}.{name}"
+
+    def put_blob(self, name, data, content_type='application/json'):
+        bigquery_storage.upload_to_gcs(self.bucket_name, name, data, content_type=content_type)
+
+    def get_blob(self, name):
+        return bigquery_storage.download_from_gcs(self.bucket_name, name)
+
+    def delete_blob(self, name):
+        bigquery_storage.delete_from_gcs(self.bucket_name, name)
+
+    def write_raw_archive(self, df, name):
+        raw_archive.write_raw_archive(df, self.bucket_name, name)
+
+    def append_table(self, df, table, write_disposition='WRITE_APPEND', schema=None, clustering=None):
+        bigquery_storage.insert_into_bigquery(df, self.dataset_id, table, write_disposition=write_disposition,
+                                              schema=schema, clustering=clustering)
+
+    def append_history(self, df):
+        history = f"{self.base_table_name}_history"
+        if self.history_mode == 'delta':
+            delta_history.append_snapshot(self, df, f"{history}_fast", f"{history}_slow")
+        elif self.snapshot_mode == 'pointer':
+            # Append-only; the snapshot becomes current in publish_snapshot().
+            df = df.drop(columns=['is_current'])
+            self.append_table(df, f"{history}{DATA_SUFFIX}", schema=history_schema.table_schema(df))
+        else:
+            # Update existing records to is_current='no', then append new records
+            bigquery_storage.set_all_historical(self.dataset_id, history)
+            self.append_table(df, history, schema=history_schema.table_schema(df))
+
+    def aggregate(self, df):
+        bigquery_storage.aggregate_current_data(self.dataset_id, self.base_table_name, df, snapshot_mode=self.snapshot_mode)
+
+    def publish_snapshot(self, processed_at, row_count):
+        if self.snapshot_mode == 'pointer':
+            bigquery_storage.publish_snapshot(self.dataset_id, self.base_table_name, processed_at, row_count)
+
+    def snapshot_id(self, processed_at):
+        # TIMESTAMP columns cast with a '+00' suffix, DATETIME ones without.
+        if self._processed_at_type is None:
+            tables = table_names(self.client.project, self.dataset_id, self.base_table_name)
+            history = tables['history_data'] if self.snapshot_mode == 'pointer' else tables['history']
+            self._processed_at_type = bigquery_storage.get_processed_at_type(self.client, history)
+        return aggregation.format_snapshot_id(processed_at, self._processed_at_type)
+
+    def current_snapshot(self):
+        tables = table_names(self.client.project, self.dataset_id, self.base_table_name)
+        if self.snapshot_mode == 'pointer':
+            sql = current_snapshot_sql(tables['snapshots'])
+        else:
+            sql = f"SELECT MAX(processed_at) as processed_at FROM `{tables['history']}` WHERE is_current = 'yes'"
+        value = self.query(sql)['processed_at'].iloc[0]
+        return None if pd.isna(value) else pd.Timestamp(value)
+
+    def query(self, sql, params=None):
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            _bigquery_parameter(bigquery, name, value) for name, value in (params or {}).items()
+        ])
+        return self.client.query(sql, job_config=job_config).to_dataframe()
+
+def _bigquery_parameter(bigquery, name, value):
+    if isinstance(value, (list, tuple)):
+        element_type = 'INT64' if all(isinstance(v, int) for v in value) and value else 'STRING'
+        return bigquery.ArrayQueryParameter(name, element_type, list(value))
+    if isinstance(value, bool):
+        return bigquery.ScalarQueryParameter(name, 'BOOL', value)
+    if isinstance(value, int):
+        return bigquery.ScalarQueryParameter(name, 'INT64', value)
+    if isinstance(value, float):
+        return bigquery.ScalarQueryParameter(name, 'FLOAT64', value)
+    return bigquery.ScalarQueryParameter(name, 'STRING', value)
+
+class LocalBackend(StorageBackend):
+    """Blobs and Parquet tables under `root`, queried with DuckDB.
+
+    Tables live in root/tables/<table>/, partitioned as processed_date=YYYY-MM-DD/ when they have a
+    processed_at column. History uses the snapshot-pointer layout: append-only `_data` tables plus a
+    `_snapshots` table, exposed through views that add is_current like the BigQuery pointer views. With
+    HISTORY_MODE=delta, history_data is a view over the `_history_fast` and `_history_slow` tables."""
+
+    dialect = 'duckdb'
+
+    def __init__(self, root=LOCAL_STORAGE_DIR, base_table_name=BQ_TABLE_BASE, history_mode=HISTORY_MODE):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("The local storage backend needs DuckDB: pip install duckdb") from e
+        self.root = root
+        self.base_table_name = base_table_name
+        self.history_mode = history_mode
+        self.tables = table_names(None, None, base_table_name)
+        os.makedirs(os.path.join(root, 'tables'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        self._con = duckdb.connect()
+        self._lock = threading.Lock()
+
+    def table_name(self, name):
+        return name
+
+    def _table_dir(self, table):
+        return os.path.join(self.root, 'tables', table)
+
+    def blob_path(self, name):
+        return os.path.join(self.root, 'blobs', name)
+
+    def put_blob(self, name, data, content_type='application/json'):
+        path = self.blob_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+        run_metrics.add('bytes_uploaded', os.path.getsize(path))
+        logger.info(f"File {name} written to {path}.")
+
+    def get_blob(self, name):
+        try:
+            with open(self.blob_path(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete_blob(self, name):
+        try:
+            os.remove(self.blob_path(name))
+        except FileNotFoundError:
+            pass
+
+    def write_raw_archive(self, df, name):
+        path = self.blob_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        rows = raw_archive.write_parquet(df, path)
+        run_metrics.add('bytes_uploaded', os.path.getsize(path))
+        logger.info(f"File {name} ({rows} rows, Parquet/{raw_archive.COMPRESSION}) written to {path}.")
+
+    def append_table(self, df, table, write_disposition='WRITE_APPEND', schema=None, clustering=None):
+        # Parquet keeps the frame's dtypes, and DuckDB has no clustering: schema and clustering are ignored.
+        import pyarrow.parquet as pq
+        import pyarrow as pa
+
+        table_dir = self._table_dir(table)
+        with self._lock:
+            if write_disposition == 'WRITE_TRUNCATE' and os.path.exists(table_dir):
+                shutil.rmtree(table_dir)
+            if 'processed_at' in df.columns:
+                # Partitioned by date; an empty frame has no partition to write to.
+                groups = df.groupby(pd.to_datetime(df['processed_at']).dt.strftime('%Y-%m-%d'), sort=False)
+            else:
+                groups = [(None, df)]
+            for date, part in groups:
+                part_dir = os.path.join(table_dir, f"processed_date={date}") if date else table_dir
+                os.makedirs(part_dir, exist_ok=True)
+                path = os.path.join(part_dir, f"part-{uuid.uuid4().hex}.parquet")
+                pq.write_table(pa.Table.from_pandas(part, preserve_index=False), path, compression='zstd')
+                run_metrics.add('bytes_uploaded', os.path.getsize(path))
+        logger.info(f"Loaded {len(df)} rows into {table} ({table_dir}).")
+
+    def append_history(self, df):
+        if self.history_mode == 'delta':
+            delta_history.append_snapshot(self, df, self.tables['history_fast'], self.tables['history_slow'])
+        else:
+            self.append_table(df.drop(columns=['is_current'], errors='ignore'), self.tables['history_data'])
+
+    def aggregate(self, df):
+        processed_at = df['processed_at'].iloc[0]
+        snapshot_id = aggregation.format_snapshot_id(processed_at)
+        for level in ['industry', 'sector']:
+            if AGGREGATION_ENGINE == 'python':
+                rows = aggregation.aggregate_snapshot(df, level, processed_at, snapshot_id, is_current=None)
+            else:
+                sql = aggregation.aggregation_sql(
+                    self.tables['history_data'], level, where="WHERE CAST(processed_at AS STRING) = @snapshot_id",
+                    is_current=None, dialect=self.dialect)
+                rows = self.query(sql, {'snapshot_id': snapshot_id})
+            if rows.empty:
+                raise RuntimeError(f"Verification failed: {level} aggregation of snapshot {snapshot_id} produced 0 rows.")
+            self.append_table(rows, self.tables[f'{level}_data'])
+
+    def publish_snapshot(self, processed_at, row_count):
+        row = pd.DataFrame([{
+            'snapshot_id': aggregation.format_snapshot_id(processed_at),
+            'processed_at': processed_at,
+            'row_count': row_count,
+            'published_at': pd.Timestamp.now(tz='UTC'),
+        }])
+        self.append_table(row, self.tables['snapshots'])
+        logger.info(f"Published snapshot {row['snapshot_id'].iloc[0]}.")
+
+    def current_snapshot(self):
+        if not os.path.exists(self._table_dir(self.tables['snapshots'])):
+            return None
+        value = self.query(current_snapshot_sql(self.tables['snapshots'], quote='"'))['processed_at'].iloc[0]
+        return None if pd.isna(value) else pd.Timestamp(value)
+
+    def _register_views(self):
+        """(Re)creates one DuckDB view per table directory plus the is_current views of the flagged tables."""
+        tables_dir = os.path.join(self.root, 'tables')
+        existing = set(os.listdir(tables_dir))
+        for table in existing:
+            pattern = os.path.join(tables_dir, table, '**', '*.parquet').replace("'", "''")
+            self._con.execute(f"""CREATE OR REPLACE VIEW "{table}" AS
+                SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true)""")
+        fast, slow = self.tables['history_fast'], self.tables['history_slow']
+        if self.tables['history_data'] not in existing and fast in existing and slow in existing:
+            # Delta history: reassemble full snapshots from the fast rows and the slow versions.
+            slow_cols = [c for c in self._con.execute(f'SELECT * FROM "{slow}" LIMIT 0').df().columns
+                         if c in delta_history.SLOW_COLUMNS]
+            self._con.execute(f'CREATE OR REPLACE VIEW "{self.tables["history_data"]}" AS '
+                              f'{delta_history.reassembly_sql(fast, slow, slow_cols, quote=chr(34))}')
+            existing.add(self.tables['history_data'])
+        for suffix in FLAGGED_TABLE_SUFFIXES:
+            logical = f"{self.base_table_name}{suffix}"
+            if f"{logical}{DATA_SUFFIX}" in existing and self.tables['snapshots'] in existing:
+                self._con.execute(f'CREATE OR REPLACE VIEW "{logical}" AS '
+                                  f'{flagged_view_sql(f"{logical}{DATA_SUFFIX}", self.tables["snapshots"], quote=chr(34))}')
+
+    def query(self, sql, params=None):
+        # DuckDB writes named parameters as $name
+        sql = re.sub(r'@(\w+)', r'$\1', sql)
+        with self._lock:
+            self._register_views()
+            return self._con.execute(sql, params or {}).df()
+
+def script_backend(name='bigquery'):
+    """Backend for command line tools: BigQuery with the credentials from .env.local, or the local one."""
+    if name == 'local':
+        return get_storage_backend('local')
+    from google.cloud import bigquery
+    from backfill_aggregations import get_credentials
+    project_id, credentials = get_credentials()
+    return BigQueryBackend(client=bigquery.Client(project=project_id, credentials=credentials))
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_storage_backend(name=None):
+    """The process-wide backend selected by STORAGE_BACKEND ('bigquery' or 'local')."""
+    name = name or STORAGE_BACKEND
+    factories = {'bigquery': BigQueryBackend, 'local': LocalBackend}
+    if name not in factories:
+        raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; expected 'bigquery' or 'local'.")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = factories[name]()
+        return _backends[name]
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The backend is a flat set of modules (deployed as the Cloud Function source directory).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EXPORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'full_export_2026-02-15.csv')
@@ -0,0 +1,31 @@
+"""Parity of the in-process aggregation with the aggregation SQL (DuckDB on the local backend) for both
+history layouts, on the recorded export."""
+import pytest
+
+import history_schema
+import main
+import parsing
+from aggregation import aggregate_snapshot, aggregation_sql, format_snapshot_id
+from conftest import EXPORT
+from storage_backends import LocalBackend
+from verify_aggregation import compare
+
+@pytest.fixture(scope='module')
+def snapshot():
+    with open(EXPORT, 'rb') as f:
+        df, _ = main.transform_snapshot(parsing.parse_view_csv(f, 'export'))
+    return df
+
+@pytest.mark.parametrize('version', [history_schema.LEGACY, history_schema.TYPED])
+@pytest.mark.parametrize('level', ['industry', 'sector'])
+def test_aggregate_snapshot_matches_sql(snapshot, tmp_path, version, level):
+    storage = LocalBackend(root=str(tmp_path))
+    storage.append_table(history_schema.to_storage_layout(snapshot, version), 'history')
+    processed_at = snapshot['processed_at'].iloc[0]
+
+    expected = storage.query(aggregation_sql('history', level, is_current=None, dialect=storage.dialect,
+                                             schema_version=version))
+    actual = aggregate_snapshot(snapshot, level, processed_at, format_snapshot_id(processed_at), is_current=None)
+
+    assert len(expected) > 1
+    assert compare(level, expected, actual) == []
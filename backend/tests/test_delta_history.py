@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from delta_history import changed_records, row_hash, split_snapshot
+
+def test_row_hash_matches_rows_read_back_as_strings():
+    written = pd.DataFrame({'company': ['Apple', None], 'beta': [1.25, np.nan]})
+    read_back = pd.DataFrame({'company': ['Apple', None], 'beta': ['1.25', None]})
+    pd.testing.assert_series_equal(row_hash(written), row_hash(read_back))
+    assert row_hash(written).iloc[0] != row_hash(written).iloc[1]
+
+def test_changed_records_keeps_new_and_changed_tickers():
+    snapshot = pd.DataFrame({
+        'ticker': ['AAPL', 'MSFT', 'NVDA'],
+        'processed_at': pd.Timestamp('2026-02-02'),
+        'price': [1.0, 2.0, 3.0],
+        'company': ['Apple', 'Microsoft', 'Nvidia'],
+        'beta': [1.2, 0.9, 1.7],
+    })
+    fast, slow = split_snapshot(snapshot)
+    assert fast.columns.tolist() == ['ticker', 'processed_at', 'price']
+    assert slow.columns.tolist() == ['ticker', 'valid_from', 'row_hash', 'company', 'beta']
+
+    latest = slow.set_index('ticker')['row_hash']
+    snapshot.loc[1, 'beta'] = 1.0
+    _, next_slow = split_snapshot(snapshot)
+    latest = latest.drop('NVDA')
+    assert changed_records(next_slow, latest)['ticker'].tolist() == ['MSFT', 'NVDA']
@@ -0,0 +1,54 @@
+import time
+
+import pandas as pd
+import pytest
+
+import main
+from main import TokenBucket, merge_views
+
+def test_token_bucket_allows_a_burst_then_waits_for_the_rate():
+    bucket = TokenBucket(rate=50, capacity=2)
+    started = time.monotonic()
+    bucket.acquire()
+    bucket.acquire()
+    assert time.monotonic() - started < 0.01
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.015
+
+@pytest.mark.parametrize('rate, capacity', [(0, 2), (-1, 2), (float('nan'), 2), (1, 0)])
+def test_token_bucket_rejects_invalid_limits(rate, capacity):
+    with pytest.raises(ValueError):
+        TokenBucket(rate, capacity)
+
+def test_merge_views_aligns_on_ticker_and_reports_duplicates_and_missing():
+    overview = pd.DataFrame({'Ticker': ['AAPL', 'MSFT', 'MSFT'], 'Price': [1.0, 2.0, 3.0], 'Sector': ['T', 'T', 'X']})
+    technical = pd.DataFrame({'Ticker': ['MSFT', 'NVDA'], 'Price': [9.0, 4.0], 'Beta': [1.1, 1.5]})
+    merged, report = merge_views([('overview', overview), ('technical', technical)])
+
+    assert merged['Ticker'].tolist() == ['AAPL', 'MSFT', 'NVDA']
+    assert merged.columns.tolist() == ['Ticker', 'Price', 'Sector', 'Beta']
+    # Repeated columns come from the first view that has them; duplicates keep their first row.
+    assert merged.set_index('Ticker').loc['MSFT', ['Price', 'Sector', 'Beta']].tolist() == [2.0, 'T', 1.1]
+    assert pd.isna(merged.set_index('Ticker').loc['NVDA', 'Price'])
+    assert report['duplicates'] == {'overview': ['MSFT']}
+    assert report['missing'] == {'overview': ['NVDA'], 'technical': ['AAPL']}
+
+class Request:
+    def __init__(self, **args):
+        self.args = args
+
+def test_resume_rejects_another_day(monkeypatch):
+    def ingest(*args, **kwargs):
+        raise AssertionError("must not ingest")
+    monkeypatch.setattr(main, '_ingest', ingest)
+    body, status = main.resume_finviz_data(Request(date='2000-01-01'))
+    assert status == 400
+    assert '2000-01-01' in body
+
+def test_resume_accepts_today(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, '_ingest', lambda metrics, **kwargs: calls.append(kwargs) or ("ok", 200))
+    monkeypatch.setattr(main, '_store_run_metrics', lambda metrics: None)
+    today = main.datetime.now().strftime('%Y-%m-%d')
+    assert main.resume_finviz_data(Request(date=today, max_age_minutes='30')) == ("ok", 200)
+    assert calls == [{'force': False, 'checkpoint_max_age': 30}]
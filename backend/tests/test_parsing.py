@@ -0,0 +1,44 @@
+import json
+
+import pandas as pd
+import pytest
+
+from parsing import from_legacy_layout, normalize_column_name, parse_view_csv, to_legacy_layout
+
+CSV = b'''"No.","Ticker","Company","Market Cap","Change","Volume"
+"1","AAPL","Apple Inc","3000000.50","1.23%","1000"
+"2","MSFT","Microsoft Corp","","-0.50%",""
+'''
+
+def test_parse_view_csv_types_the_columns():
+    df = parse_view_csv(CSV, 'overview')
+    assert df['Ticker'].tolist() == ['AAPL', 'MSFT']
+    assert df['Change'].tolist() == [1.23, -0.5]
+    assert df['Market Cap'].iloc[0] == 3000000.5
+    assert pd.isna(df['Market Cap'].iloc[1]) and pd.isna(df['Volume'].iloc[1])
+
+def test_parse_view_csv_rejects_empty_payloads():
+    with pytest.raises(ValueError, match='empty payload'):
+        parse_view_csv(b'', 'overview')
+    with pytest.raises(ValueError, match='no visible rows'):
+        parse_view_csv(CSV.split(b'\n')[0] + b'\n', 'overview')
+
+def test_parse_view_csv_allows_empty_shards():
+    df = parse_view_csv(CSV.split(b'\n')[0] + b'\n', 'overview', allow_empty=True)
+    assert df.empty
+    assert 'Ticker' in df.columns
+
+def test_legacy_layout_round_trip():
+    df = parse_view_csv(CSV, 'overview')
+    df.columns = [normalize_column_name(c) for c in df.columns]
+    legacy = to_legacy_layout(df)
+    assert legacy['change'].tolist() == ['1.23%', '-0.50%']
+    assert str(legacy['volume'].dtype) == 'Int64'
+    pd.testing.assert_series_equal(from_legacy_layout(legacy)['change'], df['change'])
+
+def test_legacy_layout_keeps_missing_values_null():
+    legacy = to_legacy_layout(parse_view_csv(CSV, 'overview'))
+    assert pd.isna(legacy.loc[1, 'Market Cap']) and pd.isna(legacy.loc[1, 'Volume'])
+    assert legacy.loc[1, 'Change'] == '-0.50%'
+    records = json.loads(legacy.to_json(orient='records'))
+    assert records[1]['Market Cap'] is None and records[1]['Volume'] is None
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from aggregation import format_snapshot_id
+from payload_fingerprint import fingerprint, last_payload, record_payload
+from storage_backends import LocalBackend
+
+FRAME = pd.DataFrame({'Ticker': ['AAPL', 'MSFT'], 'Price': [1.0, 2.0], 'Sector': ['Technology', None]})
+
+def test_fingerprint_ignores_row_and_column_order():
+    shuffled = FRAME.iloc[::-1][['Sector', 'Price', 'Ticker']]
+    assert fingerprint(shuffled) == fingerprint(FRAME)
+
+def test_fingerprint_changes_with_any_value():
+    changed = FRAME.copy()
+    changed.loc[1, 'Price'] = 2.01
+    assert fingerprint(changed) != fingerprint(FRAME)
+
+class TimestampBackend(LocalBackend):
+    """A backend whose history stores processed_at as TIMESTAMP (snapshot ids cast with '+00')."""
+
+    def snapshot_id(self, processed_at):
+        return format_snapshot_id(processed_at, 'TIMESTAMP')
+
+def test_record_payload_uses_the_backend_snapshot_id(tmp_path):
+    storage = TimestampBackend(root=str(tmp_path))
+    processed_at = pd.Timestamp('2026-02-15 21:30:00')
+    record_payload(storage, fingerprint(FRAME), processed_at, len(FRAME))
+    assert last_payload(storage)['snapshot_id'] == '2026-02-15 21:30:00+00'
@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+
+import read_api
+from read_api import TTLCache
+
+class FakeStorage:
+    """Answers every query with the same frame and counts the queries."""
+    base_table_name = 'stocks'
+
+    def __init__(self):
+        self.queries = []
+
+    def ref(self, name):
+        return name
+
+    def get_blob(self, name):
+        return None
+
+    def query(self, sql, params=None):
+        self.queries.append((sql, params))
+        return pd.DataFrame({'ticker': ['AAPL', 'MSFT'], 'price': [1.0, 2.0]})
+
+class Request:
+    def __init__(self, path, args=None, headers=None):
+        self.path, self.args, self.headers = path, args or {}, headers or {}
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    read_api.invalidate()
+    yield
+    read_api.invalidate()
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(read_api.time, 'monotonic', lambda: clock[0])
+    cache = TTLCache(max_entries=4, ttl=10)
+    cache.put('a', 1)
+    clock[0] += 10
+    assert cache.get('a') == 1
+    clock[0] += 1
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_ttl_cache_evicts_the_least_recently_used_entry():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+def test_ttl_cache_evicts_least_recently_used_entries_over_the_byte_budget():
+    cache = TTLCache(max_entries=10, ttl=60, max_bytes=10)
+    cache.put('a', 1, size=4)
+    cache.put('b', 2, size=4)
+    cache.get('a')
+    cache.put('c', 3, size=4)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c'), cache.bytes) == (1, 3, 8)
+    cache.put('huge', 4, size=11)
+    assert cache.get('huge') is None
+    assert cache.bytes == 8
+
+def test_cache_key_ignores_parameters_the_resource_does_not_use():
+    storage = FakeStorage()
+    read_api.handle(Request('/sectors', {'sector': 'Energy', 'columns': 'ticker', 'cb': '1'}), storage)
+    read_api.handle(Request('/sectors', {'cb': '2'}), storage)
+    read_api.handle(Request('/sectors', {'snapshot_id': 's1', 'days': '7'}), storage)
+    read_api.handle(Request('/sectors', {'snapshot_id': 's1'}), storage)
+    assert len(storage.queries) == 2
+
+def test_repeated_requests_are_served_from_the_cache_with_an_etag():
+    storage = FakeStorage()
+    body, status, headers = read_api.handle(Request('/snapshot', {'columns': 'ticker,price'}), storage)
+    assert status == 200
+    assert headers['Content-Type'] == read_api.JSON_CONTENT_TYPE
+    assert len(headers['ETag']) == 34
+
+    again = read_api.handle(Request('/snapshot', {'columns': 'ticker,price'}), storage)
+    assert again == (body, status, headers)
+    assert len(storage.queries) == 1
+
+    not_modified = read_api.handle(Request('/snapshot', {'columns': 'ticker,price'}, {'If-None-Match': headers['ETag']}), storage)
+    assert not_modified[:2] == ('', 304)
+
+def test_invalidate_drops_cached_responses():
+    storage = FakeStorage()
+    read_api.handle(Request('/sectors'), storage)
+    read_api.invalidate('2026-02-15 12:00:00')
+    _, _, headers = read_api.handle(Request('/sectors'), storage)
+    assert len(storage.queries) == 2
+    assert headers['X-Snapshot-Id'] == '2026-02-15 12:00:00'
+
+@pytest.mark.parametrize('path, args, status', [
+    ('/unknown', {}, 404),
+    ('/snapshot', {'days': '7'}, 400),
+    ('/industries', {'days': '0'}, 400),
+    ('/snapshot', {'columns': 'price; DROP TABLE x'}, 400),
+])
+def test_invalid_requests(path, args, status):
+    assert read_api.handle(Request(path, args), FakeStorage())[1] == status
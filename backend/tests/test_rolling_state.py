@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from rolling_state import RollingState
+
+def _advance(state, day, prices):
+    state.advance(pd.Timestamp(day), {'price': pd.Series(prices, dtype='float64')})
+
+def test_advance_shifts_the_window_and_adds_tickers():
+    state = RollingState(['price'], window=3)
+    _advance(state, '2026-02-02', {'AAPL': 1.0, 'MSFT': 2.0})
+    _advance(state, '2026-02-03', {'AAPL': 1.5, 'NVDA': 3.0})
+
+    assert state.last_trading_day == pd.Timestamp('2026-02-03')
+    rows = state.series['price'][state.rows(['AAPL', 'MSFT', 'NVDA'])]
+    np.testing.assert_array_equal(rows, [[np.nan, 1.0, 1.5], [np.nan, 2.0, np.nan], [np.nan, np.nan, 3.0]])
+    assert state.latest('price').dropna().to_dict() == {'AAPL': 1.5, 'NVDA': 3.0}
+
+def test_advance_prunes_tickers_that_left_the_window():
+    state = RollingState(['price'], window=2)
+    _advance(state, '2026-02-02', {'AAPL': 1.0, 'MSFT': 2.0})
+    _advance(state, '2026-02-03', {'AAPL': 1.1})
+    _advance(state, '2026-02-04', {'AAPL': 1.2})
+    assert state.tickers.tolist() == ['AAPL']
+    assert len(state.trading_days) == 2
+
+def test_parquet_round_trip():
+    state = RollingState(['price', 'change'], window=3, meta={'trading_day_ordinal': 7})
+    state.advance(pd.Timestamp('2026-02-02'), {'price': pd.Series({'AAPL': 1.0}), 'change': pd.Series({'AAPL': 0.5})})
+    restored = RollingState.from_parquet(state.to_parquet(), ['price', 'change'])
+    assert restored.meta == {'trading_day_ordinal': 7}
+    assert restored.trading_days == state.trading_days
+    assert restored.tickers.tolist() == ['AAPL']
+    for name in ['price', 'change']:
+        np.testing.assert_array_equal(restored.series[name], state.series[name])
+
+def test_bollinger_distance_is_measured_from_the_nearer_band():
+    from indicators import bollinger_signals
+    state = RollingState(['price'])
+    days = pd.bdate_range('2026-01-05', periods=20)
+    for i, day in enumerate(days[:-1]):
+        _advance(state, day, {'HIGH': 10.0 + (i % 2), 'LOW': 10.0 + (i % 2)})
+    # Both end inside their bands: HIGH just under the upper one, LOW just over the lower one.
+    _advance(state, days[-1], {'HIGH': 11.2, 'LOW': 9.8})
+    snapshot = pd.DataFrame({
+        'price': [11.2, 9.8], 'company': ['High', 'Low'], 'sector': 'Tech', 'industry': 'Software',
+        'relative_strength_index_14': 50.0, 'market_cap': 1.0,
+    }, index=pd.Index(['HIGH', 'LOW'], name='ticker'))
+
+    signals = bollinger_signals(state, snapshot, days[-1], '2026-01-30 00:00:00').set_index('ticker')
+    assert signals['band_side'].to_dict() == {'HIGH': 'upper', 'LOW': 'lower'}
+    high, low = signals.loc['HIGH'], signals.loc['LOW']
+    assert high['distance_from_band'] == (high['price'] - high['upper_band']) / high['upper_band'] * 100
+    assert low['distance_from_band'] == (low['lower_band'] - low['price']) / low['lower_band'] * 100
+    assert (signals['distance_from_band'] < 0).all()
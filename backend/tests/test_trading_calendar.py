@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+import main
+import parsing
+from aggregation import format_snapshot_id
+from conftest import EXPORT
+from indicators import record_calendar
+from storage_backends import LocalBackend
+from trading_calendar import MIN_OVERLAP, calendar_table, classify
+
+def _snapshot(count, offset=0.0):
+    tickers = [f"T{i}" for i in range(count)]
+    prices = pd.Series(np.arange(1, count + 1, dtype='float64') + offset, index=tickers)
+    market_caps = pd.Series(np.arange(count, 0, -1, dtype='float64'), index=tickers)
+    return prices, market_caps
+
+def test_first_snapshot_is_a_trading_day():
+    prices, caps = _snapshot(50)
+    assert classify(None, prices, caps)[:3] == (True, None, 0)
+
+def test_repeated_prices_are_not_a_trading_day():
+    prices, caps = _snapshot(50)
+    is_trading_day, changed, compared, digest = classify(prices, prices.copy(), caps)
+    assert (is_trading_day, changed, compared) == (False, 0.0, 50)
+    assert digest == classify(None, prices, caps)[3]
+
+def test_moved_prices_are_a_trading_day():
+    previous, caps = _snapshot(50)
+    prices = previous.copy()
+    prices.iloc[:5] += 0.01
+    assert classify(previous, prices, caps)[:2] == (True, 0.1)
+
+def test_too_little_overlap_counts_as_a_trading_day():
+    previous, _ = _snapshot(MIN_OVERLAP - 1)
+    prices, caps = _snapshot(50)
+    assert classify(previous, prices, caps)[:3] == (True, None, MIN_OVERLAP - 1)
+
+class TimestampBackend(LocalBackend):
+    """A backend whose history stores processed_at as TIMESTAMP (snapshot ids cast with '+00')."""
+
+    def snapshot_id(self, processed_at):
+        return format_snapshot_id(processed_at, 'TIMESTAMP')
+
+def test_calendar_rows_use_the_backend_snapshot_id(tmp_path):
+    with open(EXPORT, 'rb') as f:
+        df, _ = main.transform_snapshot(parsing.parse_view_csv(f, 'export'))
+    storage = TimestampBackend(root=str(tmp_path))
+    assert record_calendar(storage, df) is not None
+
+    calendar = storage.query(f"SELECT snapshot_id FROM {storage.ref(calendar_table())}")
+    assert calendar['snapshot_id'].tolist() == [format_snapshot_id(df['processed_at'].iloc[0], 'TIMESTAMP')]
@@ -0,0 +1,116 @@
+"""Trading-day calendar of the ingested snapshots.
+
+Finviz keeps serving the last close on weekends and market holidays, so not every snapshot is a trading
+day. Each ingest classifies its snapshot once and appends a row to `<base>_trading_calendar`:
+
+    snapshot_id, processed_at, is_trading_day, trading_day_ordinal, changed_fraction, tickers_compared, fingerprint
+
+A snapshot is a trading day if at least MIN_CHANGED_FRACTION of the REFERENCE_SIZE largest tickers it
+shares with the previous trading day changed price. A single stale or glitching ticker can't flip the
+decision. Non-trading snapshots carry the ordinal of the trading day they repeat, so
+`trading_day_ordinal` counts distinct trading days and queries can join on the calendar instead of
+rediscovering trading days from history. `fingerprint` hashes the reference prices (for diagnostics).
+
+    python trading_calendar.py --rebuild    # recompute the whole table from history
+"""
+import argparse
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from config import BQ_TABLE_BASE
+
+REFERENCE_SIZE = 200
+MIN_CHANGED_FRACTION = 0.05
+MIN_OVERLAP = 20
+ORDINAL_KEY = 'trading_day_ordinal'
+
+def calendar_table(base_table_name=BQ_TABLE_BASE):
+    return f"{base_table_name}_trading_calendar"
+
+def reference_tickers(prices, market_caps, size=REFERENCE_SIZE):
+    """The `size` largest tickers by market cap that have a price."""
+    caps = market_caps[prices.notna()].dropna()
+    return caps.sort_values(ascending=False, kind='stable').index[:size]
+
+def fingerprint(prices):
+    """Stable hash of ticker/price pairs."""
+    pairs = sorted(f"{ticker}={price:.4f}" for ticker, price in prices.dropna().items())
+    return hashlib.sha1('|'.join(pairs).encode('utf-8')).hexdigest()
+
+def classify(previous_prices, prices, market_caps):
+    """Compares a snapshot (prices and market caps by ticker) with the previous trading day's prices.
+    Returns (is_trading_day, changed_fraction, tickers_compared, fingerprint)."""
+    reference = reference_tickers(prices, market_caps)
+    current = prices.reindex(reference)
+    if previous_prices is None:
+        return True, None, 0, fingerprint(current)
+    previous = previous_prices.reindex(reference)
+    compared = previous.notna() & current.notna()
+    count = int(compared.sum())
+    if count < MIN_OVERLAP:
+        # Too little overlap to tell (first run, universe change): count it as a new trading day.
+        return True, None, count, fingerprint(current)
+    changed = float((np.abs(current[compared] - previous[compared]) > 1e-9).mean())
+    return changed >= MIN_CHANGED_FRACTION, changed, count, fingerprint(current)
+
+def calendar_row(snapshot_id, processed_at, is_trading_day, ordinal, changed_fraction, compared, digest):
+    return {
+        'snapshot_id': snapshot_id,
+        'processed_at': processed_at,
+        'is_trading_day': bool(is_trading_day),
+        'trading_day_ordinal': int(ordinal),
+        'changed_fraction': changed_fraction,
+        'tickers_compared': int(compared),
+        'fingerprint': digest,
+    }
+
+def calendar_frame(rows):
+    return pd.DataFrame(rows).astype({'changed_fraction': 'float64'})
+
+def last_ordinal(storage, base_table_name=BQ_TABLE_BASE):
+    """Highest ordinal in the calendar table, or 0 if it is empty or missing."""
+    try:
+        value = storage.query(f"SELECT MAX(trading_day_ordinal) as ordinal FROM {storage.ref(calendar_table(base_table_name))}")['ordinal'].iloc[0]
+    except Exception:
+        return 0
+    return 0 if pd.isna(value) else int(value)
+
+def rebuild(storage, base_table_name=BQ_TABLE_BASE):
+    """Recomputes the calendar of every snapshot in history and replaces the table."""
+    history = storage.ref(f"{base_table_name}_history")
+    frame = storage.query(f"SELECT processed_at, ticker, price, market_cap FROM {history} WHERE ticker IS NOT NULL")
+    frame['price'] = pd.to_numeric(frame['price'], errors='coerce')
+    frame['market_cap'] = pd.to_numeric(frame['market_cap'], errors='coerce')
+    rows, previous, ordinal = [], None, 0
+    for processed_at, snapshot in frame.groupby('processed_at', sort=True):
+        snapshot = snapshot.drop_duplicates('ticker').set_index('ticker')
+        is_trading_day, changed, compared, digest = classify(previous, snapshot['price'], snapshot['market_cap'])
+        if is_trading_day:
+            ordinal += 1
+            previous = snapshot['price']
+        rows.append(calendar_row(storage.snapshot_id(processed_at), processed_at, is_trading_day, ordinal, changed, compared, digest))
+    storage.append_table(calendar_frame(rows), calendar_table(base_table_name), write_disposition='WRITE_TRUNCATE')
+    _sync_state_ordinal(storage, ordinal)
+    print(f"Rebuilt calendar: {ordinal} trading days in {len(rows)} snapshots.")
+    return ordinal
+
+def _sync_state_ordinal(storage, ordinal):
+    """Lets the next ingest continue from the rebuilt ordinals."""
+    # Imported here: indicators imports this module.
+    from indicators import SERIES
+    from rolling_state import STATE_BLOB, load_state, save_state
+    if storage.get_blob(STATE_BLOB) is None:
+        return
+    state = load_state(storage, SERIES)
+    state.meta[ORDINAL_KEY] = ordinal
+    save_state(storage, state)
+
+if __name__ == '__main__':
+    from storage_backends import script_backend
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', required=True, help="recompute the table from history")
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default='bigquery')
+    args = parser.parse_args()
+    rebuild(script_backend(args.backend))
@@ -0,0 +1,96 @@
+"""Parity check: in-process aggregation (aggregation.aggregate_snapshot) vs. the reference SQL.
+
+Aggregates one history snapshot both ways and compares every column. Exits non-zero on a mismatch.
+
+    python verify_aggregation.py                       # current snapshot
+    python verify_aggregation.py --snapshot "2026-02-15 12:00:00"
+    python verify_aggregation.py --backend local       # DuckDB over LOCAL_STORAGE_DIR
+"""
+import argparse
+import math
+import sys
+
+import pandas as pd
+
+from aggregation import AGGREGATION_COLUMNS, aggregate_snapshot, aggregation_sql
+from history_schema import from_storage_layout
+from storage_backends import script_backend
+
+NUMERIC_COLUMNS = [
+    'change', 'week', 'month', 'quarter', 'rsi', 'momentum',
+    'changeEqual', 'weekEqual', 'monthEqual', 'quarterEqual', 'rsiEqual', 'momentumEqual', 'marketCap',
+]
+
+def _close(a, b, rel_tol=1e-9, abs_tol=1e-9):
+    a_missing, b_missing = pd.isna(a), pd.isna(b)
+    if a_missing or b_missing:
+        return a_missing and b_missing
+    return math.isclose(float(a), float(b), rel_tol=rel_tol, abs_tol=abs_tol)
+
+def compare(level, expected, actual):
+    """Returns a list of human readable differences between SQL (expected) and Python (actual) rows."""
+    problems = []
+    expected = expected.set_index('name')
+    actual = actual.set_index('name')
+    for name in sorted(set(expected.index) ^ set(actual.index)):
+        problems.append(f"{level} {name!r}: only in {'SQL' if name in expected.index else 'Python'}")
+    for name in sorted(set(expected.index) & set(actual.index)):
+        e, a = expected.loc[name], actual.loc[name]
+        for col in NUMERIC_COLUMNS:
+            if not _close(e[col], a[col]):
+                problems.append(f"{level} {name!r}.{col}: SQL={e[col]} Python={a[col]}")
+        if int(e['stockCount']) != int(a['stockCount']):
+            problems.append(f"{level} {name!r}.stockCount: SQL={e['stockCount']} Python={a['stockCount']}")
+        # Ties in week may order tickers differently, so compare the ranked week values.
+        e_weeks = [s['week'] for s in e['topStocks']]
+        a_weeks = [s['week'] for s in a['topStocks']]
+        if len(e_weeks) != len(a_weeks) or not all(_close(x, y) for x, y in zip(e_weeks, a_weeks)):
+            problems.append(f"{level} {name!r}.topStocks: SQL={list(e['topStocks'])} Python={a['topStocks']}")
+    return problems
+
+def verify(snapshot_id=None, backend='bigquery'):
+    storage = script_backend(backend)
+    raw_table = storage.table_name('processed_stock_data_history')
+
+    if snapshot_id:
+        where = "WHERE CAST(processed_at AS STRING) = @snapshot_id"
+        params = {'snapshot_id': snapshot_id}
+    else:
+        where = "WHERE is_current = 'yes'"
+        params = {}
+
+    snapshot = storage.query(f"""
+        SELECT CAST(processed_at AS STRING) as snapshot_id, processed_at, ticker, industry, sector,
+               change, performance_week, performance_month, performance_quarter, relative_strength_index_14, market_cap
+        FROM {storage.ref('processed_stock_data_history')} {where}
+    """, params)
+    if snapshot.empty:
+        print("No rows found for the requested snapshot.")
+        return 1
+    snapshot = from_storage_layout(snapshot)
+    snapshot_id = snapshot['snapshot_id'].iloc[0]
+    print(f"Verifying snapshot {snapshot_id} ({len(snapshot)} tickers)")
+
+    problems = []
+    for level in ['industry', 'sector']:
+        expected = storage.query(aggregation_sql(raw_table, level, where=where, is_current='yes', dialect=storage.dialect), params)
+        actual = aggregate_snapshot(snapshot, level, snapshot['processed_at'].iloc[0], snapshot_id)
+        missing_cols = set(AGGREGATION_COLUMNS) - set(expected.columns)
+        if missing_cols:
+            problems.append(f"{level}: SQL result is missing columns {sorted(missing_cols)}")
+            continue
+        level_problems = compare(level, expected, actual)
+        print(f"{level}: {len(expected)} SQL rows, {len(actual)} Python rows, {len(level_problems)} differences")
+        problems.extend(level_problems)
+
+    for problem in problems:
+        print(problem)
+    print("PARITY OK" if not problems else f"PARITY FAILED ({len(problems)} differences)")
+    return 0 if not problems else 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot', help="snapshot_id (CAST(processed_at AS STRING)); defaults to the current snapshot")
+    parser.add_argument('--backend', choices=['bigquery', 'local'], default='bigquery')
+    args = parser.parse_args()
+    sys.exit(verify(args.snapshot, args.backend))
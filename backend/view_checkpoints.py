@@ -0,0 +1,91 @@
+"""Run-scoped checkpoints of the fetched Finviz views.
+
+Every view that was fetched and parsed is staged as a zstd Parquet blob keyed by day, filter and view:
+
+    staging/<YYYY-MM-DD>/<filter>/<view_name>-<view_id>[-<shard>].parquet
+
+(GCS bucket or LOCAL_STORAGE_DIR/blobs). If a later view exhausts its retries, the run fails, but
+the views that were already fetched stay staged. The next run (or a retry) within
+VIEW_CHECKPOINT_MAX_AGE_MINUTES loads them instead of downloading them again and only fetches the
+missing views. The resume_finviz_data entry point reuses a day's checkpoints regardless of their age.
+A run that gets past the fetch clears its checkpoints, so the next scheduled run fetches fresh data.
+"""
+import io
+import logging
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import raw_archive
+import run_metrics
+from config import VIEW_CHECKPOINT_MAX_AGE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+STAGING_PREFIX = 'staging'
+# Parquet key-value metadata holding the fetch time (UTC, ISO 8601)
+FETCHED_AT_KEY = b'finviz_fetched_at'
+
+class ViewCheckpoints:
+    """Staged views of one run. max_age (minutes) bounds the age of reusable checkpoints; None
+    reuses any checkpoint of the day and 0 disables checkpoints."""
+
+    def __init__(self, storage, day, filter_param, max_age=VIEW_CHECKPOINT_MAX_AGE_MINUTES):
+        self.storage = storage
+        self.day = day
+        self.filter_param = filter_param
+        self.max_age = max_age
+        self.enabled = max_age != 0
+
+    def blob_name(self, view_name, view_id, shard=None):
+        suffix = f"-{shard}" if shard else ''
+        return f"{STAGING_PREFIX}/{self.day}/{self.filter_param}/{view_name}-{view_id}{suffix}.parquet"
+
+    def load(self, view_name, view_id, shard=None):
+        """The staged frame of a view (shard), or None if there is no checkpoint or it is too old."""
+        if not self.enabled:
+            return None
+        name = self.blob_name(view_name, view_id, shard)
+        try:
+            data = self.storage.get_blob(name)
+            if data is None:
+                return None
+            table = pq.read_table(io.BytesIO(data))
+            fetched_at = datetime.fromisoformat(table.schema.metadata[FETCHED_AT_KEY].decode())
+        except Exception as e:
+            logger.warning(f"Could not read checkpoint {name}, fetching the view again: {e}")
+            return None
+        age = (datetime.now(timezone.utc) - fetched_at).total_seconds() / 60
+        if self.max_age is not None and age > self.max_age:
+            logger.info(f"Checkpoint {name} is {age:.0f} minutes old (limit {self.max_age}); fetching the view again.")
+            return None
+        run_metrics.add('views_resumed')
+        logger.info(f"Resumed view {view_name} from checkpoint {name} ({table.num_rows} rows, fetched {age:.0f} minutes ago).")
+        return table.to_pandas()
+
+    def save(self, view_name, view_id, df, shard=None):
+        """Stages a fetched view (shard). A failed write is logged and doesn't fail the fetch."""
+        if not self.enabled:
+            return
+        name = self.blob_name(view_name, view_id, shard)
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            fetched_at = datetime.now(timezone.utc).isoformat().encode()
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), FETCHED_AT_KEY: fetched_at})
+            sink = io.BytesIO()
+            pq.write_table(table, sink, compression=raw_archive.COMPRESSION)
+            self.storage.put_blob(name, sink.getvalue(), content_type=raw_archive.PARQUET_CONTENT_TYPE)
+        except Exception as e:
+            logger.warning(f"Could not checkpoint view {view_name}: {e}")
+
+    def clear(self, views, shards=None):
+        """Deletes the checkpoints of [(view_name, view_id)] (of each of `shards`)."""
+        if not self.enabled:
+            return
+        for view_name, view_id in views:
+            for shard in shards or [None]:
+                try:
+                    self.storage.delete_blob(self.blob_name(view_name, view_id, shard))
+                except Exception as e:
+                    logger.warning(f"Could not delete checkpoint of view {view_name}: {e}")
@@ -6,6 +6,7 @@ const envSchema = z.object({
     GCP_BUCKET_NAME: z.string().optional(),
     GCP_CLIENT_EMAIL: z.string().email("GCP_CLIENT_EMAIL must be a valid email"),
     GCP_PRIVATE_KEY: z.string().min(1, "GCP_PRIVATE_KEY is required"),
+    HISTORY_SCHEMA_VERSION: z.coerce.number().int().default(1),
     NODE_ENV: z.enum(['development', 'test', 'production']).default('development'),
 });
 
@@ -24,6 +25,7 @@ const validateEnv = () => {
                 clientEmail: parsed.GCP_CLIENT_EMAIL,
                 privateKey: parsed.GCP_PRIVATE_KEY.replace(/\\n/g, '\n').replace(/^"|"$/g, ''),
             },
+            historySchemaVersion: parsed.HISTORY_SCHEMA_VERSION,
             isProduction: parsed.NODE_ENV === 'production',
         };
     } catch (error) {
@@ -36,6 +38,7 @@ const validateEnv = () => {
                 return {
                     finviz: { apiUrl: '' },
                     gcp: { projectId: 'dummy-project', clientEmail: '', privateKey: '' },
+                    historySchemaVersion: 1,
                     isProduction: true
                 };
             }
@@ -49,6 +52,7 @@ const validateEnv = () => {
         return {
             finviz: { apiUrl: '', apiKey: '' },
             gcp: { projectId: '', clientEmail: '', privateKey: '' },
+            historySchemaVersion: 1,
             isProduction: false
         };
     }
@@ -5,6 +5,13 @@ import { revalidatePath, unstable_cache } from 'next/cache';
 import { config } from './config';
 import { queryBigQuery } from './bigquery';
 
+// Numeric history columns in the layout of HISTORY_SCHEMA_VERSION (backend/history_schema.py):
+// version 1 stores "-1.23%" strings and market cap in millions, version 2 FLOAT64 columns and dollars.
+const typedHistory = config.historySchemaVersion >= 2;
+const percentCol = (col: string) => typedHistory ? col : `SAFE_CAST(REPLACE(${col}, '%', '') AS FLOAT64)`;
+const numberCol = (col: string) => typedHistory ? col : `SAFE_CAST(${col} AS FLOAT64)`;
+const marketCapCol = (col: string) => typedHistory ? col : `SAFE_CAST(${col} AS FLOAT64) * 1000000`;
+
 // BigQuery returns all-lowercase column names. This type represents the raw row shape.
 interface BigQueryIndustryRow {
     name?: string; industry?: string; sector?: string; ticker?: string;
@@ -149,12 +156,12 @@ export const getIndustryPerformance = async (
             clean_data AS (
                 SELECT
                     industry, sector, ticker, processed_at,
-                    SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week,
-                    SAFE_CAST(REPLACE(performance_month, '%', '') AS FLOAT64) as pct_month,
-                    SAFE_CAST(REPLACE(performance_quarter, '%', '') AS FLOAT64) as pct_quarter,
-                    SAFE_CAST(REPLACE(change, '%', '') AS FLOAT64) as pct_change,
-                    SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-                    SAFE_CAST(market_cap AS FLOAT64) * 1000000 as mcap
+                    ${percentCol('performance_week')} as pct_week,
+                    ${percentCol('performance_month')} as pct_month,
+                    ${percentCol('performance_quarter')} as pct_quarter,
+                    ${percentCol('change')} as pct_change,
+                    ${numberCol('relative_strength_index_14')} as rsi,
+                    ${marketCapCol('market_cap')} as mcap
                 FROM latest_data
                 WHERE 1=1
                 ${sectorFilter ? `AND sector = @sectorFilter` : ''}
@@ -188,7 +195,7 @@ export const getIndustryPerformance = async (
                 ),
                 raw_stocks AS (
                     SELECT ${groupCol} as group_name, ticker,
-                        SAFE_CAST(REPLACE(performance_week, '%', '') AS FLOAT64) as pct_week
+                        ${percentCol('performance_week')} as pct_week
                     FROM ${rawTable}
                     WHERE ${snapshotId && snapshotId !== 'live' ? `CAST(processed_at AS STRING) = @snapshotId` : "is_current = 'yes'"}
                     ${sectorFilter && groupBy === 'industry' ? `AND sector = @sectorFilter` : ''}
@@ -296,8 +303,8 @@ export const getBollingerOversoldStocks = async (snapshotId?: string, rsiThresho
         HistoricalPrices AS (
             SELECT
                 h.ticker, h.company, h.sector, h.industry, h.processed_at, h.is_current, h.relative_strength_index_14 as rsi,
-                SAFE_CAST(h.price AS FLOAT64) as price_val,
-                SAFE_CAST(h.market_cap AS FLOAT64) * 1000000 as market_cap_val
+                ${numberCol('h.price')} as price_val,
+                ${marketCapCol('h.market_cap')} as market_cap_val
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\` h
             INNER JOIN RecentSnapshots rs ON h.processed_at = rs.processed_at
             WHERE h.ticker IS NOT NULL AND h.price IS NOT NULL
@@ -473,7 +480,7 @@ export const getBollingerBacktest = async (currentSnapshotId?: string, rsiThresh
         AllHistory AS (
             SELECT
                 h.ticker,
-                SAFE_CAST(h.price AS FLOAT64) as price_val,
+                ${numberCol('h.price')} as price_val,
                 h.processed_at
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\` h
             INNER JOIN RecentSnapshots rs ON h.processed_at = rs.processed_at
@@ -482,9 +489,9 @@ export const getBollingerBacktest = async (currentSnapshotId?: string, rsiThresh
         PrevSnapshot AS (
             SELECT
                 ticker, company, sector, industry,
-                SAFE_CAST(price AS FLOAT64) as price_val,
-                SAFE_CAST(relative_strength_index_14 AS FLOAT64) as rsi,
-                SAFE_CAST(market_cap AS FLOAT64) * 1000000 as market_cap_val
+                ${numberCol('price')} as price_val,
+                ${numberCol('relative_strength_index_14')} as rsi,
+                ${marketCapCol('market_cap')} as market_cap_val
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\`
             WHERE CAST(processed_at AS STRING) = @previousDate
               AND ticker IS NOT NULL AND price IS NOT NULL
@@ -515,9 +522,9 @@ export const getBollingerBacktest = async (currentSnapshotId?: string, rsiThresh
         CurrentSnapshot AS (
             SELECT
                 ticker,
-                SAFE_CAST(price AS FLOAT64) as currentPrice,
-                SAFE_CAST(relative_strength_index_14 AS FLOAT64) as currentRsi,
-                SAFE_CAST(market_cap AS FLOAT64) * 1000000 as market_cap_val
+                ${numberCol('price')} as currentPrice,
+                ${numberCol('relative_strength_index_14')} as currentRsi,
+                ${marketCapCol('market_cap')} as market_cap_val
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\`
             WHERE CAST(processed_at AS STRING) = @currentDate
               AND ticker IS NOT NULL AND price IS NOT NULL
@@ -675,9 +682,9 @@ export const getVolatileStocks = async (
             SELECT
                 h.ticker, h.company, h.sector, h.industry,
                 h.processed_at,
-                SAFE_CAST(REPLACE(h.change, '%', '') AS FLOAT64) as daily_change,
-                SAFE_CAST(h.price AS FLOAT64) as price,
-                SAFE_CAST(h.market_cap AS FLOAT64) * 1000000 as market_cap
+                ${percentCol('h.change')} as daily_change,
+                ${numberCol('h.price')} as price,
+                ${marketCapCol('h.market_cap')} as market_cap
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\` h
             INNER JOIN RecentTradingDays rtd ON h.processed_at = rtd.processed_at
             WHERE h.ticker IS NOT NULL AND h.price IS NOT NULL AND h.change IS NOT NULL
@@ -799,9 +806,9 @@ export const getVolatilityBacktest = async (
             SELECT
                 h.ticker, h.company, h.sector, h.industry,
                 h.processed_at,
-                SAFE_CAST(REPLACE(h.change, '%', '') AS FLOAT64) as daily_change,
-                SAFE_CAST(h.price AS FLOAT64) as price,
-                SAFE_CAST(h.market_cap AS FLOAT64) * 1000000 as market_cap
+                ${percentCol('h.change')} as daily_change,
+                ${numberCol('h.price')} as price,
+                ${marketCapCol('h.market_cap')} as market_cap
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\` h
             INNER JOIN SignalTradingDays std ON CAST(h.processed_at AS STRING) = std.snapshot_date
             WHERE h.ticker IS NOT NULL AND h.price IS NOT NULL AND h.change IS NOT NULL
@@ -825,7 +832,7 @@ export const getVolatilityBacktest = async (
         CurrentPrices AS (
             SELECT
                 ticker,
-                SAFE_CAST(price AS FLOAT64) as currentPrice
+                ${numberCol('price')} as currentPrice
             FROM \`${config.gcp.projectId}.stock_data.processed_stock_data_history\`
             WHERE CAST(processed_at AS STRING) = @currentDate
               AND ticker IS NOT NULL AND price IS NOT NULL
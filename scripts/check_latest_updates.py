@@ -1,7 +1,43 @@
+"""Freshness monitor of the ingest pipeline.
+
+Reads metadata only, so a check bills no query bytes and takes the same time however large history grows:
+
+- the one-row ingest watermark `<base>_ingest_watermark`, replaced by every ingest run (see
+  backend/ingest_watermark.py), is read with tabledata.list (free),
+- last-modified time and row count of the history, industry and sector tables and of the daily table
+  of the last snapshot come from tables.get (views resolve to their `_data` or `_fast` table).
+
+All lookups run concurrently. A check alerts if the last successful run (ingested or unchanged payload)
+is older than --max-age-hours, if the last run failed, or if a table was not written for the published
+snapshot. Without a watermark it falls back to the history table's last modification.
+
+TIMESTAMP columns are absolute. The watermark's DATETIME columns (processed_at, last_checked_at) have
+no time zone: they hold the ingest's local clock, which is UTC on Cloud Functions. They are read as
+--datetime-tz (default UTC); pass the ingest's zone if it runs elsewhere.
+
+Exit codes: 0 fresh, 1 stale, 2 a lookup failed. --watch re-checks every N seconds and exits with the
+code of the first alert:
+
+    python scripts/check_latest_updates.py
+    python scripts/check_latest_updates.py --max-age-hours 6 --watch 300
+"""
+import argparse
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
+OK, STALE, FAILED = 0, 1, 2
+# Logical tables checked besides the daily table: label -> suffix of the base table name
+TABLES = {'history': '_history', 'industry': '_industry_history', 'sector': '_sector_history'}
+WATERMARK_SUFFIX = '_ingest_watermark'
+
 def get_credentials():
     env_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env.local')
     env_vars = {}
@@ -30,26 +66,111 @@ def get_credentials():
     
     return project_id, credentials
 
-def check_updates():
-    project_id, credentials = get_credentials()
-    client = bigquery.Client(project=project_id, credentials=credentials)
-    
-    tables = [
-        "stock_data.processed_stock_data",
-        "stock_data.processed_stock_data_history",
-        "stock_data.processed_stock_data_industry_history",
-        "stock_data.processed_stock_data_sector_history"
-    ]
-    
-    print("Checking latest updates for BigQuery tables...")
-    for table in tables:
+def _utc(value, naive_tz=timezone.utc):
+    """Aware UTC datetime of a TIMESTAMP (aware) value, or of a DATETIME (naive) value in `naive_tz`."""
+    if value is None:
+        return None
+    return (value.replace(tzinfo=naive_tz) if value.tzinfo is None else value).astimezone(timezone.utc)
+
+def _age(value, now):
+    hours = (now - value).total_seconds() / 3600
+    return f"{hours:.1f}h ago" if hours >= 1 else f"{hours * 60:.0f}m ago"
+
+def table_metadata(client, table_id):
+    """Metadata of table_id, or of the physical table behind it if it is a view (the `_data` table of
+    the snapshot-pointer layout, the `_fast` table of delta history)."""
+    for candidate in [table_id, f"{table_id}_data", f"{table_id}_fast"]:
+        try:
+            table = client.get_table(candidate)
+        except NotFound:
+            continue
+        if table.table_type != 'VIEW':
+            return table
+    raise LookupError(f"No table behind {table_id}")
+
+def read_watermark(client, table_id, datetime_tz=timezone.utc):
+    """The watermark row as a dict with aware UTC datetimes, or None if the table does not exist yet. The
+    column types come from the table schema: DATETIME values are read in `datetime_tz`."""
+    try:
+        rows = client.list_rows(table_id, max_results=1)
+        row = next(iter(rows), None)
+    except NotFound:
+        return None
+    if row is None:
+        return None
+    types = {field.name: field.field_type for field in rows.schema}
+    return {key: _utc(value, datetime_tz) if types.get(key) in ('TIMESTAMP', 'DATETIME') else value
+            for key, value in dict(row).items()}
+
+def check_updates(client, prefix, max_age_hours, datetime_tz=timezone.utc):
+    """Runs one check. Returns (exit code, report lines)."""
+    now = datetime.now(timezone.utc)
+    lines, code = [], OK
+    with ThreadPoolExecutor(max_workers=len(TABLES) + 2) as executor:
+        watermark_future = executor.submit(read_watermark, client, f"{prefix}{WATERMARK_SUFFIX}", datetime_tz)
+        futures = {label: executor.submit(table_metadata, client, f"{prefix}{suffix}") for label, suffix in TABLES.items()}
         try:
-            query = f"SELECT MAX(processed_at) as latest_update FROM `{project_id}.{table}`"
-            results = client.query(query).result()
-            for row in results:
-                print(f"Table {table}: {row.latest_update}")
+            watermark = watermark_future.result()
         except Exception as e:
-            print(f"Error checking {table}: {e}")
+            lines.append(f"ERROR reading the watermark: {e}")
+            watermark, code = None, FAILED
+        snapshot_at = watermark.get('processed_at') if watermark else None
+        if snapshot_at is not None:
+            futures['daily'] = executor.submit(table_metadata, client, f"{prefix}_{snapshot_at.strftime('%Y%m%d')}")
+        tables = {}
+        for label, future in futures.items():
+            try:
+                tables[label] = future.result()
+            except Exception as e:
+                lines.append(f"ERROR {label}: {e}")
+                code = FAILED
+
+    if watermark:
+        last_ok = watermark.get('last_checked_at')
+        lines.append(f"Last run: {watermark['status']} ({watermark['run_name']}) in {watermark['duration_s']:.1f}s, "
+                     f"finished {_age(watermark['finished_at'], now)}")
+        lines.append(f"Snapshot: {watermark['snapshot_id']} ({watermark['snapshot_rows']} rows), "
+                     f"last successful run {_age(last_ok, now) if last_ok else 'never'}")
+        if watermark['status'] == 'error':
+            lines.append(f"ALERT last run failed: {watermark['error']}")
+            code = max(code, STALE)
+    else:
+        lines.append("No ingest watermark; judging freshness by the history table's last modification.")
+        last_ok = _utc(tables['history'].modified) if 'history' in tables else None
+    if last_ok is None or (now - last_ok).total_seconds() > max_age_hours * 3600:
+        lines.append(f"ALERT no successful run in the last {max_age_hours:g}h")
+        code = max(code, STALE)
+
+    for label, table in tables.items():
+        modified = _utc(table.modified)
+        lines.append(f"{label:<9} {table.table_id:<45} modified {_age(modified, now):<10} {table.num_rows or 0:>12,} rows")
+        if snapshot_at is not None and modified < snapshot_at:
+            lines.append(f"ALERT {table.table_id} was not written for snapshot {watermark['snapshot_id']}")
+            code = max(code, STALE)
+    return code, lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default='stock_data')
+    parser.add_argument('--base-table', default='processed_stock_data')
+    parser.add_argument('--max-age-hours', type=float, default=26, help="alert if the last successful run is older")
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help="re-check every SECONDS until an alert")
+    parser.add_argument('--datetime-tz', type=ZoneInfo, default=timezone.utc, metavar='ZONE',
+                        help="time zone of the watermark's DATETIME columns, i.e. the ingest's local clock "
+                             "(default UTC, as on Cloud Functions)")
+    args = parser.parse_args()
+
+    project_id, credentials = get_credentials()
+    client = bigquery.Client(project=project_id, credentials=credentials)
+    prefix = f"{project_id}.{args.dataset}.{args.base_table}"
+    while True:
+        code, lines = check_updates(client, prefix, args.max_age_hours, args.datetime_tz)
+        status = {OK: 'OK', STALE: 'STALE', FAILED: 'FAILED'}[code]
+        print(f"[{datetime.now(timezone.utc):%Y-%m-%d %H:%M:%S}Z] {status}")
+        print('\n'.join(f"  {line}" for line in lines), flush=True)
+        if code != OK or not args.watch:
+            return code
+        time.sleep(args.watch)
 
 if __name__ == '__main__':
-    check_updates()
+    sys.exit(main())